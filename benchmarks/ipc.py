@@ -0,0 +1,112 @@
+"""
+Throughput of passing batches of game states to a worker process and results back, with the states pickled into the
+task and the results pickled back, against encoded with GameState.encode into a SharedStateBatch that the worker
+decodes from and writes its results into. The worker does next to nothing with each state, so the rates are those
+of the transport.
+
+Run from the repository root with:
+    python -m benchmarks.ipc [--batches 200] [--batch-size 64] [--output results.json]
+"""
+import argparse
+import json
+import multiprocessing
+import pickle
+import random
+import sys
+import time
+
+import chess
+
+import game_playing_agents as gpa
+from game_playing_agents.shared_batch import attached_batch
+from tests.chess_tests import ChessGameState
+from tests.tic_tac_toe_tests import TicTacToeGameState
+
+
+def random_positions(make_state, count: int, max_moves: int, seed: int = 0) -> list[gpa.GameState]:
+    """
+    :return: positions reached by up to max_moves random actions, chess boards keep their move stacks
+    """
+    rng = random.Random(seed)
+    positions = []
+    for _ in range(count):
+        state = make_state()
+        for _ in range(rng.randrange(max_moves)):
+            if state.is_terminal:
+                break
+            state = state.get_next_state(rng.choice(state.legal_actions))
+        positions.append(state)
+    return positions
+
+
+def result_of(state: gpa.GameState, players: tuple) -> dict[str, float]:
+    return {player: float(player == state.active_player) for player in players}
+
+
+def pickled_worker(states: list, players: tuple) -> list[dict[str, float]]:
+    return [result_of(state, players) for state in states]
+
+
+def shared_worker(name: str, state_type: type, count: int):
+    shared_batch = attached_batch(name)
+    for index in range(count):
+        shared_batch.write_result(index, result_of(shared_batch.state(index, state_type), shared_batch.players))
+
+
+def measure(pool, positions: list, players: tuple, batches: int, batch_size: int) -> dict:
+    rng = random.Random(0)
+    work = [rng.sample(positions, batch_size) for _ in range(batches)]
+
+    start = time.perf_counter()
+    for states in work:
+        pool.apply(pickled_worker, (states, players))
+    pickled_seconds = time.perf_counter() - start
+
+    state_type = type(positions[0])
+    data_size = batch_size * max(len(state.encode()) for state in positions)
+    with gpa.SharedStateBatch(batch_size, data_size, players) as shared_batch:
+        start = time.perf_counter()
+        for states in work:
+            shared_batch.write_states(states)
+            pool.apply(shared_worker, (shared_batch.name, state_type, len(states)))
+            [shared_batch.result(index) for index in range(len(states))]
+        shared_seconds = time.perf_counter() - start
+
+    states = batches * batch_size
+    return {
+        'pickled_bytes_per_state': sum(len(pickle.dumps(state)) for state in positions) / len(positions),
+        'encoded_bytes_per_state': sum(len(state.encode()) for state in positions) / len(positions),
+        'pickled_states_per_second': states / pickled_seconds,
+        'shared_states_per_second': states / shared_seconds,
+    }
+
+
+def main(arguments: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--batches', type=int, default=200)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--output', help="write the results to this file instead of stdout")
+    arguments = parser.parse_args(arguments)
+
+    games = {
+        'tic-tac-toe 5x5': (random_positions(lambda: TicTacToeGameState(5), 256, 20), ("X", "O")),
+        'chess': (random_positions(lambda: ChessGameState(chess.Board()), 256, 120), ("white", "black")),
+    }
+    results = {}
+    with multiprocessing.Pool(1) as pool:
+        for name, (positions, players) in games.items():
+            results[name] = measure(pool, positions, players, arguments.batches, arguments.batch_size)
+            print(name, results[name], file=sys.stderr)
+
+    text = json.dumps({'batches': arguments.batches, 'batch_size': arguments.batch_size, 'results': results},
+                      indent=2)
+    if arguments.output:
+        with open(arguments.output, 'w') as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,52 @@
+"""
+Nodes per second of MiniMaxAgent on the chess test state.
+
+The deep searches measure the cost of the search itself, the shallow search from a board with a long move
+stack measures the per move overhead of preparing the root.
+
+Run from the repository root with: python -m benchmarks.minimax_nps [depth]
+"""
+import random
+import sys
+import time
+
+import chess
+
+import game_playing_agents as gpa
+from benchmarks.move_ordering import POSITIONS
+from tests.chess_tests import ChessGameState
+
+
+def played_board(plies: int, seed: int = 0) -> chess.Board:
+    """
+    :return: a board reached by random moves, keeping the whole move stack
+    """
+    rng = random.Random(seed)
+    board = chess.Board()
+    while len(board.move_stack) < plies and not board.is_game_over():
+        board.push(rng.choice(list(board.legal_moves)))
+    return board
+
+
+def nodes_per_second(board: chess.Board, depth: int, repeats: int = 1):
+    agent = gpa.MiniMaxAgent(ChessGameState(board), depth)
+    nodes = 0
+    start = time.perf_counter()
+    for _ in range(repeats):
+        agent.get_next_action()
+        nodes += agent.nodes_searched
+    elapsed = time.perf_counter() - start
+    return nodes, elapsed
+
+
+def main(depth: int = 4):
+    print(f"{'position':<16}{'depth':>6}{'nodes':>10}{'seconds':>10}{'nodes/sec':>12}")
+    scenarios = [(name, chess.Board(fen), depth, 1) for name, fen in POSITIONS.items()]
+    scenarios.append(('200 plies', played_board(200, seed=3), 1, 50))
+    for name, board, search_depth, repeats in scenarios:
+        nodes, elapsed = nodes_per_second(board, search_depth, repeats)
+        print(f"{name:<16}{search_depth:>6}{nodes:>10}{elapsed:>10.2f}{nodes / elapsed:>12.0f}")
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
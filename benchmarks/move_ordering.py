@@ -0,0 +1,35 @@
+"""
+Nodes searched per move by MiniMaxAgent with and without move ordering on the chess test state.
+
+Run from the repository root with: python -m benchmarks.move_ordering
+"""
+import sys
+
+import chess
+
+import game_playing_agents as gpa
+from tests.chess_tests import ChessGameState
+
+POSITIONS = {
+    'opening': chess.STARTING_FEN,
+    'two knights': "r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4",
+    'queens gambit': "r2q1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N1PN2/PP2BPPP/R2Q1RK1 w - - 0 10",
+}
+
+
+def nodes_searched(fen: str, depth: int, move_ordering: list) -> int:
+    agent = gpa.MiniMaxAgent(ChessGameState(chess.Board(fen)), depth, move_ordering=move_ordering)
+    agent.get_next_action()
+    return agent.nodes_searched
+
+
+def main(depth: int = 4):
+    print(f"{'position':<16}{'unordered':>12}{'ordered':>12}{'ratio':>8}")
+    for name, fen in POSITIONS.items():
+        unordered = nodes_searched(fen, depth, None)
+        ordered = nodes_searched(fen, depth, gpa.default_move_ordering())
+        print(f"{name:<16}{unordered:>12}{ordered:>12}{unordered / ordered:>8.1f}")
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,80 @@
+"""
+Play strength of MonteCarloAgent with and without RAVE at a range of rollout budgets, measured as the fraction of
+tic-tac-toe positions in which the agent chooses a move that SolverAgent proves optimal. Only positions where some
+moves are worse than others are used, and every agent is seeded, so the results are deterministic.
+
+Run from the repository root with:
+    python -m benchmarks.rave [--dimensions 4] [--positions 100] [--rollouts 100,200,400] [--output results.json]
+"""
+import argparse
+import json
+import random
+import sys
+import time
+
+import game_playing_agents as gpa
+from tests.tic_tac_toe_tests import TicTacToeGameState
+
+
+def scored_positions(dimensions: int, count: int, seed: int = 0) -> list[tuple[TicTacToeGameState, list]]:
+    """
+    :return: random positions that are not over, each with its optimal actions, at least one action is not optimal
+    """
+    rng = random.Random(seed)
+    solver = gpa.SolverAgent(TicTacToeGameState(dimensions))
+    positions = []
+    while len(positions) < count:
+        state = TicTacToeGameState(dimensions)
+        for _ in range(rng.randrange(2, dimensions ** 2 - 4)):
+            if state.is_terminal:
+                break
+            state = state.get_next_state(rng.choice(state.legal_actions))
+        if state.is_terminal:
+            continue
+        # the opponent moves next, so the value of each action is the negated value of the state it reaches
+        values = {action: -solver.value(state.get_next_state(action)) for action in state.legal_actions}
+        best = max(values.values())
+        optimal = [action for action, value in values.items() if value == best]
+        if len(optimal) < len(values):
+            positions.append((state, optimal))
+    return positions
+
+
+def accuracy(positions: list, rollouts: int, rave: bool) -> dict:
+    start = time.perf_counter()
+    correct = 0
+    for seed, (state, optimal) in enumerate(positions):
+        agent = gpa.MonteCarloAgent(state, rollouts, seed=seed, rave=rave)
+        correct += agent.get_next_action() in optimal
+    seconds = time.perf_counter() - start
+    return {'rollouts': rollouts, 'rave': rave, 'accuracy': correct / len(positions),
+            'seconds_per_move': seconds / len(positions)}
+
+
+def main(arguments: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--dimensions', type=int, default=4)
+    parser.add_argument('--positions', type=int, default=100)
+    parser.add_argument('--rollouts', default='100,200,400', help="comma separated rollout budgets")
+    parser.add_argument('--output', help="write the results to this file instead of stdout")
+    arguments = parser.parse_args(arguments)
+
+    positions = scored_positions(arguments.dimensions, arguments.positions)
+    results = []
+    for rollouts in map(int, arguments.rollouts.split(',')):
+        for rave in (False, True):
+            results.append(accuracy(positions, rollouts, rave))
+            print(results[-1], file=sys.stderr)
+
+    text = json.dumps({'dimensions': arguments.dimensions, 'positions': len(positions), 'results': results},
+                      indent=2)
+    if arguments.output:
+        with open(arguments.output, 'w') as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,38 @@
+"""
+Rollouts per second of MonteCarloAgent on the tic-tac-toe and chess test states, with and without simulating
+batches of games in lockstep through the vectorized tic-tac-toe state.
+
+Run from the repository root with: python -m benchmarks.rollouts
+"""
+import time
+
+import chess
+
+import game_playing_agents as gpa
+from tests.chess_tests import ChessGameState
+from tests.tic_tac_toe_tests import TicTacToeGameState
+
+SCENARIOS = {
+    'tic-tac-toe 3x3': (lambda: TicTacToeGameState(), 2000, None),
+    'tic-tac-toe 3x3 x64': (lambda: TicTacToeGameState(), 2000 * 64, 64),
+    'tic-tac-toe 5x5': (lambda: TicTacToeGameState(5), 500, None),
+    'tic-tac-toe 5x5 x64': (lambda: TicTacToeGameState(5), 500 * 64, 64),
+    'chess opening': (lambda: ChessGameState(chess.Board()), 20, None),
+}
+
+
+def rollouts_per_second(make_state, rollouts: int, batch_size: int = None, seed: int = 0) -> float:
+    agent = gpa.MonteCarloAgent(make_state(), rollouts, seed=seed, batch_size=batch_size)
+    start = time.perf_counter()
+    agent.get_next_action()
+    return rollouts / (time.perf_counter() - start)
+
+
+def main():
+    print(f"{'scenario':<20}{'rollouts':>10}{'rollouts/sec':>14}")
+    for name, (make_state, rollouts, batch_size) in SCENARIOS.items():
+        print(f"{name:<20}{rollouts:>10}{rollouts_per_second(make_state, rollouts, batch_size):>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+"""
+Fixed seed benchmark scenarios for every agent on the tic-tac-toe and chess test states, written as JSON so runs
+from different commits can be diffed.
+
+Counters such as nodes searched and the action chosen are deterministic and should only change with the search,
+rates such as nodes per second are timings and are compared with a tolerance.
+
+Run from the repository root with:
+    python -m benchmarks.suite [--filter text] [--repeat n] [--output results.json]
+    python -m benchmarks.suite --compare baseline.json [--tolerance 0.1] [--output results.json]
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+
+import chess
+
+import game_playing_agents as gpa
+from tests.chess_tests import ChessGameState
+from tests.tic_tac_toe_tests import TicTacToeGameState
+
+CHESS_POSITIONS = {
+    'opening': chess.STARTING_FEN,
+    'middlegame': "r2q1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N1PN2/PP2BPPP/R2Q1RK1 w - - 0 10",
+    'endgame': "8/5pk1/6p1/8/3R4/6P1/5PK1/2r5 w - - 0 40",
+}
+
+
+# short scenarios are repeated until they have run for at least this many seconds in total
+MIN_SECONDS = 0.5
+
+
+def timed(run, repeat: int) -> tuple[any, float]:
+    """
+    :param repeat: the least number of runs
+    :return: the result of the last run and the fastest of the runs in seconds
+    """
+    best = float('inf')
+    total = 0.0
+    runs = 0
+    result = None
+    while runs < repeat or total < MIN_SECONDS:
+        random.seed(0)
+        start = time.perf_counter()
+        result = run()
+        elapsed = time.perf_counter() - start
+        best = min(best, elapsed)
+        total += elapsed
+        runs += 1
+    return result, best
+
+
+def minimax_scenario(make_state, depth: int, move_ordering: bool = False, batch_leaves: bool = False):
+    def run(repeat: int) -> dict:
+        def search():
+            agent = gpa.MiniMaxAgent(make_state(), depth,
+                                     move_ordering=gpa.default_move_ordering() if move_ordering else None,
+                                     batch_leaves=batch_leaves)
+            return agent.get_next_action(), agent.nodes_searched
+
+        (action, nodes), seconds = timed(search, repeat)
+        return {'action': str(action), 'nodes': nodes, 'seconds': seconds, 'nodes_per_second': nodes / seconds}
+    return run
+
+
+def monte_carlo_scenario(make_state, rollouts: int, max_rollout_depth: int = None, batch_size: int = None,
+                         rave: bool = False):
+    def run(repeat: int) -> dict:
+        def search():
+            agent = gpa.MonteCarloAgent(make_state(), rollouts, seed=0, max_rollout_depth=max_rollout_depth,
+                                        batch_size=batch_size, rave=rave)
+            return agent.get_next_action()
+
+        action, seconds = timed(search, repeat)
+        return {'action': str(action), 'rollouts': rollouts, 'seconds': seconds,
+                'rollouts_per_second': rollouts / seconds}
+    return run
+
+
+def solver_scenario(make_state):
+    def run(repeat: int) -> dict:
+        def solve():
+            agent = gpa.SolverAgent(make_state())
+            return agent.get_next_action(), agent.nodes_searched, len(agent.table)
+
+        (action, nodes, positions), seconds = timed(solve, repeat)
+        return {'action': str(action), 'nodes': nodes, 'positions': positions, 'seconds': seconds,
+                'nodes_per_second': nodes / seconds}
+    return run
+
+
+def move_time_scenario(agent_class, make_state, moves: int):
+    def run(repeat: int) -> dict:
+        def choose():
+            agent = agent_class(make_state())
+            return [agent.get_next_action() for _ in range(moves)][-1]
+
+        action, seconds = timed(choose, repeat)
+        return {'action': str(action), 'moves': moves, 'seconds_per_move': seconds / moves,
+                'moves_per_second': moves / seconds}
+    return run
+
+
+def chess_state(fen: str):
+    return lambda: ChessGameState(chess.Board(fen))
+
+
+def scenarios() -> dict:
+    """
+    :return: the run function of every scenario by name, each takes the number of times to repeat the measurement
+    """
+    tic_tac_toe = {'3x3': lambda: TicTacToeGameState(), '4x4': lambda: TicTacToeGameState(4),
+                   '5x5': lambda: TicTacToeGameState(5)}
+    chess_positions = {name: chess_state(fen) for name, fen in CHESS_POSITIONS.items()}
+    suite = {
+        'minimax/tic-tac-toe/3x3/depth-9': minimax_scenario(tic_tac_toe['3x3'], 9),
+        'minimax/tic-tac-toe/4x4/depth-5': minimax_scenario(tic_tac_toe['4x4'], 5),
+        'minimax/tic-tac-toe/4x4/depth-5/ordered': minimax_scenario(tic_tac_toe['4x4'], 5, move_ordering=True),
+        'minimax/tic-tac-toe/4x4/depth-5/batched': minimax_scenario(tic_tac_toe['4x4'], 5, batch_leaves=True),
+        'solver/tic-tac-toe/3x3': solver_scenario(tic_tac_toe['3x3']),
+        'solver/tic-tac-toe/4x4': solver_scenario(tic_tac_toe['4x4']),
+        'monte-carlo/tic-tac-toe/3x3/rollouts-2000': monte_carlo_scenario(tic_tac_toe['3x3'], 2000),
+        'monte-carlo/tic-tac-toe/5x5/rollouts-500': monte_carlo_scenario(tic_tac_toe['5x5'], 500),
+        'monte-carlo/tic-tac-toe/5x5/rollouts-500/rave': monte_carlo_scenario(tic_tac_toe['5x5'], 500, rave=True),
+        'monte-carlo/tic-tac-toe/5x5/rollouts-6400/batch-64':
+            monte_carlo_scenario(tic_tac_toe['5x5'], 6400, batch_size=64),
+        'simple-max/tic-tac-toe/5x5': move_time_scenario(gpa.SimpleMaxAgent, tic_tac_toe['5x5'], 200),
+        'random/tic-tac-toe/5x5': move_time_scenario(gpa.RandomAgent, tic_tac_toe['5x5'], 2000),
+    }
+    for name, make_state in chess_positions.items():
+        suite[f'minimax/chess/{name}/depth-2'] = minimax_scenario(make_state, 2)
+        suite[f'minimax/chess/{name}/depth-3'] = minimax_scenario(make_state, 3)
+        suite[f'minimax/chess/{name}/depth-4/ordered'] = minimax_scenario(make_state, 4, move_ordering=True)
+        suite[f'minimax/chess/{name}/depth-4/ordered/batched'] = minimax_scenario(make_state, 4, move_ordering=True,
+                                                                                  batch_leaves=True)
+        suite[f'monte-carlo/chess/{name}/rollouts-200'] = monte_carlo_scenario(make_state, 200, max_rollout_depth=20)
+        suite[f'monte-carlo/chess/{name}/rollouts-200/rave'] = monte_carlo_scenario(make_state, 200,
+                                                                                   max_rollout_depth=20, rave=True)
+        suite[f'simple-max/chess/{name}'] = move_time_scenario(gpa.SimpleMaxAgent, make_state, 20)
+        suite[f'random/chess/{name}'] = move_time_scenario(gpa.RandomAgent, make_state, 200)
+    return suite
+
+
+def run_suite(name_filter: str = None, repeat: int = 3) -> dict:
+    results = {}
+    for name, run in scenarios().items():
+        if name_filter is None or name_filter in name:
+            results[name] = run(repeat)
+            print(name, file=sys.stderr)
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def compare(baseline: dict, current: dict, tolerance: float = 0.1) -> list[str]:
+    """
+    :param tolerance: the fraction a rate may fall by before it counts as a regression
+    :return: a line for every regressed rate and every changed counter of the scenarios in both runs
+    """
+    problems = []
+    for name, metrics in current['results'].items():
+        old_metrics = baseline['results'].get(name)
+        if old_metrics is None:
+            continue
+        for metric, value in metrics.items():
+            old_value = old_metrics.get(metric)
+            if old_value is None:
+                continue
+            if metric.endswith('_per_second'):
+                if value < old_value * (1 - tolerance):
+                    problems.append(f"{name} {metric}: {old_value:.1f} -> {value:.1f} "
+                                    f"({value / old_value - 1:+.0%})")
+            elif not metric.startswith('seconds') and value != old_value:
+                problems.append(f"{name} {metric}: {old_value} -> {value}")
+    return problems
+
+
+def main(arguments: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--filter', help="only run scenarios whose name contains this")
+    parser.add_argument('--repeat', type=int, default=3, help="report the fastest of at least this many runs")
+    parser.add_argument('--output', help="write the results to this file instead of stdout")
+    parser.add_argument('--compare', help="the results of an earlier run to check for regressions against")
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    arguments = parser.parse_args(arguments)
+
+    current = run_suite(arguments.filter, arguments.repeat)
+    text = json.dumps(current, indent=2, sort_keys=True)
+    if arguments.output:
+        with open(arguments.output, 'w') as file:
+            file.write(text + "\n")
+    elif not arguments.compare:
+        print(text)
+
+    if arguments.compare:
+        with open(arguments.compare) as file:
+            problems = compare(json.load(file), current, arguments.tolerance)
+        for problem in problems:
+            print(problem)
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
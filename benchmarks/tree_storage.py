@@ -0,0 +1,50 @@
+"""
+Memory and throughput of MonteCarloAgent with MonteCarloNode objects versus the array backed CompactTree, each also
+bounded to a node budget with interior states dropped.
+
+Run from the repository root with: python -m benchmarks.tree_storage [rollouts]
+"""
+import sys
+import time
+import tracemalloc
+
+import chess
+
+import game_playing_agents as gpa
+from tests.chess_tests import ChessGameState
+from tests.tic_tac_toe_tests import TicTacToeGameState
+
+SCENARIOS = {
+    'tic-tac-toe 5x5': (lambda: TicTacToeGameState(5), None),
+    'chess opening': (lambda: ChessGameState(chess.Board()), 10),
+}
+MAX_NODES = 1000
+TREES = {
+    'object': {},
+    'compact': {'compact_tree': True},
+    'object/1k': {'max_nodes': MAX_NODES, 'keep_states': False},
+    'compact/1k': {'compact_tree': True, 'max_nodes': MAX_NODES, 'keep_states': False},
+}
+
+
+def measure(make_state, max_rollout_depth: int, rollouts: int, options: dict):
+    agent = gpa.MonteCarloAgent(make_state(), rollouts, seed=0, max_rollout_depth=max_rollout_depth, **options)
+    tracemalloc.start()
+    start = time.perf_counter()
+    agent.get_next_action()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return rollouts / elapsed, agent.peak_tree_size, peak
+
+
+def main(rollouts: int = 5000):
+    print(f"{'scenario':<18}{'tree':<12}{'rollouts/sec':>14}{'nodes':>10}{'peak KiB':>10}{'bytes/node':>12}")
+    for name, (make_state, max_rollout_depth) in SCENARIOS.items():
+        for tree, options in TREES.items():
+            rate, nodes, peak = measure(make_state, max_rollout_depth, rollouts, options)
+            print(f"{name:<18}{tree:<12}{rate:>14.1f}{nodes:>10}{peak / 1024:>10.0f}{peak / nodes:>12.0f}")
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
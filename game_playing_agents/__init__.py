@@ -1,6 +1,17 @@
-from .state import GameState
-from .game_agent import GameAgent
+from .state import GameState, CachedGameState, EvaluationCache, cached_state_property, clear_state_cache
+from .batch_state import BatchGameState
+from .game_agent import GameAgent, search_executor, set_search_executor
+from .instrumentation import SearchStats, TimedState
 from .random_agent import RandomAgent
 from .simple_max_agent import SimpleMaxAgent
 from .minimax_agent import MiniMaxAgent
 from .monte_carlo_agent import MonteCarloAgent
+from .book_agent import BookAgent
+from .solver_agent import SolverAgent, write_solved_table, read_solved_table
+from .compact_tree import CompactTree
+from .shared_batch import SharedStateBatch
+from .transposition_table import TranspositionTable
+from .zobrist import ZobristHasher
+from .tournament import play_game, run_match, MatchSummary
+from .opening_book import OpeningBook, write_book, self_play_entries, solved_entries
+from .move_ordering import MoveOrderer, StatePriorityOrderer, KillerMoveOrderer, HistoryOrderer, default_move_ordering
@@ -0,0 +1,66 @@
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+
+class BatchGameState(ABC):
+    """
+    A batch of independent games of the same kind held in NumPy arrays and advanced in lockstep.
+    Actions are indices into a fixed action space shared by every game in the batch.
+    """
+
+    @property
+    @abstractmethod
+    def players(self) -> list[str]:
+        """
+        :return: the players in the order of the columns of utility
+        """
+        ...
+
+    @property
+    @abstractmethod
+    def size(self) -> int:
+        """
+        :return: the number of games in the batch
+        """
+        ...
+
+    @abstractmethod
+    def legal_action_mask(self) -> np.ndarray:
+        """
+        :return: a (size, actions) boolean array, True where an action is legal in a game, all False in finished games
+        """
+        ...
+
+    @abstractmethod
+    def step(self, actions: np.ndarray):
+        """
+        Take one action in every unfinished game, in place
+        param actions: a (size,) integer array of action indices, the actions of finished games are ignored
+        """
+        ...
+
+    @property
+    @abstractmethod
+    def is_terminal(self) -> np.ndarray:
+        """
+        :return: a (size,) boolean array, True where the game is over
+        """
+        ...
+
+    @property
+    @abstractmethod
+    def utility(self) -> np.ndarray:
+        """
+        :return: a (size, players) array of utility values, as GameState.utility for each game
+        """
+        ...
+
+    def random_actions(self, rng: np.random.Generator) -> np.ndarray:
+        """
+        :return: a uniformly random legal action for every game, 0 for finished games
+        """
+        mask = self.legal_action_mask()
+        keys = rng.random(mask.shape)
+        keys[~mask] = -1
+        return keys.argmax(axis=1)
@@ -0,0 +1,48 @@
+from .state import GameState
+from .game_agent import GameAgent
+from .opening_book import OpeningBook
+import inspect
+import threading
+
+
+class BookAgent(GameAgent):
+    """Plays the book action in positions an opening book holds, and lets another agent search everywhere else"""
+
+    def __init__(self, agent: GameAgent, book: OpeningBook):
+        """
+        :param agent: the agent to search positions that are not in the book
+        """
+        self.agent = agent
+        super().__init__(agent.current_state, agent.player)
+        self.book = book
+        self.book_moves = 0
+
+    def get_next_action(self):
+        action = self.book.lookup(self.current_state)
+        if action is not None:
+            self.book_moves += 1
+            return action
+        return self.agent.get_next_action()
+
+    def update_state(self, new_state: GameState, actions: list = None):
+        """
+        :param actions: optionally, the actions taken since the last move, passed on if the searching agent takes them
+        """
+        super().update_state(new_state)
+        if actions is not None and 'actions' in inspect.signature(self.agent.update_state).parameters:
+            self.agent.update_state(new_state, actions)
+        else:
+            self.agent.update_state(new_state)
+
+    @property
+    def stop_event(self) -> threading.Event:
+        # shared with the searching agent, which checks its own
+        return self.agent.stop_event
+
+    @stop_event.setter
+    def stop_event(self, stop_event: threading.Event):
+        self.agent.stop_event = stop_event
+
+    def close(self):
+        if hasattr(self.agent, 'close'):
+            self.agent.close()
@@ -0,0 +1,394 @@
+from .state import GameState
+from .simulation import random_simulation, batch_random_simulation
+
+from typing import Sequence
+import math
+import random
+
+import numpy as np
+
+DEFAULT_EXPLORATION = math.sqrt(2)
+# a tree over its node budget is pruned down to this fraction of the budget, so pruning is not needed every rollout
+PRUNE_TARGET = 0.75
+
+
+def nodes_to_prune(parents: Sequence[int], visits: Sequence[int], expanded: Sequence[bool], max_nodes: int) \
+        -> list[int]:
+    """
+    Choose the subtrees to cut off a tree to bring it down to a number of nodes, those of the least visited nodes first
+    :param parents: the parent of every node, nodes come after their parents and the root is node 0
+    :param visits: the visits of every node
+    :param expanded: whether every node has children
+    :return: the nodes to remove all the descendants of, the root's children are never removed
+    """
+    count = len(parents)
+    sizes = [1] * count
+    for index in range(count - 1, 0, -1):
+        sizes[parents[index]] += sizes[index]
+    excess = count - max_nodes
+    pruned = []
+    cut = set()
+    # a node has no more visits than its parent, so among equally visited nodes the deeper ones are cut first
+    for index in sorted((index for index in range(1, count) if expanded[index]),
+                        key=lambda index: (visits[index], -index)):
+        if excess <= 0:
+            break
+        ancestor = parents[index]
+        while ancestor > 0 and ancestor not in cut:
+            ancestor = parents[ancestor]
+        if ancestor > 0:
+            # already removed along with an ancestor
+            continue
+        freed = sizes[index] - 1
+        cut.add(index)
+        pruned.append(index)
+        excess -= freed
+        ancestor = parents[index]
+        while ancestor >= 0:
+            sizes[ancestor] -= freed
+            ancestor = parents[ancestor]
+    return pruned
+
+
+class CompactTree:
+    """
+    Monte Carlo search tree kept in flat arrays instead of one object per node.
+    All children of a node are allocated together when it is expanded, so they occupy a contiguous range of
+    indices and their UCB scores are computed in one vectorized step. Child states are only created when the
+    child is first visited.
+    """
+
+    def __init__(self, root_state: GameState, player: str, rng: random.Random = None, capacity: int = 1024,
+                 exploration: float = DEFAULT_EXPLORATION, keep_states: bool = True):
+        """
+        :param keep_states: keep the state of every node, otherwise the state of a node is dropped once all of its
+                            children have been visited, and rebuilt from its parent's if it is needed again
+        """
+        self.player = player
+        self.keep_states = keep_states
+        self.rng = rng if rng is not None else random
+        self.exploration = exploration
+        self.capacity = capacity
+        self.visits = np.zeros(capacity, dtype=np.int64)
+        self.values = np.zeros(capacity, dtype=np.float64)
+        self.parents = np.full(capacity, -1, dtype=np.int64)
+        # first_child is -1 until a node is expanded, child_count is 0 for expanded terminal nodes
+        self.first_child = np.full(capacity, -1, dtype=np.int64)
+        self.child_count = np.zeros(capacity, dtype=np.int64)
+        self.visited_children = np.zeros(capacity, dtype=np.int64)
+        self.actions = [None] * capacity  # type: list
+        # values are stored from the perspective of the player who chose each node's action
+        self.movers = [None] * capacity  # type: list[str]
+        self.states = [None] * capacity  # type: list[GameState]
+        self.states[0] = root_state
+        self.size = 1
+        self.peak_size = 1
+
+    @property
+    def root(self) -> 'CompactNode':
+        return CompactNode(self, 0)
+
+    def state_of(self, index: int) -> GameState:
+        """
+        :return: the state of a node, created from its parent's state on first use
+        """
+        state = self.states[index]
+        if state is None:
+            state = self.state_of(int(self.parents[index])).get_next_state(self.actions[index])
+            self.states[index] = state
+        return state
+
+    def children_of(self, index: int) -> range:
+        start = int(self.first_child[index])
+        if start < 0:
+            return range(0)
+        return range(start, start + int(self.child_count[index]))
+
+    def rollout(self, index: int = 0, max_rollout_depth: int = None, batch_size: int = None):
+        """
+        Run one selection, expansion, simulation and backpropagation from a node
+        :param batch_size: simulate this many games in lockstep with the state's to_batch instead of one
+        """
+        # Selection
+        selected = self.select(index)
+        # Expansion
+        expanded = self.expand(selected)
+        # Simulation
+        if batch_size is not None:
+            simulation_result = batch_random_simulation(self.state_of(expanded), batch_size, self.rng,
+                                                        max_rollout_depth)
+        else:
+            simulation_result = random_simulation(self.state_of(expanded), self.rng, max_rollout_depth)
+        # Backpropagation
+        self.backpropagate(expanded, simulation_result, batch_size or 1)
+
+    def select(self, index: int = 0) -> int:
+        """
+        Select highest UCB until a node that has not been expanded is reached
+        :return: the index of the selected node
+        """
+        visits = self.visits
+        while self.child_count[index] > 0:
+            start = int(self.first_child[index])
+            count = int(self.child_count[index])
+            # children are visited for the first time in order, so the unvisited ones follow the visited ones
+            visited = int(self.visited_children[index])
+            if visited < count:
+                return start + visited
+            end = start + count
+            child_visits = visits[start:end]
+            ucb = self.values[start:end] / child_visits \
+                + self.exploration * np.sqrt(math.log(visits[index]) / child_visits)
+            index = start + int(np.argmax(ucb))
+        return index
+
+    def expand(self, index: int) -> int:
+        """
+        Nodes visited for the first time are simulated from directly, others get all of their children allocated
+        :return: the index of the node to simulate from
+        """
+        if self.first_child[index] >= 0 or (self.visits[index] == 0 and self.parents[index] >= 0):
+            return index
+        state = self.state_of(index)
+        if state.is_terminal:
+            self.first_child[index] = self.size
+            return index
+
+        actions = state.legal_actions
+        start = self.size
+        end = start + len(actions)
+        if end > self.capacity:
+            self.grow(end)
+        self.first_child[index] = start
+        self.child_count[index] = len(actions)
+        self.parents[start:end] = index
+        self.actions[start:end] = actions
+        self.movers[start:end] = [state.active_player] * len(actions)
+        self.size = end
+        self.peak_size = max(self.peak_size, end)
+        return start
+
+    def backpropagate(self, index: int, simulation_result: dict[str, float], visits: int = 1):
+        """
+        Update all nodes from a node to the root, each with the result for the player who chose it
+        :param visits: the number of simulations the result is the sum of
+        """
+        parent = int(self.parents[index])
+        if self.visits[index] == 0 and parent >= 0:
+            self.visited_children[parent] += 1
+            # every child has its own state now, the root's is kept to rebuild the others from
+            if not self.keep_states and parent > 0 and self.visited_children[parent] == self.child_count[parent]:
+                self.states[parent] = None
+        while index >= 0:
+            self.visits[index] += visits
+            mover = self.movers[index]
+            if mover is not None:
+                self.values[index] += simulation_result[mover]
+            index = int(self.parents[index])
+
+    def grow(self, min_capacity: int):
+        capacity = max(2 * self.capacity, min_capacity)
+        extra = capacity - self.capacity
+        self.visits = np.concatenate((self.visits, np.zeros(extra, dtype=np.int64)))
+        self.values = np.concatenate((self.values, np.zeros(extra, dtype=np.float64)))
+        self.parents = np.concatenate((self.parents, np.full(extra, -1, dtype=np.int64)))
+        self.first_child = np.concatenate((self.first_child, np.full(extra, -1, dtype=np.int64)))
+        self.child_count = np.concatenate((self.child_count, np.zeros(extra, dtype=np.int64)))
+        self.visited_children = np.concatenate((self.visited_children, np.zeros(extra, dtype=np.int64)))
+        self.actions.extend([None] * extra)
+        self.movers.extend([None] * extra)
+        self.states.extend([None] * extra)
+        self.capacity = capacity
+
+    def prune(self, max_nodes: int):
+        """
+        Cut off the subtrees of the least visited nodes until the tree has at most max_nodes nodes, or only the root
+        and its children are left. The remaining nodes are moved down in place, so the slots freed are reused.
+        The nodes cut off keep their own statistics and are expanded again when next selected.
+        """
+        if self.size <= max_nodes:
+            return
+        size = self.size
+        parents = self.parents[:size]
+        pruned = nodes_to_prune(parents.tolist(), self.visits[:size].tolist(), (self.child_count[:size] > 0).tolist(),
+                                max_nodes)
+        if not pruned:
+            return
+
+        # a node is kept unless one of its ancestors was pruned, parents come first so one pass finds them all
+        cut = np.zeros(size, dtype=bool)
+        cut[pruned] = True
+        keep = np.ones(size, dtype=bool)
+        parent_list = parents.tolist()
+        for index in range(1, size):
+            parent = parent_list[index]
+            if cut[parent] or not keep[parent]:
+                keep[index] = False
+        kept = np.flatnonzero(keep)
+        new_size = len(kept)
+        # old index to new index, nodes keep their order so children stay contiguous and after their parents
+        new_index = np.cumsum(keep) - 1
+
+        first_child = self.first_child[kept]
+        child_count = self.child_count[kept]
+        visited_children = self.visited_children[kept]
+        collapsed = cut[kept]
+        first_child[collapsed] = -1
+        child_count[collapsed] = 0
+        visited_children[collapsed] = 0
+        has_children = child_count > 0
+        first_child[has_children] = new_index[first_child[has_children]]
+        # expanded terminal nodes only need a first child that is not -1
+        first_child[(first_child >= 0) & ~has_children] = 0
+        old_parents = self.parents[kept]
+        self.parents[:new_size] = np.where(old_parents >= 0, new_index[np.maximum(old_parents, 0)], -1)
+        self.first_child[:new_size] = first_child
+        self.child_count[:new_size] = child_count
+        self.visited_children[:new_size] = visited_children
+        self.visits[:new_size] = self.visits[kept]
+        self.values[:new_size] = self.values[kept]
+        for array, empty in ((self.parents, -1), (self.first_child, -1), (self.child_count, 0),
+                             (self.visited_children, 0), (self.visits, 0), (self.values, 0)):
+            array[new_size:size] = empty
+        kept_list = kept.tolist()
+        for values in (self.actions, self.movers, self.states):
+            values[:new_size] = [values[index] for index in kept_list]
+            values[new_size:size] = [None] * (size - new_size)
+        self.size = new_size
+
+    def subtree(self, index: int) -> 'CompactTree':
+        """
+        :return: a new tree holding a copy of the subtree below a node, with the node as its root
+        """
+        tree = CompactTree(self.state_of(index), self.player, self.rng, max(self.size, 1), self.exploration,
+                           self.keep_states)
+        tree.visits[0] = self.visits[index]
+        tree.values[0] = self.values[index]
+        queue = [(index, 0)]
+        while queue:
+            old, new = queue.pop()
+            old_start = int(self.first_child[old])
+            if old_start < 0:
+                continue
+            count = int(self.child_count[old])
+            start = tree.size
+            tree.first_child[new] = start
+            tree.child_count[new] = count
+            tree.visited_children[new] = self.visited_children[old]
+            tree.parents[start:start + count] = new
+            tree.visits[start:start + count] = self.visits[old_start:old_start + count]
+            tree.values[start:start + count] = self.values[old_start:old_start + count]
+            tree.actions[start:start + count] = self.actions[old_start:old_start + count]
+            tree.movers[start:start + count] = self.movers[old_start:old_start + count]
+            tree.states[start:start + count] = self.states[old_start:old_start + count]
+            tree.size += count
+            queue.extend((old_start + offset, start + offset) for offset in range(count))
+        tree.peak_size = tree.size
+        return tree
+
+    @property
+    def nbytes(self) -> int:
+        """
+        :return: the size of the node arrays in bytes, not counting actions and states
+        """
+        return self.visits.nbytes + self.values.nbytes + self.parents.nbytes \
+            + self.first_child.nbytes + self.child_count.nbytes + self.visited_children.nbytes
+
+
+class CompactNode:
+    """A view of one node of a CompactTree with the same interface as MonteCarloNode"""
+
+    __slots__ = ('tree', 'index')
+
+    def __init__(self, tree: CompactTree, index: int):
+        self.tree = tree
+        self.index = index
+
+    @property
+    def n(self) -> int:
+        return int(self.tree.visits[self.index])
+
+    @property
+    def v(self) -> float:
+        return float(self.tree.values[self.index])
+
+    @property
+    def state(self) -> GameState:
+        return self.tree.state_of(self.index)
+
+    @property
+    def last_action(self) -> any:
+        return self.tree.actions[self.index]
+
+    @property
+    def parent(self) -> 'CompactNode':
+        parent = int(self.tree.parents[self.index])
+        return CompactNode(self.tree, parent) if parent >= 0 else None
+
+    @property
+    def children(self) -> list['CompactNode']:
+        return [CompactNode(self.tree, child) for child in self.tree.children_of(self.index)]
+
+    def rollout(self, max_rollout_depth: int = None, batch_size: int = None):
+        self.tree.rollout(self.index, max_rollout_depth, batch_size)
+
+    @property
+    def tree_size(self) -> int:
+        return self.tree.size
+
+    @property
+    def peak_tree_size(self) -> int:
+        return self.tree.peak_size
+
+    def prune(self, max_nodes: int):
+        self.tree.prune(max_nodes)
+
+    def selection(self) -> 'CompactNode':
+        return CompactNode(self.tree, self.tree.select(self.index))
+
+    def expansion(self, selected_node: 'CompactNode') -> 'CompactNode':
+        return CompactNode(self.tree, self.tree.expand(selected_node.index))
+
+    def simulation(self, child_node: 'CompactNode', max_depth: int = None) -> dict[str, float]:
+        return random_simulation(child_node.state, self.tree.rng, max_depth)
+
+    def backpropagation(self, simulation_result: dict[str, float], visits: int = 1):
+        self.tree.backpropagate(self.index, simulation_result, visits)
+
+    def descendant(self, actions: list) -> 'CompactNode':
+        """
+        :return: the node reached by taking the actions from this node, or None if it has not been expanded
+        """
+        node = self
+        for action in actions:
+            node = next((child for child in node.children if child.last_action == action), None)
+            if node is None:
+                return None
+        return node
+
+    def find(self, state: GameState, max_depth: int) -> 'CompactNode':
+        """
+        Breadth first search for the node of a state, only visited nodes are compared
+        :return: the node with an equal state at most max_depth actions below this node, or None
+        """
+        layer = [self]
+        for depth in range(max_depth + 1):
+            for node in layer:
+                if node.n > 0 and node.state == state:
+                    return node
+            layer = [child for node in layer for child in node.children]
+        return None
+
+    def detach(self) -> 'CompactNode':
+        """
+        :return: this node as the root of a tree of its own, so the rest of the old tree can be freed
+        """
+        if self.index == 0:
+            return self
+        return self.tree.subtree(self.index).root
+
+    def __eq__(self, other):
+        return isinstance(other, CompactNode) and self.tree is other.tree and self.index == other.index
+
+    def __hash__(self):
+        return hash((id(self.tree), self.index))
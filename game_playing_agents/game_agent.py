@@ -1,5 +1,34 @@
 from abc import ABC, abstractmethod
 from .state import GameState
+from .instrumentation import SearchStats, TimedState, peak_memory
+from typing import Callable
+import asyncio
+import concurrent.futures
+import threading
+import time
+
+# searches started with aget_next_action run on this executor, see set_search_executor
+_search_executor = None  # type: concurrent.futures.Executor
+
+
+def search_executor() -> concurrent.futures.Executor:
+    """
+    :return: the executor shared by the searches of every agent started with aget_next_action, by default a thread
+             pool of a bounded size, further searches wait for a free thread
+    """
+    global _search_executor
+    if _search_executor is None:
+        _search_executor = concurrent.futures.ThreadPoolExecutor(thread_name_prefix='search')
+    return _search_executor
+
+
+def set_search_executor(executor: concurrent.futures.Executor):
+    """
+    :param executor: the executor for searches started with aget_next_action, it must run them in this process so
+                     they can be asked to stop
+    """
+    global _search_executor
+    _search_executor = executor
 
 
 class GameAgent(ABC):
@@ -7,6 +36,8 @@ class GameAgent(ABC):
     def __init__(self, init_state: GameState, player: str):
         self.current_state = init_state
         self.player = player
+        # the stop token of the current search, replaced for every asynchronous search
+        self.stop_event = threading.Event()
 
     @abstractmethod
     def get_next_action(self):
@@ -17,3 +48,88 @@ class GameAgent(ABC):
 
     def update_state(self, new_state: GameState):
         self.current_state = new_state
+
+    async def aget_next_action(self, deadline: float = None):
+        """
+        Choose an action like get_next_action, on the shared search executor so the event loop is not blocked.
+        At the deadline, or when the awaiting task is cancelled, the search is asked to stop and return the best
+        action found so far.
+        :param deadline: the event loop time to return an action by, as in asyncio.timeout_at
+        :return: the action to take
+        """
+        loop = asyncio.get_running_loop()
+        # a token of this search's own, so stopping it late cannot stop the agent's next search
+        stop_event = threading.Event()
+        search = loop.run_in_executor(search_executor(), self.get_next_action_until, stop_event)
+        try:
+            if deadline is None:
+                return await asyncio.shield(search)
+            return await asyncio.wait_for(asyncio.shield(search), max(deadline - loop.time(), 0))
+        except asyncio.TimeoutError:
+            stop_event.set()
+            return await search
+        except asyncio.CancelledError:
+            stop_event.set()
+            raise
+
+    def get_next_action_until(self, stop_event: threading.Event):
+        """
+        Choose an action like get_next_action, stopping the search early when the event is set
+        """
+        self.stop_event = stop_event
+        try:
+            return self.get_next_action()
+        finally:
+            self.stop_event = threading.Event()
+
+    @property
+    def stop_requested(self) -> bool:
+        """
+        :return: True if the current search has been asked to stop, checked by the search as it runs
+        """
+        return self.stop_event.is_set()
+
+    def request_stop(self):
+        """
+        Ask a running search to return the best action it has found so far, safe to call from any thread.
+        Agents that do not search, or search in other processes, finish as usual.
+        """
+        self.stop_event.set()
+
+    def resume(self):
+        """Clear a stop request once the search it was meant for has returned"""
+        self.stop_event = threading.Event()
+
+    def get_next_action_with_stats(self, on_node: Callable = None, on_rollout: Callable = None,
+                                   time_states: bool = True) -> tuple[any, SearchStats]:
+        """
+        Choose an action like get_next_action while recording what the search did, get_next_action itself pays
+        nothing for instrumentation
+        :param on_node: called as on_node(state, ply) for every node a tree search visits
+        :param on_rollout: called as on_rollout(agent) after every rollout of a Monte Carlo search
+        :param time_states: time the calls made to the game states, through a TimedState proxy
+        :return: the action to take and the statistics of the search
+        """
+        stats = SearchStats(on_node, on_rollout)
+        state = self.current_state
+        if time_states:
+            self.current_state = TimedState(state, stats)
+        self.start_instrumentation(stats)
+        start = time.perf_counter()
+        try:
+            action = self.get_next_action()
+        finally:
+            stats.seconds = time.perf_counter() - start
+            stats.peak_memory = peak_memory()
+            stats.recording = False
+            self.current_state = state
+            self.finish_instrumentation(stats)
+        return action, stats
+
+    def start_instrumentation(self, stats: SearchStats):
+        """Called before an instrumented search, to install the callbacks of the stats"""
+        pass
+
+    def finish_instrumentation(self, stats: SearchStats):
+        """Called after an instrumented search, to remove the callbacks and fill in the agent's counters"""
+        pass
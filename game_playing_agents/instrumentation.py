@@ -0,0 +1,185 @@
+from .state import GameState
+from typing import Callable
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def peak_memory() -> int:
+    """
+    :return: the peak resident memory of the process in bytes, or 0 where the platform does not report it
+    """
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # reported in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class SearchStats:
+    """
+    What happened inside one move decision, filled in by GameAgent.get_next_action_with_stats.
+    Counters an agent does not have are left at 0.
+    """
+
+    def __init__(self, on_node: Callable = None, on_rollout: Callable = None):
+        """
+        :param on_node: called as on_node(state, ply) for every node a tree search visits
+        :param on_rollout: called as on_rollout(agent) after every rollout of a Monte Carlo search
+        """
+        self.on_node = on_node
+        self.on_rollout = on_rollout
+        self.recording = True
+        self.seconds = 0.0
+        self.nodes = 0
+        self.cutoffs = 0
+        self.max_depth = 0
+        self.rollouts = 0
+        self.tree_size = 0
+        self.peak_memory = 0
+        self.state_calls = {}  # type: dict[str, int]
+        self.state_seconds = {}  # type: dict[str, float]
+
+    def record_state_call(self, name: str, seconds: float):
+        self.state_calls[name] = self.state_calls.get(name, 0) + 1
+        self.state_seconds[name] = self.state_seconds.get(name, 0.0) + seconds
+
+    @property
+    def search_seconds(self) -> float:
+        """
+        :return: the time spent in the agent's own code, rather than in calls to the game states
+        """
+        return self.seconds - sum(self.state_seconds.values())
+
+    def to_dict(self) -> dict:
+        return {
+            'seconds': self.seconds,
+            'search_seconds': self.search_seconds,
+            'nodes': self.nodes,
+            'cutoffs': self.cutoffs,
+            'max_depth': self.max_depth,
+            'rollouts': self.rollouts,
+            'tree_size': self.tree_size,
+            'peak_memory': self.peak_memory,
+            'state_calls': dict(self.state_calls),
+            'state_seconds': dict(self.state_seconds),
+        }
+
+
+class TimedState(GameState):
+    """
+    Proxy for a game state recording the time spent in its methods, and in those of every state reached from it,
+    in a SearchStats. Calls made in worker processes are not recorded.
+    """
+
+    def __init__(self, wrapped: GameState, stats: SearchStats):
+        self.wrapped = wrapped
+        self.stats = stats
+
+    def timed(self, name: str, call: Callable, *args):
+        if not self.stats.recording:
+            return call(*args)
+        start = time.perf_counter()
+        result = call(*args)
+        self.stats.record_state_call(name, time.perf_counter() - start)
+        return result
+
+    def wrap(self, state: GameState) -> 'TimedState':
+        return TimedState(state, self.stats)
+
+    @property
+    def state(self) -> any:
+        return self.wrapped.state
+
+    @property
+    def active_player(self) -> str:
+        return self.wrapped.active_player
+
+    @property
+    def legal_actions(self) -> list:
+        return self.timed('legal_actions', lambda: self.wrapped.legal_actions)
+
+    @property
+    def utility(self) -> dict[str, float]:
+        return self.timed('utility', lambda: self.wrapped.utility)
+
+    @property
+    def is_terminal(self) -> bool:
+        return self.timed('is_terminal', lambda: self.wrapped.is_terminal)
+
+    def get_next_state(self, action) -> GameState:
+        return self.wrap(self.timed('get_next_state', self.wrapped.get_next_state, action))
+
+    def apply(self, action):
+        self.timed('apply', self.wrapped.apply, action)
+
+    def undo(self):
+        self.timed('undo', self.wrapped.undo)
+
+    @property
+    def supports_undo(self) -> bool:
+        return self.wrapped.supports_undo
+
+    def to_batch(self, size: int):
+        return self.wrapped.to_batch(size)
+
+    @property
+    def supports_batch(self) -> bool:
+        return self.wrapped.supports_batch
+
+    def action_priority(self, action) -> float:
+        return self.wrapped.action_priority(action)
+
+    def evaluate_children(self, actions: list, player: str):
+        return self.timed('evaluate_children', self.wrapped.evaluate_children, actions, player)
+
+    @property
+    def supports_evaluate_children(self) -> bool:
+        return self.wrapped.supports_evaluate_children
+
+    def encode(self) -> bytes:
+        return self.timed('encode', self.wrapped.encode)
+
+    @property
+    def supports_encode(self) -> bool:
+        return self.wrapped.supports_encode
+
+    def canonical_hash(self) -> int:
+        return self.timed('hash', self.wrapped.canonical_hash)
+
+    def get_winner(self) -> str:
+        return self.wrapped.get_winner()
+
+    def __getattr__(self, name):
+        # anything else the game defines, looked up on the wrapped state
+        wrapped = self.__dict__.get('wrapped')
+        if wrapped is None:
+            raise AttributeError(name)
+        return getattr(wrapped, name)
+
+    def __str__(self) -> str:
+        return str(self.wrapped)
+
+    def __copy__(self):
+        return self.wrap(self.timed('copy', self.wrapped.__copy__))
+
+    def __hash__(self):
+        return self.timed('hash', hash, self.wrapped)
+
+    def __eq__(self, other):
+        return self.wrapped == unwrap(other)
+
+    def __reduce__(self):
+        # worker processes get the plain state, not the stats and their callbacks, which may not be picklable
+        return unwrap, (self.wrapped,)
+
+
+def unwrap(state: GameState) -> GameState:
+    """
+    :return: the state a TimedState proxies, or the state itself
+    """
+    return state.wrapped if isinstance(state, TimedState) else state
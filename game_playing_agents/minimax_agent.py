@@ -1,83 +1,481 @@
 from .state import GameState
 from .game_agent import GameAgent
-from copy import deepcopy
+from .transposition_table import TranspositionTable, TranspositionEntry, EXACT, LOWER, UPPER
+from .move_ordering import MoveOrderer
+from .instrumentation import SearchStats
+from copy import copy
+import math
+import multiprocessing
+import multiprocessing.pool
+import time
+
+
+class SearchTimeout(Exception):
+    """Raised inside a search when the agent's deadline has passed or it was asked to stop"""
 
 
 class MiniMaxAgent(GameAgent):
 
-    def __init__(self, init_state: GameState, depth: int, player: str = None):
+    # how many nodes are searched between checks of the deadline
+    DEADLINE_CHECK_INTERVAL = 256
+
+    def __init__(self, init_state: GameState, depth: int = None, player: str = None,
+                 transposition_table: TranspositionTable = None, time_limit: float = None,
+                 move_ordering: list[MoveOrderer] = None, workers: int = 1, batch_leaves: bool = False):
+        """
+        :param depth: the depth to search to, or the deepest iteration to search to when time_limit is set
+        :param transposition_table: an optional table of search results shared between moves
+        :param time_limit: search depth 1, 2, 3... until this many seconds have passed
+        :param move_ordering: orderers applied to the legal actions of every node, earlier orderers take precedence
+        :param workers: the number of processes to split the root actions between, the pool is created once and
+                        reused. Workers keep transposition tables of their own, of the same size as the agent's
+        :param batch_leaves: value all the children of a node at depth 1 with one call to evaluate_children, for
+                             states that support it. Faster when the game's evaluation vectorizes well, but those
+                             children are no longer pruned
+        """
         if player is not None:
             super().__init__(init_state, player)
         else:
             super().__init__(init_state, init_state.active_player)
+        if depth is None and time_limit is None:
+            raise ValueError("MiniMaxAgent needs a depth, a time_limit or both")
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
         self.max_depth = depth
+        self.transposition_table = transposition_table
+        self.time_limit = time_limit
+        self.move_ordering = move_ordering if move_ordering is not None else []
+        self.workers = workers
+        self.batch_leaves = batch_leaves
+        self.deadline = None
+        self.nodes_searched = 0
+        self.cutoffs = 0
+        self.completed_depth = 0
+        self.reached_depth_limit = False
+        self.principal_variation = []
+        self._pv_table = []  # type: list[tuple]
+        self._in_place = False
+        self._evaluate_children = False
+        self._pool = None
+        self._shared_alpha = None
 
     def get_next_action(self):
-        root = MiniMaxNode(deepcopy(self.current_state), self.max_depth, self.player)
-        max_action, max_value = root.minimax_search()
+        if self.transposition_table is not None:
+            self.transposition_table.new_search()
+        for orderer in self.move_ordering:
+            orderer.new_search()
+        self.nodes_searched = 0
+        self.cutoffs = 0
+        self.principal_variation = []
+        root_state = self.current_state
+        # states that support apply and undo are searched in place, on a copy so the game's own state is untouched
+        self._in_place = root_state.supports_undo
+        if self._in_place:
+            root_state = copy(root_state)
+        self._evaluate_children = self.batch_leaves and root_state.supports_evaluate_children
+
+        if self.time_limit is None:
+            self.deadline = None
+            try:
+                max_action, _ = self.search_to_depth(root_state, self.max_depth)
+            except SearchTimeout:
+                max_action = self.interrupted_action()
+            return max_action
+
+        # Iterative Deepening: the time limit counts from the start of the move, but the first iteration always
+        # completes so there is a move to return, unless stopped
+        deadline = time.perf_counter() + self.time_limit
+        self.deadline = None
+        try:
+            try:
+                max_action, _ = self.search_to_depth(root_state, 1)
+            except SearchTimeout:
+                return self.interrupted_action()
+            self.deadline = deadline
+            depth = 1
+            # stop early once a whole iteration finished without reaching the depth limit
+            while (self.max_depth is None or depth < self.max_depth) and self.reached_depth_limit \
+                    and not self.out_of_time():
+                depth += 1
+                try:
+                    max_action, _ = self.search_to_depth(root_state, depth)
+                except SearchTimeout:
+                    break
+        finally:
+            self.deadline = None
         return max_action
 
+    def interrupted_action(self):
+        """
+        :return: the best action of a search stopped before its first iteration completed, the best of the root
+                 actions searched so far, or the first legal action if none were
+        """
+        if self._pv_table and self._pv_table[0]:
+            return self._pv_table[0][0]
+        return self.current_state.legal_actions[0]
 
-class MiniMaxNode:
+    def out_of_time(self) -> bool:
+        """
+        :return: True if the search should stop, because the deadline has passed or a stop was requested
+        """
+        return self.stop_requested or (self.deadline is not None and time.perf_counter() > self.deadline)
 
-    def __init__(self, state: GameState, max_depth: int, max_player: str,
-                 node_depth: int = 0, parent: 'MiniMaxNode' = None):
-        self.state = state
-        self.max_depth = max_depth
-        self.node_depth = node_depth
-        self.max_player = max_player
-        self.parent = parent
-        self.alpha = float('-inf')
-        self.beta = float('inf')
+    def search_to_depth(self, state: GameState, depth: int):
+        """
+        Run one complete alpha-beta search, ordering moves along the previous principal variation first
+        :return: the best action and its value
+        """
+        self.reached_depth_limit = False
+        self._pv_table = [()] * (depth + 1)
+        if self.workers > 1 and depth > 1 and state.active_player == self.player and not state.is_terminal:
+            value = self.root_split_search(state, depth, self.principal_variation)
+        else:
+            value = self.search(state, depth, 0, float('-inf'), float('inf'), self.principal_variation)
+        self.principal_variation = list(self._pv_table[0])
+        self.completed_depth = depth
+        max_action = self.principal_variation[0] if self.principal_variation else None
+        return max_action, value
 
-    def minimax_search(self):
-        best_action = None
+    def search(self, state: GameState, depth: int, ply: int, alpha: float, beta: float,
+               principal_variation: list = None) -> float:
+        """
+        Alpha-beta search of the subtree below a state, the best line found is left in the pv table at ply
+        :param depth: the remaining depth to search
+        :param ply: the distance of the state from the root
+        :param alpha: the value the maximising player is already guaranteed higher up the tree
+        :param beta: the value the minimising player is already guaranteed higher up the tree
+        :param principal_variation: the expected best line from this state, searched first
+        :return: the value of the state to the agent's player
+        """
+        self.nodes_searched += 1
+        if self.nodes_searched % self.DEADLINE_CHECK_INTERVAL == 0 and self.out_of_time():
+            raise SearchTimeout()
+        pv_table = self._pv_table
+        pv_table[ply] = ()
 
         # Base Case: If at depth or terminal state, return utility
-        if self.node_depth == self.max_depth or self.state.is_terminal:
-            return best_action, self.state.utility[self.max_player]
-
-        # Recursive Maximise Case:
-        if self.state.active_player == self.max_player:
-            max_value = float('-inf')
-            for action in self.state.legal_actions:
-                # get next node
-                next_state = self.state.get_next_state(action)
-                next_node = MiniMaxNode(next_state, self.max_depth, self.max_player, self.node_depth + 1, self)
-                _, next_value = next_node.minimax_search()
+        if state.is_terminal:
+            return state.utility[self.player]
+        if depth == 0:
+            self.reached_depth_limit = True
+            return state.utility[self.player]
+
+        original_alpha, original_beta = alpha, beta
+
+        # Transposition Case: reuse a result from an equivalent position searched at least as deep
+        table = self.transposition_table
+        key = None
+        entry = None
+        if table is not None:
+            key = hash(state)
+            entry = table.lookup(key)
+            # the root must search to return an action of its own
+            if entry is not None and entry.depth >= depth and ply > 0:
+                # the stored value may have been found with a depth limit of its own
+                self.reached_depth_limit = True
+                if entry.bound == EXACT:
+                    return entry.value
+                elif entry.bound == LOWER:
+                    alpha = max(alpha, entry.value)
+                else:
+                    beta = min(beta, entry.value)
+                if alpha >= beta:
+                    return entry.value
+
+        actions, principal_variation = self.ordered_actions(state, ply, entry, principal_variation)
+
+        maximising = state.active_player == self.player
+        if depth == 1 and self._evaluate_children and len(actions) > 1:
+            best_value, best_action = self.evaluate_leaves(state, actions, ply, alpha, beta, maximising)
+            if key is not None:
+                # every child was evaluated, so the value is exact whatever the window
+                table.store(key, depth, best_value, EXACT, best_action)
+            return best_value
 
+        best_value = float('-inf') if maximising else float('inf')
+        best_action = None
+        for action in actions:
+            next_pv = principal_variation[1:] if principal_variation and action == principal_variation[0] else None
+            if self._in_place:
+                # a timeout leaves the copy mid-search, it is discarded along with the iteration
+                state.apply(action)
+                next_value = self.search(state, depth - 1, ply + 1, alpha, beta, next_pv)
+                state.undo()
+            else:
+                next_value = self.search(state.get_next_state(action), depth - 1, ply + 1, alpha, beta, next_pv)
+
+            # Maximise Case:
+            if maximising:
                 # update best action with value
-                if next_value > max_value:
-                    max_value = next_value
+                if next_value > best_value:
+                    best_value = next_value
                     best_action = action
+                    pv_table[ply] = (action,) + pv_table[ply + 1]
+                # check a-b pruning
+                alpha = max(alpha, best_value)
 
+            # Minimise Case:
+            else:
+                # update best action with value
+                if next_value < best_value:
+                    best_value = next_value
+                    best_action = action
+                    pv_table[ply] = (action,) + pv_table[ply + 1]
                 # check a-b pruning
-                self.alpha = max(self.alpha, max_value)
-                if self.alpha >= self.beta:
-                    break
+                beta = min(beta, best_value)
+
+            if alpha >= beta:
+                self.cutoffs += 1
+                if self.move_ordering:
+                    self.record_cutoff(state, action, ply, depth)
+                break
+
+        if key is not None:
+            if best_value <= original_alpha:
+                bound = UPPER
+            elif best_value >= original_beta:
+                bound = LOWER
+            else:
+                bound = EXACT
+            table.store(key, depth, best_value, bound, best_action)
+
+        return best_value
+
+    def evaluate_leaves(self, state: GameState, actions: list, ply: int, alpha: float, beta: float,
+                        maximising: bool) -> tuple[float, any]:
+        """
+        Value all the children of a node at depth 1 with a single call to evaluate_children, instead of searching
+        each of them, the first of equally good children is chosen as the serial search would
+        :return: the value of the state to the agent's player and the best action
+        """
+        self.nodes_searched += len(actions)
+        values = state.evaluate_children(actions, self.player)
+        choose = max if maximising else min
+        best_index = choose(range(len(actions)), key=values.__getitem__)
+        best_value, best_action = float(values[best_index]), actions[best_index]
+        self._pv_table[ply] = (best_action,)
+
+        # the children's values are the same terminal or not, so whether the depth limit cut the search short is
+        # only known by looking, until a child that is not terminal is found in this iteration
+        if not self.reached_depth_limit:
+            self.reached_depth_limit = not all(self.child_is_terminal(state, action) for action in actions)
+        if (best_value >= beta) if maximising else (best_value <= alpha):
+            self.cutoffs += 1
+            if self.move_ordering:
+                self.record_cutoff(state, best_action, ply, 1)
+        return best_value, best_action
+
+    def child_is_terminal(self, state: GameState, action) -> bool:
+        if self._in_place:
+            state.apply(action)
+            is_terminal = state.is_terminal
+            state.undo()
+            return is_terminal
+        return state.get_next_state(action).is_terminal
 
-            return best_action, max_value
+    def root_split_search(self, state: GameState, depth: int, principal_variation: list = None) -> float:
+        """
+        Search the first root action here, then the others in the worker processes, each starting from the best
+        value found so far as its alpha. Returns the same action as search, unless transposition table entries
+        found deeper than the search depth differ between the processes.
+        :return: the value of the state to the agent's player
+        """
+        self.nodes_searched += 1
+        table = self.transposition_table
+        key = hash(state) if table is not None else None
+        entry = table.lookup(key) if table is not None else None
+        actions, principal_variation = self.ordered_actions(state, 0, entry, principal_variation)
 
-        # Recursive Minimise Case:
+        # Young Brothers Wait: the eldest brother sets the bound its younger brothers are searched with
+        eldest = actions[0]
+        best_value = self.search_action(state, eldest, depth, float('-inf'), float('inf'),
+                                        principal_variation[1:] if principal_variation else None)
+        best_action = eldest
+        best_line = (eldest,) + self._pv_table[1]
+        self.shared_alpha.value = best_value
+
+        time_limit = self.deadline - time.perf_counter() if self.deadline is not None else None
+        tasks = [(state, action, depth, self.player, self.move_ordering, time_limit, self._evaluate_children)
+                 for action in actions[1:]]
+        results = self.pool.starmap(root_split_worker, tasks)
+        if any(result is None for result in results):
+            raise SearchTimeout()
+
+        for action, (value, alpha, line, nodes, cutoffs, reached_depth_limit) in zip(actions[1:], results):
+            self.nodes_searched += nodes
+            self.cutoffs += cutoffs
+            self.reached_depth_limit = self.reached_depth_limit or reached_depth_limit
+            # values at or below the alpha they were searched with are only upper bounds
+            if alpha < value and value > best_value:
+                best_value = value
+                best_action = action
+                best_line = line
+
+        # the serial search returns the first of equally good actions, an earlier action that failed low against
+        # an alpha equal to the best value may be as good, so it is re-searched with a null window to find out
+        for action, (value, alpha, line, nodes, cutoffs, reached_depth_limit) in zip(actions[1:], results):
+            if best_action == eldest or action == best_action:
+                break
+            if alpha < value or value < best_value:
+                continue
+            if self.search_action(state, action, depth, math.nextafter(best_value, float('-inf')), best_value) \
+                    >= best_value:
+                best_action = action
+                best_line = (action,) + self._pv_table[1]
+                break
+
+        self._pv_table[0] = best_line
+        if table is not None:
+            table.store(key, depth, best_value, EXACT, best_action)
+        return best_value
+
+    def search_action(self, state: GameState, action, depth: int, alpha: float, beta: float,
+                      principal_variation: list = None) -> float:
+        """
+        Search the state reached by an action from the root
+        :return: the value of the action to the agent's player
+        """
+        if self._in_place:
+            state.apply(action)
+            value = self.search(state, depth - 1, 1, alpha, beta, principal_variation)
+            state.undo()
+            return value
+        return self.search(state.get_next_state(action), depth - 1, 1, alpha, beta, principal_variation)
+
+    def ordered_actions(self, state: GameState, ply: int, entry: TranspositionEntry = None,
+                        principal_variation: list = None) -> tuple[list, list]:
+        """
+        :param entry: the transposition table entry of the state, if any
+        :return: the legal actions in the order they are searched, and the principal variation if it is among them
+        """
+        actions = state.legal_actions
+        if self.move_ordering:
+            actions = self.order_actions(state, actions, ply)
+        # try the stored best action first
+        if entry is not None and entry.best_action in actions:
+            actions = [entry.best_action] + [action for action in actions if action != entry.best_action]
+        # try the principal variation of the previous iteration before anything else
+        if principal_variation and principal_variation[0] in actions:
+            pv_action = principal_variation[0]
+            actions = [pv_action] + [action for action in actions if action != pv_action]
         else:
-            min_value = float('inf')
-            for action in self.state.legal_actions:
-                # get next node
-                next_state = self.state.get_next_state(action)
-                next_node = MiniMaxNode(next_state, self.max_depth, self.max_player, self.node_depth + 1, self)
-                _, next_value = next_node.minimax_search()
+            principal_variation = None
+        return actions, principal_variation
 
-                # update best action with value
-                if next_value < min_value:
-                    min_value = next_value
-                    best_action = action
+    def order_actions(self, state: GameState, actions: list, ply: int) -> list:
+        """
+        :return: the actions sorted by the scores of the move orderers, best first
+        """
+        orderers = self.move_ordering
+        if len(orderers) == 1:
+            orderer = orderers[0]
+            return sorted(actions, key=lambda action: orderer.score(state, action, ply), reverse=True)
+        return sorted(actions, key=lambda action: tuple(orderer.score(state, action, ply) for orderer in orderers),
+                      reverse=True)
 
-                # check a-b pruning
-                self.beta = min(self.beta, min_value)
-                if self.alpha >= self.beta:
-                    break
+    def record_cutoff(self, state: GameState, action, ply: int, depth: int):
+        for orderer in self.move_ordering:
+            orderer.record_cutoff(state, action, ply, depth)
+
+    def start_instrumentation(self, stats: SearchStats):
+        if stats.on_node is not None:
+            # shadow the search method for this move only, so uninstrumented searches make no extra calls
+            search = type(self).search
+            on_node = stats.on_node
+
+            def instrumented_search(state: GameState, depth: int, ply: int, alpha: float, beta: float,
+                                    principal_variation: list = None) -> float:
+                on_node(state, ply)
+                return search(self, state, depth, ply, alpha, beta, principal_variation)
+            self.search = instrumented_search
+
+    def finish_instrumentation(self, stats: SearchStats):
+        self.__dict__.pop('search', None)
+        stats.nodes = self.nodes_searched
+        stats.cutoffs = self.cutoffs
+        stats.max_depth = self.completed_depth
+
+    @property
+    def shared_alpha(self) -> multiprocessing.Value:
+        """
+        :return: the best value found from the root so far, shared with the worker processes
+        """
+        if self._shared_alpha is None:
+            self._shared_alpha = multiprocessing.Value('d', float('-inf'))
+        return self._shared_alpha
+
+    @property
+    def pool(self) -> multiprocessing.pool.Pool:
+        if self._pool is None:
+            table = self.transposition_table
+            table_settings = (table.max_entries, table.replacement) if table is not None else None
+            self._pool = multiprocessing.Pool(self.workers, initializer=root_split_initializer,
+                                              initargs=(self.shared_alpha, table_settings))
+        return self._pool
+
+    def close(self):
+        """Shut down the worker processes"""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def effective_branching_factor(self) -> float:
+        """
+        :return: the branching factor b such that b ** depth equals the nodes searched by the last move
+        """
+        if self.nodes_searched == 0 or self.completed_depth == 0:
+            return 0.0
+        return self.nodes_searched ** (1 / self.completed_depth)
+
+
+# the state of a root split worker process, set up once by root_split_initializer
+_shared_alpha = None
+_worker_table = None  # type: TranspositionTable
+
+
+def root_split_initializer(shared_alpha: multiprocessing.Value, table_settings: tuple = None):
+    """
+    :param shared_alpha: the best value found from the root so far
+    :param table_settings: the size and replacement policy of the worker's transposition table, None for no table
+    """
+    global _shared_alpha, _worker_table
+    _shared_alpha = shared_alpha
+    _worker_table = TranspositionTable(*table_settings) if table_settings is not None else None
 
-            return best_action, min_value
 
+def root_split_worker(state: GameState, action, depth: int, player: str, move_ordering: list[MoveOrderer],
+                      time_limit: float = None, evaluate_children: bool = False) -> tuple:
+    """
+    Run in a worker process by root split search, searches one root action with the best value found so far as alpha
+    :return: the value of the action, the alpha it was searched with, its line, the number of nodes searched and of
+             cutoffs, and whether the depth limit was reached, or None if the time limit passed first
+    """
+    if _worker_table is not None:
+        _worker_table.new_search()
+    agent = MiniMaxAgent(state, depth, player, _worker_table, move_ordering=move_ordering)
+    agent._in_place = state.supports_undo
+    agent._evaluate_children = evaluate_children
+    agent._pv_table = [()] * (depth + 1)
+    if time_limit is not None:
+        agent.deadline = time.perf_counter() + time_limit
+    # the state is the worker's own copy, unpickled from the task
+    alpha = _shared_alpha.value
+    try:
+        value = agent.search_action(state, action, depth, alpha, float('inf'))
+    except SearchTimeout:
+        return None
 
-        
+    if value > alpha:
+        with _shared_alpha.get_lock():
+            if value > _shared_alpha.value:
+                _shared_alpha.value = value
+    return value, alpha, (action,) + agent._pv_table[1], agent.nodes_searched, agent.cutoffs, \
+        agent.reached_depth_limit
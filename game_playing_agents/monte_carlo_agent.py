@@ -1,61 +1,625 @@
 from .state import GameState
 from .game_agent import GameAgent
 
+from .simulation import random_simulation, batch_random_simulation
+from .compact_tree import CompactTree, DEFAULT_EXPLORATION, PRUNE_TARGET, nodes_to_prune
+from .instrumentation import SearchStats, unwrap
+from .shared_batch import SharedStateBatch, attached_batch
+
 import math
+import multiprocessing
+import multiprocessing.pool
 import random
+import time
+import weakref
+
+
+# the child visits at which the value of a child and its AMAF value are weighted equally
+DEFAULT_RAVE_EQUIVALENCE = 300
 
 
 class MonteCarloAgent(GameAgent):
 
-    def __init__(self, init_state: GameState, rollouts: int, player: str = None):
+    PARALLELISMS = ('root', 'leaf')
+    # how many actions below the previous root to look for the current state when reusing the tree
+    REUSE_DEPTH = 2
+
+    def __init__(self, init_state: GameState, rollouts: int = None, player: str = None,
+                 workers: int = 1, parallelism: str = 'root', seed: int = None,
+                 time_limit: float = None, max_rollout_depth: int = None, reuse_tree: bool = True,
+                 compact_tree: bool = False, exploration: float = None, batch_size: int = None,
+                 rave: bool = False, rave_equivalence: float = None, max_nodes: int = None,
+                 keep_states: bool = True, shared_memory: bool = False):
+        """
+        :param rollouts: the number of simulations to run per move
+        :param workers: the number of processes to run simulations in, the pool is created once and reused.
+                        Shut it down with close, or by using the agent as a context manager, an agent dropped
+                        without closing it only terminates its workers once it is garbage collected
+        :param parallelism: 'root' grows an independent tree in each worker and merges the root statistics,
+                            'leaf' grows one tree and runs a batch of simulations from each new leaf in the workers
+        :param seed: seeds the agent's random number generator and that of every worker task, so searches are
+                     reproducible
+        :param time_limit: keep running simulations until this many seconds have passed, or the rollouts are done
+        :param max_rollout_depth: cut simulations off after this many actions and score them with the state's utility
+        :param reuse_tree: start each move from the subtree of the previous search matching the current state
+        :param compact_tree: store the tree in flat arrays (CompactTree) instead of MonteCarloNode objects
+        :param exploration: the UCB exploration constant, sqrt(2) by default
+        :param batch_size: for states that support to_batch, simulate this many games in lockstep from every
+                           expanded node
+        :param rave: blend all-moves-as-first (AMAF) statistics into the selection of every node, crediting an
+                     action with the result of each simulation it was played in below the node, not only those
+                     through its child. Not supported with compact_tree, batch_size or leaf parallelism
+        :param rave_equivalence: the number of visits at which a child's own value and its AMAF value are weighted
+                                 equally, DEFAULT_RAVE_EQUIVALENCE by default
+        :param max_nodes: bound the tree to this many nodes, when it grows past them the subtrees of the least
+                          visited nodes are cut off, down to PRUNE_TARGET of the bound, and grown again if they are
+                          selected later. The root and its children are never cut, so the bound should be larger
+                          than the number of legal actions
+        :param keep_states: keep a state in every node, otherwise the state of a node is dropped once all of its
+                            children have been created, and rebuilt from the nearest ancestor state if needed again
+        :param shared_memory: with leaf parallelism and states that support encode, pass each leaf state to the
+                              workers encoded once in a SharedStateBatch instead of pickled into every task
+        """
         if player is not None:
             super().__init__(init_state, player)
         else:
             super().__init__(init_state, init_state.active_player)
+        if rollouts is None and time_limit is None:
+            raise ValueError("MonteCarloAgent needs a number of rollouts, a time_limit or both")
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        if parallelism not in self.PARALLELISMS:
+            raise ValueError(f"parallelism must be one of {self.PARALLELISMS}")
+        if rave and (compact_tree or batch_size is not None or (workers > 1 and parallelism == 'leaf')):
+            raise ValueError("rave is not supported with compact_tree, batch_size or leaf parallelism")
+        if max_nodes is not None and max_nodes < 1:
+            raise ValueError("max_nodes must be at least 1")
         self.rollouts = rollouts
+        self.time_limit = time_limit
+        self.max_rollout_depth = max_rollout_depth
+        self.reuse_tree = reuse_tree
+        self.compact_tree = compact_tree
+        self.exploration = exploration if exploration is not None else DEFAULT_EXPLORATION
+        self.batch_size = batch_size
+        # None when RAVE is off, the nodes of the tree inherit it from the root
+        self.rave_equivalence = None
+        if rave:
+            self.rave_equivalence = rave_equivalence if rave_equivalence is not None else DEFAULT_RAVE_EQUIVALENCE
+        self.max_nodes = max_nodes
+        self.keep_states = keep_states
+        self.shared_memory = shared_memory
+        self.workers = workers
+        self.parallelism = parallelism
+        self.seed = seed if seed is not None else random.getrandbits(32)
+        self.rng = random.Random(self.seed)
+        self.searches = 0
+        self.rollouts_completed = 0
+        self.reused_visits = 0
+        self.root = None  # type: MonteCarloNode
+        self._merged_statistics = {}  # type: dict[any, tuple[int, float]]
+        self._pool = None
+        self._pool_finalizer = None  # type: weakref.finalize
+        self._shared_batch = None  # type: SharedStateBatch
+        self._shared_batch_finalizer = None  # type: weakref.finalize
+        self.on_rollout = None
 
     def get_next_action(self):
-        root = MonteCarloNode(self.current_state, self.player)
+        self.searches += 1
+        if self.workers > 1 and self.parallelism == 'root':
+            self.root = None
+            self.root_parallel_search()
+        else:
+            self.root = self.reused_root()
+            self.reused_visits = self.root.n if self.root is not None else 0
+            self.search(self.rollouts, self.time_limit)
+        return self.best_action()
+
+    def update_state(self, new_state: GameState, actions: list = None):
+        """
+        :param new_state: the current game state
+        :param actions: optionally, the actions taken since the agent's last move, used to find the new root directly
+        """
+        super().update_state(new_state)
+        if self.reuse_tree and self.root is not None and actions is not None:
+            self.root = self.root.descendant(actions)
+            if self.root is not None:
+                self.root = self.root.detach()
+        else:
+            self.root = self.reused_root()
+
+    def reused_root(self) -> 'MonteCarloNode':
+        """
+        Promote the node of the previous tree matching the current state to root, freeing the rest of the tree
+        :return: the new root, or None if the current state is not in the tree
+        """
+        if not self.reuse_tree or self.root is None:
+            return None
+        root = self.root.find(self.current_state, self.REUSE_DEPTH)
+        if root is not None:
+            root = root.detach()
+        return root
 
-        for i in range(self.rollouts):
+    def search(self, rollouts: int = None, time_limit: float = None):
+        """
+        Grow the current tree, stopping after the rollouts or the time limit, whichever comes first, or when a stop
+        is requested. Can be called repeatedly to keep improving the same tree.
+        """
+        if rollouts is None and time_limit is None:
+            raise ValueError("search needs a number of rollouts, a time_limit or both")
+        if self.root is None:
+            self.root = new_root(self.current_state, self.player, self.rng, self.compact_tree, self.exploration,
+                                 self.rave_equivalence, self.keep_states)
+        deadline = time.perf_counter() + time_limit if time_limit is not None else None
+        self.rollouts_completed = 0
+        if self.workers > 1:
+            self.leaf_parallel_search(self.root, rollouts, deadline)
+            return
+
+        batch_size = self.simulation_batch_size
+        while (rollouts is None or self.rollouts_completed < rollouts) \
+                and (deadline is None or time.perf_counter() < deadline):
+            self.root.rollout(self.max_rollout_depth, batch_size)
+            self.rollouts_completed += batch_size or 1
+            if self.max_nodes is not None:
+                enforce_node_budget(self.root, self.max_nodes)
+            if self.on_rollout is not None:
+                self.on_rollout(self)
+            # checked after the rollout, so a stopped search still has an action to return
+            if self.stop_requested:
+                break
+
+    @property
+    def simulation_batch_size(self) -> int:
+        """
+        :return: the number of games simulated together from each expanded node, None when simulating one at a time
+        """
+        if self.batch_size is not None and self.batch_size > 1 and self.current_state.supports_batch:
+            return self.batch_size
+        return None
+
+    def root_parallel_search(self):
+        """Grow an independent tree in every worker and merge the statistics of their root children"""
+        tasks = []
+        for worker in range(self.workers):
+            worker_rollouts = None
+            if self.rollouts is not None:
+                worker_rollouts = self.rollouts // self.workers + (1 if worker < self.rollouts % self.workers else 0)
+            tasks.append((self.current_state, self.player, worker_rollouts, self.task_seed(worker),
+                          self.time_limit, self.max_rollout_depth, self.compact_tree, self.exploration,
+                          self.simulation_batch_size, self.rave_equivalence, self.max_nodes, self.keep_states))
+
+        merged_statistics = {}
+        for statistics in self.pool.starmap(root_parallel_worker, tasks):
+            for action, (n, v) in statistics.items():
+                merged_n, merged_v = merged_statistics.get(action, (0, 0))
+                merged_statistics[action] = (merged_n + n, merged_v + v)
+        self._merged_statistics = merged_statistics
+        self.rollouts_completed = sum(n for n, v in merged_statistics.values())
+
+    def leaf_parallel_search(self, root: 'MonteCarloNode', rollouts: int = None, deadline: float = None):
+        """Grow a single tree, simulating a batch of one simulation per worker from every expanded node"""
+        batch = 0
+        batch_size = self.simulation_batch_size
+        while (rollouts is None or self.rollouts_completed < rollouts) \
+                and (deadline is None or time.perf_counter() < deadline):
             # Selection
             selected_node = root.selection()
             # Expansion
             expanded_node = selected_node.expansion(selected_node)
-            # Simulation
-            simulation_result = expanded_node.simulation(expanded_node)
+            # Simulation, the last batch only runs as many tasks as there are rollouts left
+            task_count = self.workers
+            if rollouts is not None:
+                task_count = min(task_count, -(-(rollouts - self.rollouts_completed) // (batch_size or 1)))
+            if expanded_node.state.is_terminal:
+                simulation_results = [(expanded_node.simulation(expanded_node), 1)] * task_count
+            elif self.shared_memory and expanded_node.state.supports_encode:
+                simulation_results = self.shared_simulations(expanded_node.state, batch, task_count, batch_size)
+            else:
+                tasks = [(expanded_node.state, self.task_seed(batch * self.workers + worker), self.max_rollout_depth,
+                          batch_size)
+                         for worker in range(task_count)]
+                simulation_results = self.pool.starmap(simulation_worker, tasks)
             # Backpropagation
-            expanded_node.backpropagation(simulation_result)
+            for simulation_result, visits in simulation_results:
+                expanded_node.backpropagation(simulation_result, visits)
+                self.rollouts_completed += visits
+            batch += 1
+            if self.max_nodes is not None:
+                enforce_node_budget(root, self.max_nodes)
+            if self.on_rollout is not None:
+                self.on_rollout(self)
+            if self.stop_requested:
+                break
+
+    def shared_simulations(self, state: GameState, batch: int, task_count: int, batch_size: int = None) \
+            -> list[tuple[dict[str, float], int]]:
+        """
+        Run simulation tasks from a state in the workers, passing the state and the results through shared memory
+        :param batch: the number of the leaf parallel batch, to seed the tasks with
+        :param task_count: the number of tasks, at most one per worker
+        :return: the summed utilities of each task's simulations and how many it ran
+        """
+        # the state is written once, every worker decodes it and writes its result to a row of its own
+        encoded = [state.encode()]
+        if self._shared_batch is None or not self._shared_batch.fits(encoded):
+            self.close_shared_batch()
+            # room for larger states later in the game, the players are those of the state's utility
+            self._shared_batch = SharedStateBatch(1, 2 * len(encoded[0]), tuple(state.utility),
+                                                  result_rows=self.workers)
+            # freed if the agent is dropped without being closed
+            self._shared_batch_finalizer = weakref.finalize(self, self._shared_batch.release)
+        shared_batch = self._shared_batch
+        shared_batch.write(encoded)
+        state_type = type(unwrap(state))
+        tasks = [(shared_batch.name, state_type, 0, worker, self.task_seed(batch * self.workers + worker),
+                  self.max_rollout_depth, batch_size)
+                 for worker in range(task_count)]
+        visits = self.pool.starmap(shared_simulation_worker, tasks)
+        return [(shared_batch.result(worker), worker_visits) for worker, worker_visits in enumerate(visits)]
+
+    def close_shared_batch(self):
+        if self._shared_batch is not None:
+            self._shared_batch_finalizer()
+            self._shared_batch = None
+
+    @property
+    def root_statistics(self) -> dict:
+        """
+        Safe to read from another thread while a search is running
+        :return: the (visits, total value) of each action from the root
+        """
+        if self.root is None:
+            return dict(self._merged_statistics)
+        return {child.last_action: (child.n, child.v) for child in list(self.root.children)}
+
+    def visit_counts(self) -> dict:
+        """
+        Safe to call from another thread while a search is running
+        :return: the number of simulations run through each action from the root so far
+        """
+        return {action: n for action, (n, v) in self.root_statistics.items()}
+
+    def best_action(self):
+        """
+        Safe to call from another thread while a search is running
+        :return: the best action found so far
+        """
+        return most_visited_action(self.root_statistics)
+
+    @property
+    def tree_size(self) -> int:
+        """
+        :return: the number of nodes in the current tree, 0 before the first search and with root parallelism
+        """
+        return self.root.tree_size if self.root is not None else 0
+
+    @property
+    def peak_tree_size(self) -> int:
+        """
+        :return: the most nodes the current tree has had at once, including those of earlier moves it was reused from
+        """
+        return self.root.peak_tree_size if self.root is not None else 0
+
+    def task_seed(self, task: int) -> str:
+        """
+        :return: the seed of a worker task, unique to the agent's seed, the move and the task
+        """
+        return f"{self.seed}:{self.searches}:{task}"
+
+    def start_instrumentation(self, stats: SearchStats):
+        self.on_rollout = stats.on_rollout
+
+    def finish_instrumentation(self, stats: SearchStats):
+        self.on_rollout = None
+        stats.rollouts = self.rollouts_completed
+        if self.root is None:
+            return
+        if self.compact_tree:
+            tree = self.root.tree
+            # states created during the search must not keep timing after it
+            tree.states = [unwrap(state) for state in tree.states]
+            depths = [0] * tree.size
+            for index in range(1, tree.size):
+                depths[index] = depths[int(tree.parents[index])] + 1
+            stats.tree_size = tree.size
+            stats.max_depth = max(depths) - depths[self.root.index] if depths else 0
+            return
+        stack = [(self.root, 0)]
+        while stack:
+            node, depth = stack.pop()
+            # dropped states are left dropped rather than rebuilt
+            node._state = unwrap(node._state)
+            stats.tree_size += 1
+            stats.max_depth = max(stats.max_depth, depth)
+            stack.extend((child, depth + 1) for child in node.children)
+
+    @property
+    def pool(self) -> multiprocessing.pool.Pool:
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.workers)
+            # the workers are terminated if the agent is dropped without being closed
+            self._pool_finalizer = weakref.finalize(self, self._pool.terminate)
+        return self._pool
+
+    def close(self):
+        """Shut down the worker processes and free the shared memory"""
+        if self._pool is not None:
+            self._pool_finalizer.detach()
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        self.close_shared_batch()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def amaf_value(statistics: list) -> float:
+    """
+    :param statistics: the AMAF [visits, total value] of an action, or None if it has never been played
+    :return: the mean value, infinite for actions never played so they are tried first
+    """
+    if statistics is None:
+        return float('inf')
+    return statistics[1] / statistics[0]
+
+
+def enforce_node_budget(root, max_nodes: int):
+    """
+    Prune a tree that has grown past max_nodes, leaving room for it to grow before it needs pruning again
+    """
+    if root.tree_size > max_nodes:
+        root.prune(int(max_nodes * PRUNE_TARGET))
 
-        # Get the best action
-        max_action = None
-        max_value = float('-inf')
-        for child in root.children:
-            if child.v > max_value:
-                max_value = child.v
-                max_action = child.last_action
-        return max_action
+
+def most_visited_action(statistics: dict) -> any:
+    """
+    :param statistics: the (visits, total value) of each root action
+    :return: the action simulated most often, ties broken by the higher total value
+    """
+    max_action = None
+    max_key = (-1, float('-inf'))
+    for action, (n, v) in statistics.items():
+        if (n, v) > max_key:
+            max_key = (n, v)
+            max_action = action
+    return max_action
+
+
+def new_root(state: GameState, player: str, rng: random.Random, compact_tree: bool = False,
+             exploration: float = DEFAULT_EXPLORATION, rave_equivalence: float = None, keep_states: bool = True):
+    """
+    :return: the root node of a new search tree
+    """
+    if compact_tree:
+        return CompactTree(state, player, rng, exploration=exploration, keep_states=keep_states).root
+    return MonteCarloNode(state, player, rng=rng, exploration=exploration, rave_equivalence=rave_equivalence,
+                          keep_states=keep_states)
+
+
+def root_parallel_worker(state: GameState, player: str, rollouts: int, seed: str,
+                         time_limit: float = None, max_rollout_depth: int = None, compact_tree: bool = False,
+                         exploration: float = DEFAULT_EXPLORATION, batch_size: int = None,
+                         rave_equivalence: float = None, max_nodes: int = None, keep_states: bool = True) -> dict:
+    """
+    Run in a worker process by root parallel search
+    :return: the (visits, total value) of each root action
+    """
+    deadline = time.perf_counter() + time_limit if time_limit is not None else None
+    root = new_root(state, player, random.Random(seed), compact_tree, exploration, rave_equivalence, keep_states)
+    completed = 0
+    while (rollouts is None or completed < rollouts) and (deadline is None or time.perf_counter() < deadline):
+        root.rollout(max_rollout_depth, batch_size)
+        completed += batch_size or 1
+        if max_nodes is not None:
+            enforce_node_budget(root, max_nodes)
+    return {child.last_action: (child.n, child.v) for child in root.children}
+
+
+def simulation_worker(state: GameState, seed: str, max_rollout_depth: int = None,
+                      batch_size: int = None) -> tuple[dict[str, float], int]:
+    """
+    Run in a worker process by leaf parallel search
+    :return: the utilities at the end of the random simulations from the state summed, and how many were run
+    """
+    if batch_size is not None:
+        return batch_random_simulation(state, batch_size, random.Random(seed), max_rollout_depth), batch_size
+    return random_simulation(state, random.Random(seed), max_rollout_depth), 1
+
+
+def shared_simulation_worker(name: str, state_type: type, index: int, result_index: int, seed: str,
+                             max_rollout_depth: int = None, batch_size: int = None) -> int:
+    """
+    Run in a worker process by leaf parallel search with shared memory
+    :param name: the name of the SharedStateBatch holding the state
+    :param index: the index of the state in the batch
+    :param result_index: the result row to write the summed utilities to
+    :return: the number of simulations run
+    """
+    shared_batch = attached_batch(name)
+    simulation_result, visits = simulation_worker(shared_batch.state(index, state_type), seed, max_rollout_depth,
+                                                  batch_size)
+    shared_batch.write_result(result_index, simulation_result)
+    return visits
+
+
+class TreeSize:
+    """The number of nodes in a tree of MonteCarloNode objects, shared by all of them"""
+
+    __slots__ = ('nodes', 'peak')
+
+    def __init__(self, nodes: int = 1):
+        self.nodes = nodes
+        self.peak = nodes
+
+    def add(self, nodes: int):
+        self.nodes += nodes
+        self.peak = max(self.peak, self.nodes)
 
 
 class MonteCarloNode:
 
-    def __init__(self, init_state: GameState, player: str, last_action: any = None, parent: 'MonteCarloNode' = None):
-        self.state = init_state
-        self.children = set()  # type: set[MonteCarloNode]
+    def __init__(self, init_state: GameState, player: str, last_action: any = None, parent: 'MonteCarloNode' = None,
+                 rng: random.Random = None, exploration: float = None, rave_equivalence: float = None,
+                 keep_states: bool = None):
+        """
+        :param exploration: the UCB exploration constant, inherited from the parent when not given
+        :param rave_equivalence: see MonteCarloAgent, inherited from the parent when not given, None turns RAVE off
+        :param keep_states: see MonteCarloAgent, inherited from the parent when not given, True for a root
+        """
+        self._state = init_state
+        self.rng = rng if rng is not None else random
+        self.children = []  # type: list[MonteCarloNode]
+        self.untried_actions = None  # type: list
         self.last_action = last_action
         self.player = player
         self.parent = parent
-        self.N = 0
+        if exploration is None:
+            exploration = parent.exploration if parent is not None else DEFAULT_EXPLORATION
+        self.exploration = exploration
+        if rave_equivalence is None and parent is not None:
+            rave_equivalence = parent.rave_equivalence
+        self.rave_equivalence = rave_equivalence
+        if keep_states is None:
+            keep_states = parent.keep_states if parent is not None else True
+        self.keep_states = keep_states
+        self.size = parent.size if parent is not None else TreeSize()
+        # values are stored from the perspective of the player who chose this node's action
+        self.mover = parent.state.active_player if parent is not None else None
         self.n = 0
         self.v = 0
+        # the AMAF [visits, total value] of the actions of this node's active player, by action
+        self.amaf = {} if rave_equivalence is not None else None  # type: dict[any, list]
+
+    @property
+    def state(self) -> GameState:
+        """
+        :return: the node's state, rebuilt from its parent's if it was dropped
+        """
+        state = self._state
+        if state is None:
+            state = self._state = self.parent.state.get_next_state(self.last_action)
+        return state
+
+    @state.setter
+    def state(self, state: GameState):
+        self._state = state
+
+    @property
+    def tree_size(self) -> int:
+        return self.size.nodes
+
+    @property
+    def peak_tree_size(self) -> int:
+        return self.size.peak
+
+    def prune(self, max_nodes: int):
+        """
+        Cut off the subtrees of the least visited nodes of the tree below this root until it has at most max_nodes
+        nodes, or only the root and its children are left. The nodes cut off keep their own statistics and are
+        expanded again when next selected.
+        """
+        if self.size.nodes <= max_nodes:
+            return
+        # breadth first, so parents come before their children
+        nodes = [self]
+        parents = [-1]
+        for index, node in enumerate(nodes):
+            nodes.extend(node.children)
+            parents.extend([index] * len(node.children))
+        pruned = nodes_to_prune(parents, [node.n for node in nodes], [bool(node.children) for node in nodes],
+                                max_nodes)
+        removed = 0
+        for index in pruned:
+            node = nodes[index]
+            removed += node.count_nodes() - 1
+            node.children = []
+            node.untried_actions = None
+        self.size.nodes = len(nodes) - removed
+
+    def count_nodes(self) -> int:
+        """
+        :return: the number of nodes in the subtree below this node, including itself
+        """
+        count = 0
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            count += 1
+            stack.extend(node.children)
+        return count
+
+    def descendant(self, actions: list) -> 'MonteCarloNode':
+        """
+        :return: the node reached by taking the actions from this node, or None if it has not been expanded
+        """
+        node = self
+        for action in actions:
+            node = next((child for child in node.children if child.last_action == action), None)
+            if node is None:
+                return None
+        return node
+
+    def find(self, state: GameState, max_depth: int) -> 'MonteCarloNode':
+        """
+        Breadth first search for the node of a state
+        :return: the node with an equal state at most max_depth actions below this node, or None
+        """
+        layer = [self]
+        for depth in range(max_depth + 1):
+            for node in layer:
+                if node.state == state:
+                    return node
+            layer = [child for node in layer for child in node.children]
+        return None
+
+    def detach(self) -> 'MonteCarloNode':
+        """
+        :return: this node as the root of a tree of its own, so the rest of the old tree can be freed
+        """
+        if self.parent is None:
+            return self
+        # the root's state is kept, the others are rebuilt from it
+        self.state = self.state
+        self.parent = None
+        self.size.nodes = self.count_nodes()
+        return self
 
     def ucb(self):
-        return self.v / self.n + 2 * math.sqrt(math.log(self.N) / self.n)
+        value = self.v / self.n
+        if self.rave_equivalence is not None:
+            amaf = self.parent.amaf.get(self.last_action)
+            if amaf is not None:
+                # the AMAF value is trusted less as the child's own visits grow
+                beta = math.sqrt(self.rave_equivalence / (3 * self.n + self.rave_equivalence))
+                value = (1 - beta) * value + beta * amaf[1] / amaf[0]
+        return value + self.exploration * math.sqrt(math.log(self.parent.n) / self.n)
+
+    def rollout(self, max_rollout_depth: int = None, batch_size: int = None):
+        """
+        Run one selection, expansion, simulation and backpropagation from this node
+        :param batch_size: simulate this many games in lockstep with the state's to_batch instead of one
+        """
+        # Selection
+        selected_node = self.selection()
+        # Expansion
+        expanded_node = selected_node.expansion(selected_node)
+        # Simulation
+        played = [] if self.rave_equivalence is not None else None
+        if batch_size is not None:
+            simulation_result = batch_random_simulation(expanded_node.state, batch_size, self.rng, max_rollout_depth)
+        else:
+            simulation_result = expanded_node.simulation(expanded_node, max_rollout_depth, played)
+        # Backpropagation
+        expanded_node.backpropagation(simulation_result, batch_size or 1, played)
 
     def selection(self):
-        """Select highest UCB until leaf node is reached"""
+        """Select highest UCB until a node with untried actions or a terminal node is reached"""
         current_node = self
-        while current_node.children:
+        while current_node.untried_actions == [] and current_node.children:
             max_ucb = float('-inf')
             max_ucb_node = None
             for child in current_node.children:
@@ -67,35 +631,74 @@ class MonteCarloNode:
         return current_node
 
     def expansion(self, selected_node: 'MonteCarloNode'):
-        """Expand Leaf Node with a new child"""
-        if self.state.is_terminal:
-            return self
+        """Expand the selected node with a child for one of its untried actions"""
+        if selected_node.state.is_terminal:
+            return selected_node
 
-        random_action = random.choice(self.state.legal_actions)
-        next_state = self.state.get_next_state(random_action)
-        new_node = MonteCarloNode(next_state, self.player, random_action, selected_node)
-        selected_node.children.add(new_node)
+        if selected_node.untried_actions is None:
+            selected_node.untried_actions = list(selected_node.state.legal_actions)
+        untried_actions = selected_node.untried_actions
+        if selected_node.amaf:
+            # try the action with the best AMAF value first, and those never played yet before any other
+            amaf = selected_node.amaf
+            index = max(range(len(untried_actions)), key=lambda i: amaf_value(amaf.get(untried_actions[i])))
+        else:
+            # pick a random untried action
+            index = self.rng.randrange(len(untried_actions))
+        # swap the chosen action to the end so it can be removed in constant time
+        untried_actions[index], untried_actions[-1] = untried_actions[-1], untried_actions[index]
+        action = untried_actions.pop()
+
+        next_state = selected_node.state.get_next_state(action)
+        new_node = MonteCarloNode(next_state, self.player, action, selected_node, self.rng)
+        selected_node.children.append(new_node)
+        selected_node.size.add(1)
+        # every child has its own state now, the root's is kept to rebuild the others from
+        if not untried_actions and not selected_node.keep_states and selected_node.parent is not None:
+            selected_node._state = None
         return new_node
 
-    def simulation(self, child_node: 'MonteCarloNode'):
-        """Simulate from new child"""
-        simulation_state = child_node.state
-        while not simulation_state.is_terminal:
-            random_action = random.choice(simulation_state.legal_actions)
-            simulation_state = simulation_state.get_next_state(random_action)
-        return simulation_state.utility[self.player]
+    def simulation(self, child_node: 'MonteCarloNode', max_depth: int = None,
+                   played: list = None) -> dict[str, float]:
+        """
+        Simulate from new child, scoring with the state's utility if cut off after max_depth actions
+        :param played: if given, the (player, action) of every simulated action is appended to it
+        """
+        return random_simulation(child_node.state, self.rng, max_depth, played)
 
-    def backpropagation(self, simulation_result: float):
-        """Update all nodes from leaf to root"""
+    def backpropagation(self, simulation_result: dict[str, float], visits: int = 1, played: list = None):
+        """
+        Update all nodes from leaf to root, each with the result for the player who chose it
+        :param visits: the number of simulations the result is the sum of
+        :param played: the (player, action) of every simulated action, to update the AMAF statistics with
+        """
         current_node = self
         while current_node is not None:
-            current_node.N += 1
-            current_node.n += 1
-            current_node.v += simulation_result
+            current_node.n += visits
+            if current_node.mover is not None:
+                current_node.v += simulation_result[current_node.mover]
+            if played is not None:
+                current_node.update_amaf(simulation_result, played)
+                # the node's own action was played after every node above it
+                if current_node.mover is not None:
+                    played.append((current_node.mover, current_node.last_action))
             current_node = current_node.parent
 
-    def __hash__(self):
-        return hash(self.state)
-
-    def __eq__(self, other):
-        return self.state == other.state
+    def update_amaf(self, simulation_result: dict[str, float], played: list):
+        """
+        Credit every action the active player took below this node with the result, once per simulation
+        """
+        # the mover of the children, so a dropped state is not rebuilt
+        player = self.children[0].mover if self.children else self.state.active_player
+        value = simulation_result[player]
+        amaf = self.amaf
+        credited = set()
+        for mover, action in played:
+            if mover == player and action not in credited:
+                credited.add(action)
+                statistics = amaf.get(action)
+                if statistics is None:
+                    amaf[action] = [1, value]
+                else:
+                    statistics[0] += 1
+                    statistics[1] += value
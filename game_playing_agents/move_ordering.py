@@ -0,0 +1,92 @@
+from abc import ABC, abstractmethod
+from .state import GameState
+
+
+class MoveOrderer(ABC):
+    """
+    Scores actions so a search can try the most promising ones first.
+    Higher scores are searched first.
+    """
+
+    @abstractmethod
+    def score(self, state: GameState, action, ply: int) -> float:
+        """
+        :param state: the state the action is taken from
+        :param action: the action to score
+        :param ply: the distance of the state from the root of the search
+        :return: the priority of the action
+        """
+        ...
+
+    def record_cutoff(self, state: GameState, action, ply: int, depth: int):
+        """
+        Called when an action causes an alpha-beta cutoff
+        :param depth: the remaining search depth below the state
+        """
+        pass
+
+    def new_search(self):
+        """Called before each new search from the root"""
+        pass
+
+
+class StatePriorityOrderer(MoveOrderer):
+    """Orders actions by GameState.action_priority, e.g. captures first"""
+
+    def score(self, state: GameState, action, ply: int) -> float:
+        return state.action_priority(action)
+
+
+class KillerMoveOrderer(MoveOrderer):
+    """Tries actions that recently caused a cutoff at the same ply first"""
+
+    def __init__(self, slots: int = 2):
+        self.slots = slots
+        self.killers = []  # type: list[list]
+
+    def score(self, state: GameState, action, ply: int) -> float:
+        if ply >= len(self.killers):
+            return 0
+        killers = self.killers[ply]
+        if action in killers:
+            return self.slots - killers.index(action)
+        return 0
+
+    def record_cutoff(self, state: GameState, action, ply: int, depth: int):
+        while ply >= len(self.killers):
+            self.killers.append([])
+        killers = self.killers[ply]
+        if action in killers:
+            killers.remove(action)
+        killers.insert(0, action)
+        del killers[self.slots:]
+
+    def new_search(self):
+        self.killers = []
+
+
+class HistoryOrderer(MoveOrderer):
+    """Tries actions that have caused deep cutoffs anywhere in the tree first"""
+
+    def __init__(self, decay: float = 0.5):
+        """
+        :param decay: the factor history scores are multiplied by between searches
+        """
+        self.decay = decay
+        self.history = {}  # type: dict[any, float]
+
+    def score(self, state: GameState, action, ply: int) -> float:
+        return self.history.get(action, 0)
+
+    def record_cutoff(self, state: GameState, action, ply: int, depth: int):
+        self.history[action] = self.history.get(action, 0) + depth * depth
+
+    def new_search(self):
+        self.history = {action: score * self.decay for action, score in self.history.items() if score * self.decay >= 1}
+
+
+def default_move_ordering() -> list[MoveOrderer]:
+    """
+    :return: state priorities first, then killer moves, then the history heuristic
+    """
+    return [StatePriorityOrderer(), KillerMoveOrderer(), HistoryOrderer()]
@@ -0,0 +1,173 @@
+from .state import GameState
+from .minimax_agent import MiniMaxAgent
+from .transposition_table import TranspositionTable
+from .tournament import AgentFactory, play_game
+from copy import copy
+import mmap
+import random
+import struct
+
+# a book file is a header followed by an open addressing hash table of (state key, action index) slots
+MAGIC = b'GPABOOK1'
+HEADER = struct.Struct('<8sQQ')  # magic, number of slots, number of entries
+SLOT = struct.Struct('<QQ')  # state key, index of the action in the state's legal_actions
+EMPTY = 0
+
+
+def book_key(state: GameState) -> int:
+    """
+    The state hash must be the same in every process, e.g. a Zobrist hash, for a book to be reused
+    :return: the 64 bit key of a state in a book, never EMPTY
+    """
+    return hash(state) & 0xFFFFFFFFFFFFFFFF or 1
+
+
+def write_book(path: str, entries: dict[int, int], load_factor: float = 0.5):
+    """
+    :param entries: the index of the book action in legal_actions, by book_key of the state
+    :param load_factor: the largest fraction of slots in use, lower is faster to look up in but larger
+    """
+    if not 0 < load_factor < 1:
+        raise ValueError("load_factor must be between 0 and 1, a book needs empty slots to end lookups")
+    slots = 2
+    while slots * load_factor < len(entries):
+        slots *= 2
+    mask = slots - 1
+    table = bytearray(SLOT.size * slots)
+    for key, action_index in entries.items():
+        # Linear Probing: use the next free slot after the one the key hashes to
+        index = key & mask
+        while SLOT.unpack_from(table, index * SLOT.size)[0] != EMPTY:
+            index = (index + 1) & mask
+        SLOT.pack_into(table, index * SLOT.size, key, action_index)
+    with open(path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, slots, len(entries)))
+        file.write(table)
+
+
+class OpeningBook:
+    """
+    Read only position to action table in a book file, memory mapped so opening it does not read the table.
+    Actions are stored as their index in legal_actions, which must list actions in the same order in every process.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.slots, self.entries = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not an opening book")
+        self.mask = self.slots - 1
+        self.hits = 0
+        self.misses = 0
+
+    def lookup_key(self, key: int) -> int:
+        """
+        :return: the action index stored for a book key, or None if there is none
+        """
+        index = key & self.mask
+        # bounded in case the table has no empty slot left, e.g. a book written by another tool
+        for _ in range(self.slots):
+            slot_key, action_index = SLOT.unpack_from(self.buffer, HEADER.size + index * SLOT.size)
+            if slot_key == key:
+                return action_index
+            if slot_key == EMPTY:
+                return None
+            index = (index + 1) & self.mask
+        return None
+
+    def lookup(self, state: GameState):
+        """
+        :return: the book action for a state, or None if the state is not in the book
+        """
+        action_index = self.lookup_key(book_key(state))
+        if action_index is not None:
+            actions = state.legal_actions
+            # an index out of range means the key belongs to another position
+            if action_index < len(actions):
+                self.hits += 1
+                return actions[action_index]
+        self.misses += 1
+        return None
+
+    def __contains__(self, state: GameState) -> bool:
+        return self.lookup_key(book_key(state)) is not None
+
+    def __len__(self):
+        return self.entries
+
+    def close(self):
+        self.buffer.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __getstate__(self):
+        # reopened from the path, e.g. when sent to a worker process
+        return {'path': self.path}
+
+    def __setstate__(self, state: dict):
+        self.__init__(state['path'])
+
+
+def book_entry(state: GameState, action) -> tuple[int, int]:
+    """
+    :return: the book key of the state and the index of the action
+    """
+    return book_key(state), state.legal_actions.index(action)
+
+
+def self_play_entries(state: GameState, factory: AgentFactory, games: int, plies: int, seed: int = 0) \
+        -> dict[int, int]:
+    """
+    Play games of an agent against itself and keep the action it chose most often in each early position
+    :param factory: called as factory(state, player=player) for every player of every game
+    :param plies: the number of actions from the start of each game to keep
+    :param seed: the random module is seeded with seed + game before each game
+    :return: book entries for write_book
+    """
+    counts = {}  # type: dict[tuple[int, int], int]
+    for game in range(games):
+        random.seed(seed + game)
+        agents = {player: factory(copy(state), player=player) for player in state.utility}
+        record = play_game(copy(state), agents, max_moves=plies)
+        position = state
+        for action in record['moves']:
+            entry = book_entry(position, action)
+            counts[entry] = counts.get(entry, 0) + 1
+            position = position.get_next_state(action)
+
+    entries = {}
+    for (key, action_index), count in sorted(counts.items(), key=lambda item: item[1], reverse=True):
+        entries.setdefault(key, action_index)
+    return entries
+
+
+def solved_entries(state: GameState, depth: int, max_positions: int = None) -> dict[int, int]:
+    """
+    Search every position reachable from a state with MiniMaxAgent, e.g. to build a tablebase of a small game
+    :param depth: the search depth, deep enough to reach the end of the game to solve it
+    :param max_positions: stop after this many positions
+    :return: book entries for write_book
+    """
+    tables = {}  # type: dict[str, TranspositionTable]
+    entries = {}
+    stack = [state]
+    while stack and (max_positions is None or len(entries) < max_positions):
+        position = stack.pop()
+        key = book_key(position)
+        if key in entries or position.is_terminal:
+            continue
+        player = position.active_player
+        # values in a transposition table are from one player's perspective
+        table = tables.setdefault(player, TranspositionTable(2 ** 16))
+        action = MiniMaxAgent(position, depth, player, transposition_table=table).get_next_action()
+        entries[key] = position.legal_actions.index(action)
+        stack.extend(position.get_next_state(action) for action in position.legal_actions)
+    return entries
@@ -0,0 +1,152 @@
+from .state import GameState
+from multiprocessing import shared_memory
+from typing import Sequence
+import struct
+
+import numpy as np
+
+# the block starts with its capacity, the number of result rows, the size of the state data area and the size of
+# the player names
+HEADER = struct.Struct('<QQQQ')
+
+
+class SharedStateBatch:
+    """
+    A batch of encoded game states and rows of results in a block of shared memory, so a coordinator and its worker
+    processes can pass them by the block's name instead of pickling the states into every task.
+    Workers decode the states straight from the shared buffer and write their results in place, as one float per
+    player. There is a result row per state by default, or e.g. one per worker when they all start from the same
+    state. The block is laid out as the header, the player names, the offsets of the states, the results and the
+    state data.
+    """
+
+    def __init__(self, capacity: int, data_size: int, players: Sequence[str], name: str = None,
+                 result_rows: int = None):
+        """
+        Create a new block, or attach to an existing one when a name is given, in which case the other arguments
+        are read from its header
+        :param capacity: the number of states a batch can hold
+        :param data_size: the total size of the encoded states a batch can hold in bytes
+        :param players: the players of the results, in the order they are stored
+        :param result_rows: the number of results, capacity by default
+        """
+        if name is None:
+            result_rows = result_rows if result_rows is not None else capacity
+            names = '\0'.join(players).encode()
+            size = HEADER.size + len(names) + 8 * (capacity + 1) + 8 * result_rows * len(players) + data_size
+            self.memory = shared_memory.SharedMemory(create=True, size=size)
+            HEADER.pack_into(self.memory.buf, 0, capacity, result_rows, data_size, len(names))
+            self.memory.buf[HEADER.size:HEADER.size + len(names)] = names
+        else:
+            self.memory = shared_memory.SharedMemory(name)
+            capacity, result_rows, data_size, names_size = HEADER.unpack_from(self.memory.buf, 0)
+            players = bytes(self.memory.buf[HEADER.size:HEADER.size + names_size]).decode().split('\0')
+        self.capacity = capacity
+        self.data_size = data_size
+        self.players = tuple(players)
+        offset = HEADER.size + len('\0'.join(self.players).encode())
+        # offsets[i] and offsets[i + 1] are where state i starts and ends in the data
+        self.offsets = np.ndarray(capacity + 1, dtype=np.int64, buffer=self.memory.buf, offset=offset)
+        offset += self.offsets.nbytes
+        self.results = np.ndarray((result_rows, len(self.players)), dtype=np.float64, buffer=self.memory.buf,
+                                  offset=offset)
+        offset += self.results.nbytes
+        self.data = self.memory.buf[offset:offset + data_size]
+        self.count = 0
+
+    @property
+    def name(self) -> str:
+        return self.memory.name
+
+    def fits(self, encoded: Sequence[bytes]) -> bool:
+        """
+        :return: True if the encoded states fit in one batch
+        """
+        return len(encoded) <= self.capacity and sum(map(len, encoded)) <= self.data_size
+
+    def write(self, encoded: Sequence[bytes]):
+        """
+        Replace the batch with states already encoded with GameState.encode
+        """
+        if not self.fits(encoded):
+            raise ValueError(f"{len(encoded)} states of {sum(map(len, encoded))} bytes do not fit in a batch of "
+                             f"{self.capacity} states and {self.data_size} bytes")
+        offset = 0
+        offsets = [0]
+        for data in encoded:
+            self.data[offset:offset + len(data)] = data
+            offset += len(data)
+            offsets.append(offset)
+        self.offsets[:len(offsets)] = offsets
+        self.results[:] = 0
+        self.count = len(encoded)
+
+    def write_states(self, states: Sequence[GameState]):
+        self.write([state.encode() for state in states])
+
+    def encoded(self, index: int) -> memoryview:
+        """
+        :return: the encoded state at an index, a view of the shared buffer valid until the batch is rewritten
+        """
+        return self.data[int(self.offsets[index]):int(self.offsets[index + 1])]
+
+    def state(self, index: int, state_type: type) -> GameState:
+        """
+        :param state_type: the GameState class the state was encoded from
+        :return: the decoded state at an index
+        """
+        data = self.encoded(index)
+        try:
+            return state_type.decode(data)
+        finally:
+            data.release()
+
+    def write_result(self, index: int, utilities: dict[str, float]):
+        """
+        :param index: the result row, that of the state with the same index unless the rows are used otherwise
+        """
+        row = self.results[index]
+        for column, player in enumerate(self.players):
+            row[column] = utilities[player]
+
+    def result(self, index: int) -> dict[str, float]:
+        return dict(zip(self.players, self.results[index].tolist()))
+
+    def close(self):
+        """Detach from the block, which stays available to other processes until it is unlinked"""
+        # the views of the buffer must be released before the block can be closed
+        self.offsets = self.results = None
+        self.data.release()
+        self.memory.close()
+
+    def unlink(self):
+        """Free the block, called once by the process that created it"""
+        self.memory.unlink()
+
+    def release(self):
+        """Close and unlink the block, for the process that created it"""
+        self.close()
+        self.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+# the batch a worker process last attached to, kept open so tasks on the same batch do not attach again
+_attached = None  # type: SharedStateBatch
+
+
+def attached_batch(name: str) -> SharedStateBatch:
+    """
+    Called in a worker process
+    :return: the batch of a shared memory block, attaching to it unless this process already has
+    """
+    global _attached
+    if _attached is None or _attached.name != name:
+        if _attached is not None:
+            _attached.close()
+        _attached = SharedStateBatch(0, 0, (), name)
+    return _attached
@@ -1,5 +1,6 @@
 from .state import GameState
 from .game_agent import GameAgent
+from copy import copy
 
 
 class SimpleMaxAgent(GameAgent):
@@ -13,5 +14,22 @@ class SimpleMaxAgent(GameAgent):
     def get_next_action(self):
         actions = self.current_state.legal_actions
         # get the max action based on the utility of the state after taking the action
-        max_action = max(actions, key=lambda action: self.current_state.get_next_state(action).utility[self.player])
+        if self.current_state.supports_evaluate_children:
+            utilities = self.current_state.evaluate_children(actions, self.player)
+            max_action = actions[max(range(len(actions)), key=utilities.__getitem__)]
+        elif self.current_state.supports_undo:
+            state = copy(self.current_state)
+            max_action = max(actions, key=lambda action: self.applied_utility(state, action))
+        else:
+            max_action = max(actions, key=lambda action: self.current_state.get_next_state(action).utility[self.player])
         return max_action
+
+    def applied_utility(self, state: GameState, action) -> float:
+        """
+        :return: the utility of the state after taking the action in place, the state is restored afterwards
+        """
+        state.apply(action)
+        try:
+            return state.utility[self.player]
+        finally:
+            state.undo()
@@ -0,0 +1,50 @@
+from .state import GameState
+
+from copy import copy
+import random
+
+import numpy as np
+
+
+def random_simulation(state: GameState, rng: random.Random = random, max_depth: int = None,
+                      played: list = None) -> dict[str, float]:
+    """
+    Play random actions from a state until the game ends, or until max_depth actions have been taken
+    :param played: if given, the (player, action) of every action taken is appended to it
+    :return: the utilities of the final state
+    """
+    depth = 0
+    if state.supports_undo:
+        # play the whole simulation in place on a single copy
+        state = copy(state)
+        while not state.is_terminal and (max_depth is None or depth < max_depth):
+            random_action = rng.choice(state.legal_actions)
+            if played is not None:
+                played.append((state.active_player, random_action))
+            state.apply(random_action)
+            depth += 1
+        return state.utility
+
+    while not state.is_terminal and (max_depth is None or depth < max_depth):
+        random_action = rng.choice(state.legal_actions)
+        if played is not None:
+            played.append((state.active_player, random_action))
+        state = state.get_next_state(random_action)
+        depth += 1
+    return state.utility
+
+
+def batch_random_simulation(state: GameState, size: int, rng: random.Random = random,
+                            max_depth: int = None) -> dict[str, float]:
+    """
+    Play size random games from a state in lockstep through its BatchGameState
+    :return: the utilities of the final states, summed over the games
+    """
+    batch = state.to_batch(size)
+    generator = np.random.default_rng(rng.getrandbits(64))
+    depth = 0
+    while not batch.is_terminal.all() and (max_depth is None or depth < max_depth):
+        batch.step(batch.random_actions(generator))
+        depth += 1
+    totals = batch.utility.sum(axis=0)
+    return {player: float(total) for player, total in zip(batch.players, totals)}
@@ -0,0 +1,161 @@
+from .state import GameState
+from .game_agent import GameAgent
+from .instrumentation import SearchStats
+from .minimax_agent import SearchTimeout
+from .transposition_table import EXACT, LOWER, UPPER
+from copy import copy
+import struct
+
+# a solved table file is a header followed by one record per position
+MAGIC = b'GPASOLV1'
+HEADER = struct.Struct('<8sQ')  # magic, number of records
+RECORD = struct.Struct('<QdB')  # canonical key, value, bound
+
+
+def solver_key(state: GameState) -> int:
+    """
+    :return: the 64 bit key of a state in a solved table, the same for all of its symmetries
+    """
+    return state.canonical_hash() & 0xFFFFFFFFFFFFFFFF
+
+
+def score(state: GameState) -> float:
+    """
+    :return: the utility of a terminal state to its active player, less the best utility of the other players
+    """
+    utility = state.utility
+    player = state.active_player
+    return utility[player] - max(value for other, value in utility.items() if other != player)
+
+
+def write_solved_table(path: str, table: dict[int, tuple[float, int]]):
+    """
+    :param table: the table of a SolverAgent
+    """
+    with open(path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, len(table)))
+        file.write(b''.join(RECORD.pack(key, value, bound) for key, (value, bound) in table.items()))
+
+
+def read_solved_table(path: str) -> dict[int, tuple[float, int]]:
+    """
+    :return: a table written by write_solved_table, to pass to a SolverAgent
+    """
+    with open(path, 'rb') as file:
+        data = file.read()
+    magic, records = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a solved table")
+    return {key: (value, bound) for key, value, bound in RECORD.iter_unpack(data[HEADER.size:])}
+
+
+class SolverAgent(GameAgent):
+    """
+    Plays perfectly in zero-sum games small enough to search to the end, e.g. 4x4 tic-tac-toe, with a memoized
+    negamax search. Every position solved is kept in a table keyed by GameState.canonical_hash, so transpositions
+    and symmetric positions are only searched once. Values in the table are from the perspective of the position's
+    active player, so one table can be shared by the agents of every player and saved with write_solved_table.
+    """
+
+    # how many nodes are searched between checks for a stop request
+    STOP_CHECK_INTERVAL = 256
+
+    def __init__(self, init_state: GameState, player: str = None, table: dict[int, tuple[float, int]] = None):
+        """
+        :param table: positions solved earlier, by solver_key, as (value, bound) to the active player
+        """
+        super().__init__(init_state, player if player is not None else init_state.active_player)
+        self.table = table if table is not None else {}
+        self.nodes_searched = 0
+        self._in_place = False
+
+    def get_next_action(self):
+        self.nodes_searched = 0
+        state = self.current_state
+        # states that support apply and undo are searched in place, on a copy so the game's own state is untouched
+        self._in_place = state.supports_undo
+        if self._in_place:
+            state = copy(state)
+        best_action = None
+        best_value = float('-inf')
+        try:
+            for action in state.legal_actions:
+                # only an action better than the best so far needs an exact value
+                value = self.child_value(state, action, best_value, float('inf'))
+                if value > best_value:
+                    best_value = value
+                    best_action = action
+        except SearchTimeout:
+            # positions solved before the stop stay in the table
+            if best_action is None:
+                best_action = self.current_state.legal_actions[0]
+        return best_action
+
+    def value(self, state: GameState) -> float:
+        """
+        :return: the value of a state to its active player with perfect play from both sides
+        """
+        self._in_place = state.supports_undo
+        return self.negamax(copy(state) if self._in_place else state, float('-inf'), float('inf'))
+
+    def child_value(self, state: GameState, action, alpha: float, beta: float) -> float:
+        """
+        :return: the value to the active player of the state reached by an action
+        """
+        player = state.active_player
+        if self._in_place:
+            state.apply(action)
+            child = state
+        else:
+            child = state.get_next_state(action)
+        # a player moving again keeps the window, otherwise it is negated for the opponent
+        if child.active_player == player:
+            value = self.negamax(child, alpha, beta)
+        else:
+            value = -self.negamax(child, -beta, -alpha)
+        if self._in_place:
+            state.undo()
+        return value
+
+    def negamax(self, state: GameState, alpha: float, beta: float) -> float:
+        """
+        :return: the value of the state to its active player, exact if it is between alpha and beta,
+                 otherwise a bound on the side of the window it falls outside of
+        """
+        self.nodes_searched += 1
+        if self.stop_requested and self.nodes_searched % self.STOP_CHECK_INTERVAL == 0:
+            raise SearchTimeout()
+        key = solver_key(state)
+        entry = self.table.get(key)
+        if entry is not None:
+            value, bound = entry
+            if bound == EXACT or (bound == LOWER and value >= beta) or (bound == UPPER and value <= alpha):
+                return value
+
+        if state.is_terminal:
+            value = score(state)
+            self.table[key] = (value, EXACT)
+            return value
+
+        original_alpha = alpha
+        best_value = float('-inf')
+        for action in state.legal_actions:
+            value = self.child_value(state, action, alpha, beta)
+            if value > best_value:
+                best_value = value
+                alpha = max(alpha, value)
+                if alpha >= beta:
+                    break
+
+        if best_value <= original_alpha:
+            bound = UPPER
+        elif best_value >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        self.table[key] = (best_value, bound)
+        return best_value
+
+    def finish_instrumentation(self, stats: SearchStats):
+        stats.nodes = self.nodes_searched
+        stats.tree_size = len(self.table)
@@ -1,4 +1,7 @@
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from functools import wraps
+from typing import Sequence
 
 
 class GameState(ABC):
@@ -46,7 +49,7 @@ class GameState(ABC):
     @abstractmethod
     def get_winner(self) -> str:
         """
-        :return: the winner of the game if the game is over, or None if the game is not terminal
+        :return: the winner of the game if the game is over, "" for a draw, or None if the game is not terminal
         """
         ...
 
@@ -58,6 +61,99 @@ class GameState(ABC):
         """
         ...
 
+    def apply(self, action):
+        """
+        Optional: take an action in place, so this state becomes the next game state without allocating a new one
+        param action: the action to take
+        """
+        raise NotImplementedError
+
+    def undo(self):
+        """
+        Optional: reverse the last action taken with apply
+        """
+        raise NotImplementedError
+
+    @property
+    def supports_undo(self) -> bool:
+        """
+        :return: True if the state implements the optional apply and undo methods
+        """
+        return type(self).apply is not GameState.apply and type(self).undo is not GameState.undo
+
+    def to_batch(self, size: int) -> 'BatchGameState':
+        """
+        Optional: vectorized copies of this state for simulating many games at once
+        param size: the number of copies
+        :return: a BatchGameState holding size copies of this state
+        """
+        raise NotImplementedError
+
+    @property
+    def supports_batch(self) -> bool:
+        """
+        :return: True if the state implements the optional to_batch method
+        """
+        return type(self).to_batch is not GameState.to_batch
+
+    def action_priority(self, action) -> float:
+        """
+        Optional cheap estimate of how promising an action is, used to order searches (e.g. captures first)
+        param action: a legal action from this state
+        :return: the priority of the action, higher is searched first
+        """
+        return 0
+
+    def evaluate_children(self, actions: list, player: str) -> Sequence[float]:
+        """
+        Optional: the utility to a player of the state reached by each action, all in one call so a game can
+        vectorize its evaluation (e.g. material or line counts) instead of building every next state
+        param actions: legal actions from this state
+        :return: the utilities in the order of the actions, e.g. a list or a NumPy array
+        """
+        raise NotImplementedError
+
+    @property
+    def supports_evaluate_children(self) -> bool:
+        """
+        :return: True if the state implements the optional evaluate_children method
+        """
+        return type(self).evaluate_children is not GameState.evaluate_children
+
+    def encode(self) -> bytes:
+        """
+        Optional: this state as compact bytes, e.g. for passing it between processes more cheaply than pickling it.
+        Anything decode does not need, such as the history of a board, can be left out.
+        :return: bytes from which decode builds a state equal to this one
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def decode(cls, data) -> 'GameState':
+        """
+        Optional: the inverse of encode
+        param data: bytes or a memoryview written by encode, only valid during the call
+        :return: the state the data was encoded from
+        """
+        raise NotImplementedError
+
+    @property
+    def supports_encode(self) -> bool:
+        """
+        :return: True if the state implements the optional encode and decode methods
+        """
+        cls = type(self)
+        return cls.encode is not GameState.encode and cls.decode.__func__ is not GameState.decode.__func__
+
+    def canonical_hash(self) -> int:
+        """
+        Optional: a hash shared by every state equivalent to this one under the game's symmetries (e.g. the
+        rotations and reflections of a board), so a solver stores them once. Equivalent states must have the same
+        utilities and active player.
+        :return: the hash of the canonical form of the state, by default the hash of the state itself
+        """
+        return hash(self)
+
     @abstractmethod
     def __str__(self) -> str:
         """
@@ -71,3 +167,143 @@ class GameState(ABC):
         :return: a copy of the game state
         """
         ...
+
+
+_MISSING = object()
+
+
+class EvaluationCache:
+    """
+    Least recently used cache of evaluation results keyed by state hash, shared by every state in the process.
+    States with equal hashes are assumed to be equal, so the state hash should be strong (e.g. Zobrist).
+    """
+
+    def __init__(self, max_entries: int = 2 ** 16):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        value = self.entries.get(key, _MISSING)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    @property
+    def hit_rate(self) -> float:
+        """
+        :return: the fraction of lookups answered from the cache
+        """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class cached_state_property:
+    """
+    Property decorator memoizing the value in the state instance, like functools.cached_property.
+    Cached values must be treated as read only and are forgotten by clear_state_cache.
+    Use as @cached_state_property or @cached_state_property(shared=True).
+    """
+
+    def __init__(self, function=None, shared: bool = False):
+        """
+        :param shared: also look the value up by state hash in CachedGameState.evaluation_cache, when one is set
+        """
+        self.function = function
+        self.shared = shared
+        self.name = function.__name__ if function is not None else None
+        self.__doc__ = getattr(function, '__doc__', None)
+
+    def __call__(self, function):
+        return cached_state_property(function, self.shared)
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        # only called on a miss, after which the value in the instance __dict__ hides the descriptor
+        evaluation_cache = CachedGameState.evaluation_cache if self.shared else None
+        if evaluation_cache is not None:
+            key = (hash(instance), self.name)
+            value = evaluation_cache.get(key, _MISSING)
+            if value is _MISSING:
+                value = self.function(instance)
+                evaluation_cache.put(key, value)
+        else:
+            value = self.function(instance)
+        instance.__dict__[self.name] = value
+        return value
+
+
+def cached_state_property_names(cls: type) -> tuple:
+    """
+    :return: the names of the cached_state_property attributes of a GameState class
+    """
+    return tuple({name for klass in cls.__mro__ for name, attribute in vars(klass).items()
+                  if isinstance(attribute, cached_state_property)})
+
+
+def clear_state_cache(state: GameState):
+    """Forget the cached_state_property values of a state, must be called whenever the state is changed in place"""
+    names = getattr(type(state), '_cached_state_names', None)
+    if names is None:
+        names = cached_state_property_names(type(state))
+    values = state.__dict__
+    for name in names:
+        values.pop(name, None)
+
+
+class CachedGameState(GameState, ABC):
+    """
+    GameState mixin memoizing is_terminal, utility and legal_actions per instance.
+    The caches of a state are cleared by its apply and undo methods.
+    """
+
+    # optional process-wide cache of utility and is_terminal values keyed by state hash
+    evaluation_cache = None  # type: EvaluationCache
+
+    CACHED_PROPERTIES = {'is_terminal': True, 'utility': True, 'legal_actions': False}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for name, shared in cls.CACHED_PROPERTIES.items():
+            attribute = cls.__dict__.get(name)
+            if isinstance(attribute, property):
+                setattr(cls, name, cached_state_property(attribute.fget, shared))
+        cls._cached_state_names = cached_state_property_names(cls)
+        for name in ('apply', 'undo'):
+            method = cls.__dict__.get(name)
+            if method is not None and not getattr(method, 'clears_state_cache', False):
+                setattr(cls, name, _clearing_state_cache(method))
+
+
+def _clearing_state_cache(method):
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        values = self.__dict__
+        for name in self._cached_state_names:
+            values.pop(name, None)
+        return method(self, *args, **kwargs)
+
+    wrapper.clears_state_cache = True
+    return wrapper
@@ -0,0 +1,204 @@
+from .state import GameState
+from .game_agent import GameAgent
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from copy import copy
+from statistics import NormalDist
+from typing import Callable, TextIO
+import json
+import math
+import os
+import random
+import time
+
+# called as factory(state, player=player), e.g. RandomAgent or functools.partial(MiniMaxAgent, depth=3)
+AgentFactory = Callable[..., GameAgent]
+
+
+def play_game(state: GameState, agents: dict[str, GameAgent], max_moves: int = None) -> dict:
+    """
+    Play one game, every agent is told the new state after each move
+    :param agents: the agent playing each player
+    :param max_moves: stop the game unfinished after this many moves
+    :return: the actions taken, the player who took each, the seconds each took to choose, the final utility and
+             the winning player, "" for a draw or None if the game was stopped unfinished
+    """
+    moves = []
+    movers = []
+    latencies = []
+    while not state.is_terminal and (max_moves is None or len(moves) < max_moves):
+        agent = agents[state.active_player]
+        start = time.perf_counter()
+        action = agent.get_next_action()
+        latencies.append(time.perf_counter() - start)
+        movers.append(state.active_player)
+        state = state.get_next_state(action)
+        moves.append(action)
+        for each_agent in agents.values():
+            each_agent.update_state(state)
+    return {
+        'moves': moves,
+        'movers': movers,
+        'latencies': latencies,
+        'utility': state.utility,
+        'winner': state.get_winner() if state.is_terminal else None,
+    }
+
+
+def match_game(game: int, state: GameState, seats: dict[str, str], factories: dict[str, AgentFactory],
+               max_moves: int = None, seed: int = 0) -> dict:
+    """
+    Run in a worker process by run_match, or in the calling process when there is one worker
+    :param game: the number of the game in the match
+    :param seats: the name of the agent playing each player
+    :return: the play_game record, with the winner given as the name of the winning agent
+    """
+    random.seed(seed)
+    agents = {player: factories[name](copy(state), player=player) for player, name in seats.items()}
+    try:
+        record = play_game(copy(state), agents, max_moves)
+    finally:
+        for agent in agents.values():
+            if hasattr(agent, 'close'):
+                agent.close()
+    winner = record.pop('winner')
+    record['winner'] = seats[winner] if winner else None
+    # a game stopped unfinished counts as a draw, as in MatchSummary
+    record['draw'] = winner in ("", None)
+    return {'game': game, 'seed': seed, 'seats': seats, **record}
+
+
+def run_match(state: GameState, factories: dict[str, AgentFactory], games: int, workers: int = None,
+              output=None, max_moves: int = None, seed: int = 0) -> 'MatchSummary':
+    """
+    Play games between two agents from a starting state in parallel, the agents swap seats every game
+    :param factories: the two agents by name, each factory must be picklable to run in worker processes
+    :param workers: the number of processes to play games in, all cores by default
+    :param output: a path or open file each game record is written to as a JSON line as soon as the game finishes
+    :param max_moves: stop games unfinished after this many moves, they count as draws
+    :param seed: the random module is seeded with seed + game in the process playing each game
+    :return: the results of the match
+    """
+    if len(factories) != 2:
+        raise ValueError("a match is played between two agents")
+    players = list(state.utility)
+    names = list(factories)
+    workers = workers if workers is not None else os.cpu_count() or 1
+    tasks = [(game, state, {player: names[(seat + game) % 2] for seat, player in enumerate(players)}, factories,
+              max_moves, seed + game) for game in range(games)]
+
+    summary = MatchSummary(names[0], names[1])
+    stream = open(output, 'w') if isinstance(output, str) else output
+    try:
+        if workers > 1:
+            # the executor's processes are not daemonic, so agents can start worker pools of their own
+            with ProcessPoolExecutor(workers) as executor:
+                for future in as_completed([executor.submit(match_game, *task) for task in tasks]):
+                    record = future.result()
+                    summary.add(record)
+                    write_record(stream, record)
+        else:
+            for task in tasks:
+                record = match_game(*task)
+                summary.add(record)
+                write_record(stream, record)
+    finally:
+        if isinstance(output, str):
+            stream.close()
+    return summary
+
+
+def write_record(stream: TextIO, record: dict):
+    if stream is not None:
+        # actions are written as their str, e.g. chess moves in UCI notation
+        stream.write(json.dumps(record, default=str) + "\n")
+        stream.flush()
+
+
+class MatchSummary:
+    """Win, draw and loss counts of one agent against another, with the Elo difference they imply"""
+
+    def __init__(self, name: str, opponent: str):
+        self.name = name
+        self.opponent = opponent
+        self.wins = 0
+        self.draws = 0
+        self.losses = 0
+        self.moves = {name: 0, opponent: 0}
+        self.thinking_time = {name: 0.0, opponent: 0.0}
+
+    def add(self, record: dict):
+        """
+        :param record: a game record from run_match
+        """
+        if record['winner'] == self.name:
+            self.wins += 1
+        elif record['winner'] == self.opponent:
+            self.losses += 1
+        else:
+            self.draws += 1
+        for mover, latency in zip(record['movers'], record['latencies']):
+            name = record['seats'][mover]
+            self.moves[name] += 1
+            self.thinking_time[name] += latency
+
+    @property
+    def games(self) -> int:
+        return self.wins + self.draws + self.losses
+
+    @property
+    def win_rate(self) -> float:
+        return self.wins / self.games if self.games else 0.0
+
+    @property
+    def score(self) -> float:
+        """
+        :return: the points scored per game by the first agent, a draw is worth half a point
+        """
+        return (self.wins + self.draws / 2) / self.games if self.games else 0.5
+
+    def score_interval(self, confidence: float = 0.95) -> tuple[float, float]:
+        """
+        :return: the normal approximation confidence interval of the score
+        """
+        if self.games == 0:
+            return 0.0, 1.0
+        score = self.score
+        variance = max(0.0, (self.wins + self.draws / 4) / self.games - score * score)
+        margin = NormalDist().inv_cdf((1 + confidence) / 2) * math.sqrt(variance / self.games)
+        return max(0.0, score - margin), min(1.0, score + margin)
+
+    @property
+    def elo(self) -> float:
+        """
+        :return: the rating difference between the agents implied by the score
+        """
+        return elo_difference(self.score)
+
+    def elo_interval(self, confidence: float = 0.95) -> tuple[float, float]:
+        low, high = self.score_interval(confidence)
+        return elo_difference(low), elo_difference(high)
+
+    def mean_latency(self, name: str) -> float:
+        """
+        :return: the mean seconds an agent took per move
+        """
+        return self.thinking_time[name] / self.moves[name] if self.moves[name] else 0.0
+
+    def __str__(self):
+        low, high = self.elo_interval()
+        return f"{self.name} vs {self.opponent}: +{self.wins} ={self.draws} -{self.losses}, " \
+               f"score {self.score:.3f}, elo {self.elo:+.0f} [{low:+.0f}, {high:+.0f}], " \
+               f"{self.mean_latency(self.name) * 1000:.1f}ms vs " \
+               f"{self.mean_latency(self.opponent) * 1000:.1f}ms per move"
+
+
+def elo_difference(score: float) -> float:
+    """
+    :param score: the expected points per game of one player against another
+    :return: the difference in Elo rating between the players
+    """
+    if score <= 0:
+        return float('-inf')
+    if score >= 1:
+        return float('inf')
+    return -400 * math.log10(1 / score - 1)
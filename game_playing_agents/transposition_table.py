@@ -0,0 +1,87 @@
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+
+class TranspositionEntry:
+    __slots__ = ('key', 'depth', 'value', 'bound', 'best_action', 'generation')
+
+    def __init__(self, key: int, depth: int, value: float, bound: int, best_action: any, generation: int):
+        self.key = key
+        self.depth = depth
+        self.value = value
+        self.bound = bound
+        self.best_action = best_action
+        self.generation = generation
+
+
+class TranspositionTable:
+    """
+    Fixed size table of search results keyed on the hash of a game state.
+    Values are stored from the perspective of the searching agent, so a table should only be shared
+    between searches made for the same player.
+    """
+
+    REPLACEMENT_POLICIES = ('depth', 'always')
+
+    def __init__(self, max_entries: int = 2 ** 16, replacement: str = 'depth'):
+        """
+        :param max_entries: the number of slots in the table
+        :param replacement: 'depth' keeps the deeper of two colliding entries from the current search,
+                            'always' overwrites the slot with the newest entry
+        """
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        if replacement not in self.REPLACEMENT_POLICIES:
+            raise ValueError(f"replacement must be one of {self.REPLACEMENT_POLICIES}")
+        self.max_entries = max_entries
+        self.replacement = replacement
+        self.slots = [None] * max_entries  # type: list[TranspositionEntry]
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0
+
+    def new_search(self):
+        """Mark entries from previous searches as replaceable"""
+        self.generation += 1
+
+    def lookup(self, key: int) -> TranspositionEntry:
+        """
+        :param key: the hash of the game state
+        :return: the stored entry for the key, or None if there is none
+        """
+        entry = self.slots[key % self.max_entries]
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry.key != key:
+            self.misses += 1
+            self.collisions += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def store(self, key: int, depth: int, value: float, bound: int, best_action: any):
+        """
+        :param key: the hash of the game state
+        :param depth: the remaining search depth the value was found with
+        :param value: the value of the state
+        :param bound: EXACT, LOWER or UPPER
+        :param best_action: the best action found from the state
+        """
+        index = key % self.max_entries
+        entry = self.slots[index]
+        if entry is not None and self.replacement == 'depth' \
+                and entry.generation == self.generation and entry.depth > depth:
+            return
+        self.slots[index] = TranspositionEntry(key, depth, value, bound, best_action, self.generation)
+
+    def clear(self):
+        self.slots = [None] * self.max_entries
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0
+
+    def __len__(self):
+        return sum(entry is not None for entry in self.slots)
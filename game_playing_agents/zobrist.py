@@ -0,0 +1,52 @@
+import random
+
+
+class ZobristHasher:
+    """
+    Deterministic random keys for the features of a game state, e.g. (square, piece) pairs or the player to move.
+    The hash of a state is the xor of the keys of its features, so it can be updated from an action by xoring out
+    the keys of the features the action removes and xoring in the keys of those it adds.
+    Keys only depend on the seed and the repr of the feature, so hashes are the same in every process.
+    """
+
+    def __init__(self, seed: int = 0, bits: int = 64):
+        """
+        :param seed: games that should share hashes must use the same seed
+        :param bits: the size of the keys
+        """
+        self.seed = seed
+        self.bits = bits
+        self.keys = {}  # type: dict[any, int]
+
+    def key(self, feature) -> int:
+        """
+        :param feature: a hashable feature with a stable repr, e.g. a tuple of ints and strings
+        :return: the key of the feature
+        """
+        key = self.keys.get(feature)
+        if key is None:
+            key = self.keys[feature] = random.Random(f"{self.seed}:{feature!r}").getrandbits(self.bits)
+        return key
+
+    def hash(self, features) -> int:
+        """
+        :param features: all features of a state
+        :return: the hash of the state
+        """
+        state_hash = 0
+        for feature in features:
+            state_hash ^= self.key(feature)
+        return state_hash
+
+    def update(self, state_hash: int, removed=(), added=()) -> int:
+        """
+        :param state_hash: the hash of the state before an action
+        :param removed: the features the action removes from the state
+        :param added: the features the action adds to the state
+        :return: the hash of the state after the action
+        """
+        for feature in removed:
+            state_hash ^= self.key(feature)
+        for feature in added:
+            state_hash ^= self.key(feature)
+        return state_hash
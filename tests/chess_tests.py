@@ -1,13 +1,52 @@
+import asyncio
+import io
+import json
+import pickle
+import struct
+import time
 import unittest
+from copy import copy
+
 import chess
 
 import game_playing_agents as gpa
 
+ZOBRIST = gpa.ZobristHasher()
+
+# the piece, colour and promoted bitboards, castling rights, turn, en passant square (-1 for none) and clocks
+ENCODING = struct.Struct('<10Q?bHH')
+PIECE_VALUES = {None: 0, chess.PAWN: 1, chess.KNIGHT: 3, chess.BISHOP: 3, chess.ROOK: 5, chess.QUEEN: 9, chess.KING: 0}
+
+
+def piece_key(board: chess.Board, square: chess.Square) -> int:
+    piece_type = board.piece_type_at(square)
+    if not piece_type:
+        return 0
+    return ZOBRIST.key((square, piece_type, bool(board.occupied_co[chess.WHITE] & chess.BB_SQUARES[square])))
+
+
+def en_passant_square(board: chess.Board):
+    # the en passant square only matters when the capture is legal, as in chess.Board equality
+    return board.ep_square if board.has_legal_en_passant() else None
+
+
+def board_key(board: chess.Board) -> int:
+    key = ZOBRIST.key(('castling', board.castling_rights)) ^ ZOBRIST.key(('en passant', en_passant_square(board)))
+    if board.turn == chess.BLACK:
+        key ^= ZOBRIST.key('black to move')
+    for square in chess.SquareSet(board.occupied):
+        key ^= piece_key(board, square)
+    return key
+
 
 class ChessGameState(gpa.GameState):
 
-    def __init__(self, board: chess.Board):
+    def __init__(self, board: chess.Board, key: int = None):
         self.board = board
+        if key is None:
+            key = board_key(board)
+        self.key = key
+        self.previous_keys = []
 
     @property
     def state(self) -> any:
@@ -47,22 +86,111 @@ class ChessGameState(gpa.GameState):
     def is_terminal(self) -> bool:
         return self.board.is_game_over()
 
+    def evaluate_children(self, actions: list, player: str) -> list[float]:
+        # the material after each action follows from the piece it captures or promotes to, so only whether the
+        # opponent is left without a legal move needs the action pushed
+        board = self.board
+        color = chess.WHITE if player == "white" else chess.BLACK
+        material = self.get_material_count(color)
+        moving = board.turn == color
+        utilities = []
+        for action in actions:
+            if moving:
+                value = material + (PIECE_VALUES[action.promotion] - 1 if action.promotion else 0)
+            elif board.is_en_passant(action):
+                value = material - 1
+            else:
+                value = material - PIECE_VALUES[board.piece_type_at(action.to_square)]
+            board.push(action)
+            if not any(board.generate_legal_moves()):
+                value = (1 if moving else -1) if board.is_check() else 0
+            board.pop()
+            utilities.append(value)
+        return utilities
+
+    def action_priority(self, action) -> float:
+        # most valuable victim, least valuable attacker
+        if not self.board.is_capture(action):
+            return 0
+        victim = self.board.piece_type_at(action.to_square) or chess.PAWN
+        attacker = self.board.piece_type_at(action.from_square)
+        return 10 * victim - attacker
+
     def get_winner(self) -> str:
         if self.board.is_checkmate():
             return "black" if self.board.turn else "white"
         else:
             return ""
 
+    def push(self, board: chess.Board, action) -> int:
+        """
+        Push an action onto a copy of this state's board, or the board itself
+        :return: the key of the new position, from the squares the action changed
+        """
+        squares = {action.from_square, action.to_square}
+        if board.is_en_passant(action):
+            squares.add(chess.square(chess.square_file(action.to_square), chess.square_rank(action.from_square)))
+        elif board.is_castling(action):
+            squares.update(chess.SquareSet(chess.BB_RANKS[chess.square_rank(action.from_square)]))
+        castling_rights, en_passant = board.castling_rights, en_passant_square(board)
+
+        key = self.key ^ ZOBRIST.key('black to move')
+        for square in squares:
+            key ^= piece_key(board, square)
+        board.push(action)
+        for square in squares:
+            key ^= piece_key(board, square)
+        if board.castling_rights != castling_rights:
+            key ^= ZOBRIST.key(('castling', castling_rights)) ^ ZOBRIST.key(('castling', board.castling_rights))
+        if board.ep_square is not None or en_passant is not None:
+            key ^= ZOBRIST.key(('en passant', en_passant)) ^ ZOBRIST.key(('en passant', en_passant_square(board)))
+        return key
+
     def get_next_state(self, action) -> gpa.GameState:
         new_board = self.board.copy()
-        new_board.push(action)
-        return ChessGameState(new_board)
+        key = self.push(new_board, action)
+        return ChessGameState(new_board, key)
+
+    def apply(self, action):
+        self.previous_keys.append(self.key)
+        self.key = self.push(self.board, action)
+
+    def undo(self):
+        self.board.pop()
+        self.key = self.previous_keys.pop()
+
+    def encode(self) -> bytes:
+        # the position without the move stack, like a FEN
+        board = self.board
+        return ENCODING.pack(board.pawns, board.knights, board.bishops, board.rooks, board.queens, board.kings,
+                             board.occupied_co[chess.WHITE], board.occupied_co[chess.BLACK], board.promoted,
+                             board.castling_rights, board.turn,
+                             board.ep_square if board.ep_square is not None else -1,
+                             board.halfmove_clock, board.fullmove_number)
+
+    @classmethod
+    def decode(cls, data) -> 'ChessGameState':
+        board = chess.Board(None)
+        (board.pawns, board.knights, board.bishops, board.rooks, board.queens, board.kings, white, black,
+         board.promoted, board.castling_rights, board.turn, ep_square, board.halfmove_clock,
+         board.fullmove_number) = ENCODING.unpack(data)
+        board.occupied_co[chess.WHITE] = white
+        board.occupied_co[chess.BLACK] = black
+        board.occupied = white | black
+        board.ep_square = ep_square if ep_square >= 0 else None
+        return cls(board)
 
     def __str__(self):
         return str(self.board)
 
     def __hash__(self):
-        return hash(str(self.board))
+        return self.key
+
+    def __eq__(self, other):
+        return isinstance(other, ChessGameState) and self.board == other.board
+
+    def __copy__(self):
+        return ChessGameState(self.board.copy(), self.key)
 
 
 class TestChess(unittest.TestCase):
@@ -165,16 +293,192 @@ class TestChess(unittest.TestCase):
         black_agent = gpa.MiniMaxAgent(self.game_state, 1, "black")
         self.play_game(white_agent, black_agent)
 
+    def test_minimax_prunes(self):
+        agent = gpa.MiniMaxAgent(self.game_state, 2, "white")
+        agent.get_next_action()
+        # 1 root + 20 replies + 400 positions two plies deep without pruning
+        self.assertLess(agent.nodes_searched, 421)
+
+    def test_minimax_transposition_table(self):
+        agent = gpa.MiniMaxAgent(self.game_state, 3, "white", transposition_table=gpa.TranspositionTable())
+        first_action = agent.get_next_action()
+        first_nodes = agent.nodes_searched
+        # the second search of the same position is answered from the table below the root
+        self.assertEqual(agent.get_next_action(), first_action)
+        self.assertLess(agent.nodes_searched, first_nodes)
+        self.assertGreater(agent.transposition_table.hits, 0)
+
+    def test_move_ordering(self):
+        board = chess.Board("r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4")
+        self.game_state = ChessGameState(board)
+        unordered_agent = gpa.MiniMaxAgent(self.game_state, 3, "white")
+        unordered_agent.get_next_action()
+        ordered_agent = gpa.MiniMaxAgent(self.game_state, 3, "white", move_ordering=gpa.default_move_ordering())
+        action = ordered_agent.get_next_action()
+        self.assertIn(action, self.game_state.legal_actions)
+        self.assertLess(ordered_agent.nodes_searched, unordered_agent.nodes_searched)
+
+    def test_time_limited_minimax(self):
+        agent = gpa.MiniMaxAgent(self.game_state, player="white", time_limit=0.5,
+                                 transposition_table=gpa.TranspositionTable())
+        start = time.perf_counter()
+        action = agent.get_next_action()
+        self.assertLess(time.perf_counter() - start, 5)
+        self.assertIn(action, self.game_state.legal_actions)
+        self.assertGreaterEqual(agent.completed_depth, 2)
+        self.assertEqual(agent.principal_variation[0], action)
+
     def test_monte_carlo_vs_random(self):
         white_agent = gpa.MonteCarloAgent(self.game_state, 1, "white")
         black_agent = gpa.RandomAgent(self.game_state, "black")
         self.play_game(white_agent, black_agent)
 
+    def test_parallel_minimax_matches_serial(self):
+        # positions where many root actions share the best value
+        fens = ['rnbqkbnr/3pppp1/pp2Q3/2p4p/8/4P3/PPPP1PPP/RNB1KBNR w KQkq - 0 8',
+                '1n3b1r/1p1b1kpp/rq3p2/B1ppPP2/6n1/1P2PN2/P1P4P/RNQ1KB1R b - - 0 15',
+                'r4rk1/p1p1pp2/1pn4b/6pN/PPPPPqn1/R3Nb2/3KQPPP/2B2B1R b - - 6 17']
+        for fen in fens:
+            state = ChessGameState(chess.Board(fen))
+            serial = gpa.MiniMaxAgent(state, 3)
+            with gpa.MiniMaxAgent(state, 3, workers=2) as parallel:
+                self.assertEqual(parallel.get_next_action(), serial.get_next_action())
+                self.assertEqual(parallel.principal_variation[0], serial.principal_variation[0])
+
+    def test_time_limited_parallel_minimax(self):
+        with gpa.MiniMaxAgent(self.game_state, player="white", time_limit=1, workers=2,
+                              transposition_table=gpa.TranspositionTable()) as agent:
+            start = time.perf_counter()
+            action = agent.get_next_action()
+            self.assertLess(time.perf_counter() - start, 5)
+            self.assertIn(action, self.game_state.legal_actions)
+            self.assertGreaterEqual(agent.completed_depth, 2)
+
+    def test_parallel_monte_carlo(self):
+        for parallelism in gpa.MonteCarloAgent.PARALLELISMS:
+            with gpa.MonteCarloAgent(self.game_state, 8, "white", workers=2, parallelism=parallelism, seed=1) as agent:
+                self.assertIn(agent.get_next_action(), self.game_state.legal_actions)
+
+    def test_time_limited_monte_carlo(self):
+        agent = gpa.MonteCarloAgent(self.game_state, player="white", time_limit=0.5, max_rollout_depth=20, seed=1)
+        start = time.perf_counter()
+        action = agent.get_next_action()
+        self.assertLess(time.perf_counter() - start, 5)
+        self.assertIn(action, self.game_state.legal_actions)
+        self.assertGreater(agent.rollouts_completed, 0)
+
     def test_random_vs_monte_carlo(self):
         white_agent = gpa.RandomAgent(self.game_state, "white")
         black_agent = gpa.MonteCarloAgent(self.game_state, 1, "black")
         self.play_game(white_agent, black_agent)
 
+    def test_match_stops_unfinished_games(self):
+        output = io.StringIO()
+        summary = gpa.run_match(self.game_state, {'simple max': gpa.SimpleMaxAgent, 'random': gpa.RandomAgent}, 2,
+                                workers=2, output=output, max_moves=20)
+        records = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual(summary.games, 2)
+        for record in records:
+            self.assertLessEqual(len(record['moves']), 20)
+            self.assertIn(chess.Move.from_uci(record['moves'][0]), self.game_state.legal_actions)
+            if len(record['moves']) == 20:
+                self.assertIsNone(record['winner'])
+                self.assertTrue(record['draw'])
+
+    def test_instrumentation_splits_state_and_search_time(self):
+        agent = gpa.MiniMaxAgent(self.game_state, 2, "white")
+        action, stats = agent.get_next_action_with_stats()
+        self.assertIn(action, self.game_state.legal_actions)
+        # searched in place, on a copy of the root
+        self.assertEqual(stats.state_calls['copy'], 1)
+        self.assertEqual(stats.state_calls['apply'], stats.nodes - 1)
+        self.assertEqual(stats.state_calls['apply'], stats.state_calls['undo'])
+        self.assertGreater(stats.state_seconds['legal_actions'], 0)
+
+        action, stats = gpa.SimpleMaxAgent(self.game_state, "white").get_next_action_with_stats()
+        # the children are valued together
+        self.assertEqual(stats.state_calls['evaluate_children'], 1)
+        self.assertNotIn('utility', stats.state_calls)
+        self.assertEqual(stats.to_dict()['state_calls'], stats.state_calls)
+
+    def test_zobrist_key_is_updated_incrementally(self):
+        # castling both ways, an en passant capture and a promotion
+        moves = ['e4', 'd5', 'e5', 'f5', 'exf6', 'Nc6', 'Nf3', 'Bd7', 'Bc4', 'exf6', 'O-O', 'Qe7', 'd3', 'O-O-O',
+                 'Re1', 'g5', 'Nc3', 'g4', 'Bf4', 'gxf3', 'Qd2', 'fxg2', 'Rf1', 'gxf1=Q+']
+        state = ChessGameState(chess.Board())
+        in_place = copy(state)
+        for move in moves:
+            action = state.board.parse_san(move)
+            state = state.get_next_state(action)
+            in_place.apply(action)
+            self.assertEqual(hash(state), hash(ChessGameState(state.board.copy())))
+            self.assertEqual(hash(in_place), hash(state))
+        for _ in moves:
+            in_place.undo()
+        self.assertEqual(hash(in_place), hash(ChessGameState(chess.Board())))
+
+    def test_zobrist_key_ignores_move_order(self):
+        state = ChessGameState(chess.Board())
+        for first, second in [('e4', 'Nf3'), ('Nf3', 'e4')]:
+            transposed = state
+            for move in [first, 'e5', second]:
+                transposed = transposed.get_next_state(transposed.board.parse_san(move))
+            self.assertEqual(hash(transposed), hash(ChessGameState(chess.Board(
+                'rnbqkbnr/pppp1ppp/8/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R b KQkq - 1 2'))))
+
+    def test_async_search_stops_at_deadline(self):
+        async def choose_all() -> list:
+            deadline = asyncio.get_running_loop().time() + 0.5
+            # more searches than the executor has threads, the queued ones return as soon as they start
+            agents = [gpa.MiniMaxAgent(self.game_state, 6, "white") for _ in range(40)]
+            return await asyncio.gather(*(agent.aget_next_action(deadline=deadline) for agent in agents))
+
+        start = time.perf_counter()
+        actions = asyncio.run(choose_all())
+        self.assertLess(time.perf_counter() - start, 10)
+        for action in actions:
+            self.assertIn(action, self.game_state.legal_actions)
+
+    def test_evaluate_children_matches_next_states(self):
+        fens = [chess.STARTING_FEN,
+                # en passant, promotion with and without capture
+                "rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3", "1n5k/P7/8/8/8/8/8/K7 w - - 0 1",
+                # mate in one and stalemate in one
+                "6k1/5ppp/8/8/8/8/5PPP/R5K1 w - - 0 1", "7k/8/5Q2/6K1/8/8/8/8 w - - 0 1"]
+        for fen in fens:
+            state = ChessGameState(chess.Board(fen))
+            actions = state.legal_actions
+            for player in ("white", "black"):
+                self.assertEqual(state.evaluate_children(actions, player),
+                                 [state.get_next_state(action).utility[player] for action in actions])
+
+    def test_batched_leaves_choose_the_same_action(self):
+        for fen in ["r2q1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N1PN2/PP2BPPP/R2Q1RK1 w - - 0 10",
+                    "6k1/5ppp/8/8/8/8/5PPP/R5K1 w - - 0 1"]:
+            for move_ordering in (None, gpa.default_move_ordering):
+                actions = []
+                for batch_leaves in (False, True):
+                    agent = gpa.MiniMaxAgent(ChessGameState(chess.Board(fen)), 3, batch_leaves=batch_leaves,
+                                             move_ordering=move_ordering() if move_ordering else None)
+                    actions.append(agent.get_next_action())
+                self.assertEqual(actions[0], actions[1])
+
+    def test_encode_decode(self):
+        # castling rights, en passant squares, promotion and the clocks all survive the round trip
+        moves = ['e4', 'd5', 'e5', 'f5', 'exf6', 'Nc6', 'Nf3', 'Bd7', 'Bc4', 'exf6', 'O-O', 'Qe7', 'd3', 'O-O-O',
+                 'Re1', 'g5', 'Nc3', 'g4', 'Bf4', 'gxf3', 'Qd2', 'fxg2', 'Rf1', 'gxf1=Q+']
+        state = ChessGameState(chess.Board())
+        self.assertTrue(state.supports_encode)
+        for move in moves:
+            state = state.get_next_state(state.board.parse_san(move))
+            decoded = ChessGameState.decode(memoryview(state.encode()))
+            self.assertEqual(decoded, state)
+            self.assertEqual(hash(decoded), hash(state))
+            self.assertEqual(decoded.board.fen(), state.board.fen())
+            self.assertEqual(decoded.legal_actions, state.legal_actions)
+        # the move stack is left out
+        self.assertLess(len(state.encode()), len(pickle.dumps(state)) / 10)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,11 +1,47 @@
+import asyncio
+import gc
+import io
+import json
+import os
+import pickle
+import tempfile
+import threading
+import time
 import unittest
+from copy import copy
+from functools import lru_cache, partial
+
+import numpy as np
 
 import game_playing_agents as gpa
 
+ZOBRIST = gpa.ZobristHasher()
+
+
+def board_symmetries(dimensions: int) -> list:
+    """
+    :return: the cell each cell moves to in each rotation and reflection of the board, the identity first
+    """
+    last = dimensions - 1
+    return [lambda row, col: (row, col), lambda row, col: (col, last - row),
+            lambda row, col: (last - row, last - col), lambda row, col: (last - col, row),
+            lambda row, col: (row, last - col), lambda row, col: (col, row),
+            lambda row, col: (last - row, col), lambda row, col: (last - col, last - row)]
+
+
+@lru_cache
+def symmetric_move_keys(dimensions: int) -> dict:
+    """
+    :return: the change to the key of every symmetry of the board when a player moves to a cell
+    """
+    return {(row, col, player): tuple(ZOBRIST.key((*symmetry(row, col), player)) ^ ZOBRIST.key('O to move')
+                                      for symmetry in board_symmetries(dimensions))
+            for row in range(dimensions) for col in range(dimensions) for player in ("X", "O")}
 
-class TicTacToeGameState(gpa.GameState):
 
-    def __init__(self, dimensions: int = 3, board: list = None, current_player: str = "X"):
+class TicTacToeGameState(gpa.CachedGameState):
+
+    def __init__(self, dimensions: int = 3, board: list = None, current_player: str = "X", key: int = None):
         if board is None:
             self.board = [['' for _ in range(dimensions)] for _ in range(dimensions)]
             self.dimensions = dimensions
@@ -13,6 +49,15 @@ class TicTacToeGameState(gpa.GameState):
             self.board = board
             self.dimensions = len(board)
         self.current_player = current_player
+        self.applied_actions = []
+        if key is None:
+            key = ZOBRIST.hash([(row, col, cell) for row, cells in enumerate(self.board)
+                                for col, cell in enumerate(cells) if cell != ''])
+            if current_player == "O":
+                key ^= ZOBRIST.key('O to move')
+        self.key = key
+        # the keys of the board's symmetries, only kept up to date once canonical_hash has been called
+        self.symmetric_keys = None
 
     @property
     def state(self) -> any:
@@ -63,7 +108,7 @@ class TicTacToeGameState(gpa.GameState):
             # Get Player of Column
             player = self.board[0][col]
             if player == '':
-                break
+                continue
             # Check if every row in column is the same
             for row in range(self.dimensions):
                 if self.board[row][col] != player:
@@ -91,12 +136,84 @@ class TicTacToeGameState(gpa.GameState):
 
         return ""
 
+    def evaluate_children(self, actions: list, player: str) -> np.ndarray:
+        cells = {'': 0, 'X': 1, 'O': -1}
+        board = np.array([[cells[cell] for cell in row] for row in self.board])
+        last = self.dimensions - 1
+        # the number of the mover's pieces in each line, less the opponent's
+        mover = cells[self.current_player]
+        row_sums, col_sums = mover * board.sum(axis=1), mover * board.sum(axis=0)
+        diagonal, anti_diagonal = mover * np.trace(board), mover * np.trace(np.fliplr(board))
+        if np.abs(np.concatenate((row_sums, col_sums, [diagonal, anti_diagonal]))).max() > last:
+            # the game is already won, which line a move past the end wins with is up to get_winner
+            return np.array([self.get_next_state(action).utility[player] for action in actions], dtype=float)
+
+        # an action wins if it fills the last empty cell of a line holding only the mover's pieces
+        rows, cols = np.array(actions, dtype=int).reshape(-1, 2).T
+        wins = (row_sums[rows] == last) | (col_sums[cols] == last) | ((rows == cols) & (diagonal == last)) \
+            | ((rows + cols == last) & (anti_diagonal == last))
+        return np.where(wins, 1.0 if player == self.current_player else -1.0, 0.5)
+
+    def next_key(self, action) -> int:
+        return self.key ^ ZOBRIST.key('O to move') ^ ZOBRIST.key((action[0], action[1], self.current_player))
+
     def get_next_state(self, action) -> gpa.GameState:
-        new_board = self.board.copy()
+        new_board = [row.copy() for row in self.board]
         new_board[action[0]][action[1]] = self.current_player
-        new_state = TicTacToeGameState(self.dimensions, new_board, "O" if self.current_player == "X" else "X")
+        new_state = TicTacToeGameState(self.dimensions, new_board, "O" if self.current_player == "X" else "X",
+                                       self.next_key(action))
         return new_state
 
+    def apply(self, action):
+        if self.symmetric_keys is not None:
+            self.update_symmetric_keys(action, self.current_player)
+        self.key = self.next_key(action)
+        self.board[action[0]][action[1]] = self.current_player
+        self.current_player = "O" if self.current_player == "X" else "X"
+        self.applied_actions.append(action)
+
+    def undo(self):
+        row, col = self.applied_actions.pop()
+        self.board[row][col] = ''
+        self.current_player = "O" if self.current_player == "X" else "X"
+        self.key ^= ZOBRIST.key('O to move') ^ ZOBRIST.key((row, col, self.current_player))
+        if self.symmetric_keys is not None:
+            self.update_symmetric_keys((row, col), self.current_player)
+
+    def update_symmetric_keys(self, action, player: str):
+        changes = symmetric_move_keys(self.dimensions)[(action[0], action[1], player)]
+        self.symmetric_keys = [key ^ change for key, change in zip(self.symmetric_keys, changes)]
+
+    def canonical_hash(self) -> int:
+        if self.symmetric_keys is None:
+            self.symmetric_keys = [
+                ZOBRIST.hash([(*symmetry(row, col), cell) for row, cells in enumerate(self.board)
+                              for col, cell in enumerate(cells) if cell != ''])
+                ^ (ZOBRIST.key('O to move') if self.current_player == "O" else 0)
+                for symmetry in board_symmetries(self.dimensions)]
+        return min(self.symmetric_keys)
+
+    def to_batch(self, size: int) -> gpa.BatchGameState:
+        cells = {'': 0, 'X': 1, 'O': -1}
+        board = np.array([[cells[cell] for cell in row] for row in self.board], dtype=np.int8)
+        boards = np.repeat(board[np.newaxis], size, axis=0)
+        current_players = np.full(size, cells[self.current_player], dtype=np.int8)
+        return TicTacToeBatchState(boards, current_players)
+
+    def encode(self) -> bytes:
+        # the Zobrist key, so it is not computed again, the board size, the active player and a byte per cell
+        codes = {'': 0, 'X': 1, 'O': 2}
+        return self.key.to_bytes(8, 'little') + bytes([self.dimensions, codes[self.current_player],
+                                                       *(codes[cell] for row in self.board for cell in row)])
+
+    @classmethod
+    def decode(cls, data) -> 'TicTacToeGameState':
+        cells = ('', 'X', 'O')
+        dimensions = data[8]
+        board = [[cells[code] for code in data[10 + row * dimensions:10 + (row + 1) * dimensions]]
+                 for row in range(dimensions)]
+        return cls(dimensions, board, cells[data[9]], int.from_bytes(data[:8], 'little'))
+
     def __str__(self):
         string = ""
         for row in range(self.dimensions):
@@ -108,14 +225,88 @@ class TicTacToeGameState(gpa.GameState):
             string += "\n"
         return string
 
+    def __hash__(self):
+        return self.key
+
+    def __eq__(self, other):
+        return self.board == other.board and self.current_player == other.current_player
+
     def __copy__(self):
-        return TicTacToeGameState(self.dimensions, self.board.copy(), self.current_player)
+        return TicTacToeGameState(self.dimensions, [row.copy() for row in self.board], self.current_player, self.key)
 
 
 if __name__ == '__main__':
     unittest.main()
 
 
+class TicTacToeBatchState(gpa.BatchGameState):
+    """Vectorized NxN tic-tac-toe, cells and players are 1 for X, -1 for O and 0 for empty"""
+
+    def __init__(self, boards: np.ndarray, current_players: np.ndarray):
+        self.boards = boards
+        self.current_players = current_players
+        self.dimensions = boards.shape[1]
+        self.winners = self.get_winners(np.arange(len(boards)))
+
+    @property
+    def players(self) -> list[str]:
+        return ["X", "O"]
+
+    @property
+    def size(self) -> int:
+        return len(self.boards)
+
+    def legal_action_mask(self) -> np.ndarray:
+        mask = self.boards.reshape(self.size, -1) == 0
+        mask[self.is_terminal] = False
+        return mask
+
+    def step(self, actions: np.ndarray):
+        active = np.flatnonzero(~self.is_terminal)
+        cells = self.boards.reshape(self.size, -1)
+        cells[active, actions[active]] = self.current_players[active]
+        self.current_players[active] *= -1
+        self.winners[active] = self.get_winners(active)
+
+    def get_winners(self, games: np.ndarray) -> np.ndarray:
+        boards = self.boards[games].astype(np.int32)
+        lines = np.concatenate((boards.sum(axis=2), boards.sum(axis=1),
+                                np.trace(boards, axis1=1, axis2=2)[:, np.newaxis],
+                                np.trace(boards[:, :, ::-1], axis1=1, axis2=2)[:, np.newaxis]), axis=1)
+        x_wins = (lines == self.dimensions).any(axis=1)
+        o_wins = (lines == -self.dimensions).any(axis=1)
+        return np.where(x_wins, 1, np.where(o_wins, -1, 0)).astype(np.int8)
+
+    @property
+    def is_terminal(self) -> np.ndarray:
+        return (self.winners != 0) | (self.boards != 0).all(axis=(1, 2))
+
+    @property
+    def utility(self) -> np.ndarray:
+        utilities = np.full((self.size, 2), 0.5)
+        utilities[self.winners == 1] = (1, -1)
+        utilities[self.winners == -1] = (-1, 1)
+        return utilities
+
+
+def plain_minimax(state: TicTacToeGameState, depth: int, max_player: str):
+    """
+    Exhaustive minimax without pruning
+    :return: the minimax value and the number of nodes visited
+    """
+    if depth == 0 or state.is_terminal:
+        return state.utility[max_player], 1
+    values = []
+    nodes = 1
+    for action in state.legal_actions:
+        value, child_nodes = plain_minimax(state.get_next_state(action), depth - 1, max_player)
+        values.append(value)
+        nodes += child_nodes
+    if state.active_player == max_player:
+        return max(values), nodes
+    return min(values), nodes
+
+
 class TicTacToeTest(unittest.TestCase):
 
     def setUp(self):
@@ -153,3 +344,765 @@ class TicTacToeTest(unittest.TestCase):
         o_agent = gpa.MiniMaxAgent(self.game, 10, "O")
         winner = self.play_game(x_agent, o_agent)
         self.assertIn(winner, ["X", "O", ""])
+
+    def test_alpha_beta_prunes(self):
+        self.game = self.game.get_next_state((1, 1)).get_next_state((0, 0))
+        agent = gpa.MiniMaxAgent(self.game, 10, "X")
+        action = agent.get_next_action()
+        value, nodes = plain_minimax(self.game, 10, "X")
+
+        self.assertEqual(plain_minimax(self.game.get_next_state(action), 9, "X")[0], value)
+        self.assertLess(agent.nodes_searched, nodes)
+        self.assertLess(agent.effective_branching_factor, nodes ** (1 / 10))
+
+    def test_transposition_table(self):
+        self.game = self.game.get_next_state((1, 1)).get_next_state((0, 0))
+        plain_agent = gpa.MiniMaxAgent(self.game, 10, "X")
+        plain_agent.get_next_action()
+        table = gpa.TranspositionTable()
+        agent = gpa.MiniMaxAgent(self.game, 10, "X", transposition_table=table)
+        action = agent.get_next_action()
+
+        self.assertEqual(plain_minimax(self.game.get_next_state(action), 9, "X")[0],
+                         plain_minimax(self.game, 10, "X")[0])
+        self.assertGreater(table.hits, 0)
+        self.assertLess(agent.nodes_searched, plain_agent.nodes_searched)
+
+    def test_transposition_table_collisions(self):
+        self.game = self.game.get_next_state((1, 1)).get_next_state((0, 0))
+        for replacement in gpa.TranspositionTable.REPLACEMENT_POLICIES:
+            table = gpa.TranspositionTable(max_entries=8, replacement=replacement)
+            agent = gpa.MiniMaxAgent(self.game, 10, "X", transposition_table=table)
+            action = agent.get_next_action()
+
+            self.assertLessEqual(len(table), 8)
+            self.assertGreater(table.collisions, 0)
+            self.assertEqual(plain_minimax(self.game.get_next_state(action), 9, "X")[0],
+                             plain_minimax(self.game, 10, "X")[0])
+
+    def test_transposition_table_persists_between_moves(self):
+        x_agent = gpa.MiniMaxAgent(self.game, 10, "X", transposition_table=gpa.TranspositionTable())
+        o_agent = gpa.MiniMaxAgent(self.game, 10, "O", transposition_table=gpa.TranspositionTable())
+        winner = self.play_game(x_agent, o_agent)
+        self.assertEqual(winner, "")
+        self.assertGreater(x_agent.transposition_table.hits, 0)
+
+    def test_iterative_deepening_stops_when_tree_is_exhausted(self):
+        agent = gpa.MiniMaxAgent(self.game, player="X", time_limit=60)
+        action = agent.get_next_action()
+        self.assertIn(action, self.game.legal_actions)
+        self.assertEqual(agent.completed_depth, 9)
+
+    def test_time_limited_minimax_vs_minimax(self):
+        x_agent = gpa.MiniMaxAgent(self.game, player="X", time_limit=0.05)
+        o_agent = gpa.MiniMaxAgent(self.game, 10, "O")
+        winner = self.play_game(x_agent, o_agent)
+        self.assertIn(winner, ["X", "O", ""])
+
+    def test_time_limit_includes_first_iteration(self):
+        class SlowState(TicTacToeGameState):
+            @property
+            def utility(self) -> dict[str, float]:
+                time.sleep(0.02)
+                return super().utility
+
+            def get_next_state(self, action) -> gpa.GameState:
+                state = super().get_next_state(action)
+                return SlowState(state.dimensions, state.board, state.current_player, state.key)
+
+            def __copy__(self):
+                return SlowState(self.dimensions, [row.copy() for row in self.board], self.current_player, self.key)
+
+        # the first iteration alone takes longer than the time limit, so no deeper one is started
+        agent = gpa.MiniMaxAgent(SlowState(), player="X", time_limit=0.05)
+        start = time.perf_counter()
+        agent.get_next_action()
+        self.assertEqual(agent.completed_depth, 1)
+        self.assertLess(time.perf_counter() - start, 1)
+        self.assertIsNone(agent.deadline)
+
+    def test_killer_and_history_ordering(self):
+        self.game = self.game.get_next_state((1, 1)).get_next_state((0, 0))
+        ordering = [gpa.KillerMoveOrderer(), gpa.HistoryOrderer()]
+        agent = gpa.MiniMaxAgent(self.game, 10, "X", move_ordering=ordering)
+        action = agent.get_next_action()
+        self.assertEqual(plain_minimax(self.game.get_next_state(action), 9, "X")[0],
+                         plain_minimax(self.game, 10, "X")[0])
+        self.assertTrue(ordering[0].killers)
+        self.assertTrue(ordering[1].history)
+
+    def test_in_place_search_leaves_state_untouched(self):
+        self.game = self.game.get_next_state((1, 1))
+        self.assertTrue(self.game.supports_undo)
+        before = copy(self.game)
+        agents = [gpa.MiniMaxAgent(self.game, 8, "O"), gpa.SimpleMaxAgent(self.game, "O"),
+                  gpa.MonteCarloAgent(self.game, 50, "O")]
+        for agent in agents:
+            self.assertIn(agent.get_next_action(), self.game.legal_actions)
+            self.assertEqual(self.game, before)
+
+    def test_parallel_minimax_vs_minimax(self):
+        with gpa.MiniMaxAgent(self.game, 10, "X", workers=2) as x_agent, \
+                gpa.MiniMaxAgent(self.game, 10, "O", workers=2, move_ordering=gpa.default_move_ordering()) as o_agent:
+            self.assertEqual(self.play_game(x_agent, o_agent), "")
+        for depth in (2, 4):
+            with gpa.MiniMaxAgent(TicTacToeGameState(4), depth, "X", workers=2) as parallel:
+                self.assertEqual(parallel.get_next_action(),
+                                 gpa.MiniMaxAgent(TicTacToeGameState(4), depth, "X").get_next_action())
+
+    def test_root_parallel_monte_carlo_is_reproducible(self):
+        statistics = []
+        for _ in range(2):
+            with gpa.MonteCarloAgent(self.game, 200, "X", workers=2, parallelism='root', seed=7) as agent:
+                self.assertIn(agent.get_next_action(), self.game.legal_actions)
+                statistics.append(agent.root_statistics)
+        self.assertEqual(statistics[0], statistics[1])
+        self.assertEqual(sum(n for n, v in statistics[0].values()), 200)
+
+    def test_leaf_parallel_monte_carlo_is_reproducible(self):
+        statistics = []
+        for _ in range(2):
+            with gpa.MonteCarloAgent(self.game, 200, "X", workers=2, parallelism='leaf', seed=7) as agent:
+                self.assertIn(agent.get_next_action(), self.game.legal_actions)
+                statistics.append(agent.root_statistics)
+        self.assertEqual(statistics[0], statistics[1])
+
+    def test_leaf_parallel_monte_carlo_runs_exact_rollouts(self):
+        for shared_memory in (False, True):
+            with gpa.MonteCarloAgent(self.game, 201, "X", workers=2, parallelism='leaf', seed=7,
+                                     shared_memory=shared_memory) as agent:
+                agent.get_next_action()
+                self.assertEqual(agent.rollouts_completed, 201)
+                self.assertEqual(sum(agent.visit_counts().values()), 201)
+
+    def test_dropped_parallel_agent_frees_workers(self):
+        agent = gpa.MonteCarloAgent(self.game, 20, "X", workers=2, parallelism='leaf', seed=7, shared_memory=True)
+        agent.get_next_action()
+        processes = list(agent.pool._pool)
+        name = agent._shared_batch.name
+        del agent
+        gc.collect()
+        for process in processes:
+            process.join(5)
+            self.assertFalse(process.is_alive())
+        with self.assertRaises(FileNotFoundError):
+            gpa.SharedStateBatch(0, 0, (), name)
+
+    def test_parallel_monte_carlo_vs_random(self):
+        with gpa.MonteCarloAgent(self.game, 100, "X", workers=2, seed=3) as x_agent:
+            o_agent = gpa.RandomAgent(self.game, "O")
+            winner = self.play_game(x_agent, o_agent)
+            self.assertIn(winner, ["X", "O", ""])
+            self.assertEqual(x_agent.searches, sum(row.count("X") for row in self.game.board))
+
+    def test_anytime_monte_carlo(self):
+        agent = gpa.MonteCarloAgent(self.game, 50, "X", seed=1)
+        agent.search(rollouts=50)
+        agent.search(rollouts=50)
+        self.assertEqual(sum(agent.visit_counts().values()), 100)
+        self.assertIn(agent.best_action(), self.game.legal_actions)
+
+    def test_query_monte_carlo_mid_search(self):
+        agent = gpa.MonteCarloAgent(self.game, player="X", time_limit=0.5, seed=1)
+        search = threading.Thread(target=agent.get_next_action)
+        search.start()
+        time.sleep(0.1)
+        visits = agent.visit_counts()
+        best_action = agent.best_action()
+        search.join()
+        self.assertGreater(sum(visits.values()), 0)
+        self.assertIn(best_action, self.game.legal_actions)
+        self.assertGreaterEqual(sum(agent.visit_counts().values()), sum(visits.values()))
+
+    def test_monte_carlo_reuses_tree(self):
+        x_agent = gpa.MonteCarloAgent(self.game, 500, "X", seed=1)
+        x_action = x_agent.get_next_action()
+        x_node = next(child for child in x_agent.root.children if child.last_action == x_action)
+        o_action = max(x_node.children, key=lambda child: child.n).last_action
+        self.game = self.game.get_next_state(x_action).get_next_state(o_action)
+
+        x_agent.update_state(self.game)
+        self.assertIsNone(x_agent.root.parent)
+        self.assertEqual(x_agent.root.state, self.game)
+        x_agent.get_next_action()
+        self.assertGreater(x_agent.reused_visits, 0)
+        self.assertEqual(x_agent.root.n, x_agent.reused_visits + 500)
+
+    def test_monte_carlo_reuses_tree_by_actions(self):
+        x_agent = gpa.MonteCarloAgent(self.game, 500, "X", seed=1)
+        x_action = x_agent.get_next_action()
+        expected_root = next(child for child in x_agent.root.children if child.last_action == x_action)
+        self.game = self.game.get_next_state(x_action)
+        x_agent.update_state(self.game, [x_action])
+        self.assertIs(x_agent.root, expected_root)
+
+    def test_monte_carlo_without_tree_reuse(self):
+        x_agent = gpa.MonteCarloAgent(self.game, 100, "X", seed=1, reuse_tree=False)
+        o_agent = gpa.MonteCarloAgent(self.game, 100, "O", seed=2)
+        self.play_game(x_agent, o_agent)
+        self.assertEqual(x_agent.reused_visits, 0)
+
+        # nor when told the actions taken
+        agent = gpa.MonteCarloAgent(TicTacToeGameState(), 100, "X", seed=1, reuse_tree=False)
+        action = agent.get_next_action()
+        agent.update_state(TicTacToeGameState().get_next_state(action), [action])
+        self.assertIsNone(agent.root)
+
+    def test_compact_tree_monte_carlo(self):
+        agent = gpa.MonteCarloAgent(self.game, 2000, "X", seed=1, compact_tree=True)
+        action = agent.get_next_action()
+        self.assertIn(action, self.game.legal_actions)
+        self.assertEqual(sum(agent.visit_counts().values()), 2000)
+        self.assertEqual(len(agent.visit_counts()), 9)
+        # every expanded node's children sit in one contiguous block of the arrays
+        tree = agent.root.tree
+        for index in range(tree.size):
+            for child in tree.children_of(index):
+                self.assertEqual(tree.parents[child], index)
+
+    def test_compact_tree_reuse(self):
+        x_agent = gpa.MonteCarloAgent(self.game, 1000, "X", seed=1, compact_tree=True)
+        x_action = x_agent.get_next_action()
+        x_node = x_agent.root.descendant([x_action])
+        o_action = max(x_node.children, key=lambda child: child.n).last_action
+        expected_visits = x_node.descendant([o_action]).n
+        self.game = self.game.get_next_state(x_action).get_next_state(o_action)
+
+        x_agent.update_state(self.game)
+        self.assertIsNone(x_agent.root.parent)
+        self.assertEqual(x_agent.root.n, expected_visits)
+        self.assertLess(x_agent.root.tree.size, x_node.tree.size)
+        x_agent.get_next_action()
+        self.assertEqual(x_agent.reused_visits, expected_visits)
+
+    def test_compact_tree_monte_carlo_vs_random(self):
+        for parallelism in gpa.MonteCarloAgent.PARALLELISMS:
+            self.setUp()
+            with gpa.MonteCarloAgent(self.game, 100, "X", workers=2, parallelism=parallelism, seed=1,
+                                     compact_tree=True) as x_agent:
+                o_agent = gpa.RandomAgent(self.game, "O")
+                winner = self.play_game(x_agent, o_agent)
+                self.assertIn(winner, ["X", "O", ""])
+
+    def test_monte_carlo_expands_each_action_once(self):
+        agent = gpa.MonteCarloAgent(self.game, 100, "X", seed=1)
+        agent.get_next_action()
+        actions = [child.last_action for child in agent.root.children]
+        self.assertCountEqual(actions, self.game.legal_actions)
+        self.assertEqual(agent.root.untried_actions, [])
+        self.assertEqual(agent.root.n, sum(child.n for child in agent.root.children))
+
+    def test_monte_carlo_wins_and_blocks(self):
+        for compact_tree in (False, True):
+            win = TicTacToeGameState(board=[['X', 'X', ''], ['O', 'O', ''], ['', '', '']], current_player="X")
+            agent = gpa.MonteCarloAgent(win, 200, "X", seed=1, compact_tree=compact_tree)
+            self.assertEqual(agent.get_next_action(), (0, 2))
+
+            block = TicTacToeGameState(board=[['X', 'X', ''], ['O', '', ''], ['', '', '']], current_player="O")
+            agent = gpa.MonteCarloAgent(block, 500, "O", seed=1, compact_tree=compact_tree, exploration=1)
+            self.assertEqual(agent.get_next_action(), (0, 2))
+
+    def test_rave_wins_and_blocks(self):
+        win = TicTacToeGameState(board=[['X', 'X', ''], ['O', 'O', ''], ['', '', '']], current_player="X")
+        agent = gpa.MonteCarloAgent(win, 100, "X", seed=1, rave=True)
+        self.assertEqual(agent.get_next_action(), (0, 2))
+        # every simulation through the root credits the actions X played in it
+        self.assertEqual(set(agent.root.amaf), set(win.legal_actions))
+        self.assertLessEqual(max(n for n, v in agent.root.amaf.values()), agent.root.n)
+
+        block = TicTacToeGameState(board=[['X', 'X', ''], ['O', '', ''], ['', '', '']], current_player="O")
+        for workers in (1, 2):
+            with gpa.MonteCarloAgent(block, 200, "O", seed=1, rave=True, workers=workers) as agent:
+                self.assertEqual(agent.get_next_action(), (0, 2))
+
+        with self.assertRaises(ValueError):
+            gpa.MonteCarloAgent(block, 200, rave=True, compact_tree=True)
+        with self.assertRaises(ValueError):
+            gpa.MonteCarloAgent(block, 200, rave=True, workers=2, parallelism='leaf')
+
+    def test_monte_carlo_node_budget(self):
+        block = TicTacToeGameState(board=[['X', 'X', ''], ['O', '', ''], ['', '', '']], current_player="O")
+        for compact_tree in (False, True):
+            agent = gpa.MonteCarloAgent(self.game, 2000, "X", seed=1, compact_tree=compact_tree, max_nodes=100)
+            agent.get_next_action()
+            # a tree is pruned after the rollout that takes it past the bound, which adds at most one child per action
+            self.assertLessEqual(agent.peak_tree_size, 100 + 9)
+            self.assertGreater(agent.peak_tree_size, 100)
+            self.assertLessEqual(agent.tree_size, 100)
+            self.assertEqual(sum(agent.visit_counts().values()), 2000)
+            if not compact_tree:
+                self.assertEqual(agent.root.count_nodes(), agent.tree_size)
+
+            agent = gpa.MonteCarloAgent(block, 500, "O", seed=1, compact_tree=compact_tree, exploration=1,
+                                        max_nodes=50)
+            self.assertEqual(agent.get_next_action(), (0, 2))
+            self.assertLessEqual(agent.tree_size, 50)
+
+        with self.assertRaises(ValueError):
+            gpa.MonteCarloAgent(self.game, 200, max_nodes=0)
+
+    def test_monte_carlo_dropped_states(self):
+        for compact_tree in (False, True):
+            x_agent = gpa.MonteCarloAgent(self.game, 1000, "X", seed=1, compact_tree=compact_tree, keep_states=False)
+            kept = gpa.MonteCarloAgent(self.game, 1000, "X", seed=1, compact_tree=compact_tree)
+            self.assertEqual(x_agent.get_next_action(), kept.get_next_action())
+            self.assertEqual(x_agent.visit_counts(), kept.visit_counts())
+            if compact_tree:
+                tree = x_agent.root.tree
+                states = tree.states[:tree.size]
+            else:
+                nodes = [x_agent.root]
+                for node in nodes:
+                    nodes.extend(node.children)
+                states = [node._state for node in nodes]
+            self.assertIsNotNone(states[0])
+            self.assertTrue(any(state is None for state in states))
+
+            # reusing the tree rebuilds the state of the new root
+            o_agent = gpa.RandomAgent(self.game, "O")
+            self.assertNotEqual(self.play_game(x_agent, o_agent), "O")
+            self.game = TicTacToeGameState()
+
+    def test_encode_decode(self):
+        state = TicTacToeGameState(4).get_next_state((1, 2)).get_next_state((3, 0))
+        self.assertTrue(state.supports_encode)
+        self.assertEqual(len(state.encode()), 8 + 2 + 16)
+        decoded = TicTacToeGameState.decode(state.encode())
+        self.assertEqual(decoded, state)
+        self.assertEqual(hash(decoded), hash(state))
+        self.assertEqual(decoded.active_player, "X")
+
+    def test_shared_state_batch(self):
+        states = [self.game, self.game.get_next_state((0, 0)), TicTacToeGameState(4)]
+        with gpa.SharedStateBatch(4, 64, ("X", "O")) as shared_batch:
+            shared_batch.write_states(states)
+            attached = gpa.SharedStateBatch(0, 0, (), shared_batch.name)
+            self.assertEqual(attached.players, ("X", "O"))
+            self.assertEqual([attached.state(index, TicTacToeGameState) for index in range(3)], states)
+            attached.write_result(1, {"X": 1, "O": -1})
+            attached.close()
+            self.assertEqual(shared_batch.result(1), {"X": 1.0, "O": -1.0})
+            self.assertEqual(shared_batch.result(0), {"X": 0.0, "O": 0.0})
+            with self.assertRaises(ValueError):
+                shared_batch.write_states(states * 2)
+
+        with gpa.SharedStateBatch(1, 32, ("X", "O"), result_rows=3) as shared_batch:
+            shared_batch.write_states([self.game])
+            shared_batch.write_result(2, {"X": 0.5, "O": 0.5})
+            attached = gpa.SharedStateBatch(0, 0, (), shared_batch.name)
+            self.assertEqual(attached.result(2), {"X": 0.5, "O": 0.5})
+            self.assertEqual(attached.state(0, TicTacToeGameState), self.game)
+            attached.close()
+
+    def test_leaf_parallel_shared_memory(self):
+        block = TicTacToeGameState(board=[['X', 'X', ''], ['O', '', ''], ['', '', '']], current_player="O")
+        visit_counts = []
+        for shared_memory in (False, True):
+            with gpa.MonteCarloAgent(block, 200, "O", seed=1, workers=2, parallelism='leaf',
+                                     shared_memory=shared_memory) as agent:
+                self.assertEqual(agent.get_next_action(), (0, 2))
+                visit_counts.append(agent.visit_counts())
+                if shared_memory:
+                    # the leaf state is held once, with a result row per worker
+                    self.assertEqual(agent._shared_batch.capacity, 1)
+                    self.assertEqual(len(agent._shared_batch.results), 2)
+        # the same simulations, whether the states are pickled or encoded
+        self.assertEqual(visit_counts[0], visit_counts[1])
+
+    def test_monte_carlo_draws_minimax(self):
+        x_agent = gpa.MonteCarloAgent(self.game, 2000, "X", seed=1)
+        o_agent = gpa.MiniMaxAgent(self.game, 10, "O")
+        self.assertEqual(self.play_game(x_agent, o_agent), "")
+
+    def test_batch_state_matches_game_state(self):
+        game = TicTacToeGameState(4)
+        batch = game.to_batch(1)
+        rng = np.random.default_rng(0)
+        while not game.is_terminal:
+            self.assertFalse(batch.is_terminal[0])
+            mask = batch.legal_action_mask()[0]
+            self.assertEqual(sorted(divmod(int(action), 4) for action in np.flatnonzero(mask)), game.legal_actions)
+            action = batch.random_actions(rng)
+            game = game.get_next_state(divmod(int(action[0]), 4))
+            batch.step(action)
+        self.assertTrue(batch.is_terminal[0])
+        self.assertEqual(dict(zip(batch.players, batch.utility[0])), game.utility)
+
+    def test_batched_monte_carlo(self):
+        for compact_tree in (False, True):
+            win = TicTacToeGameState(board=[['X', 'X', ''], ['O', 'O', ''], ['', '', '']], current_player="X")
+            agent = gpa.MonteCarloAgent(win, 640, "X", seed=1, batch_size=32, compact_tree=compact_tree)
+            self.assertEqual(agent.get_next_action(), (0, 2))
+            self.assertEqual(agent.root.n, 640)
+
+    def test_batched_parallel_monte_carlo(self):
+        for parallelism in gpa.MonteCarloAgent.PARALLELISMS:
+            with gpa.MonteCarloAgent(self.game, 256, "X", workers=2, parallelism=parallelism, seed=1,
+                                     batch_size=16) as agent:
+                self.assertIn(agent.get_next_action(), self.game.legal_actions)
+                self.assertEqual(sum(agent.visit_counts().values()), 256)
+
+    def test_cached_state_properties(self):
+        self.assertIs(self.game.legal_actions, self.game.legal_actions)
+
+        # changing the state in place forgets the cached values
+        state = copy(self.game)
+        for action in [(0, 0), (1, 0), (0, 1), (1, 1), (0, 2)]:
+            self.assertFalse(state.is_terminal)
+            state.apply(action)
+        self.assertTrue(state.is_terminal)
+        self.assertEqual(state.utility, {"X": 1, "O": -1})
+        state.undo()
+        self.assertFalse(state.is_terminal)
+        self.assertEqual(state.utility, {"X": 0.5, "O": 0.5})
+        self.assertNotIn((0, 2), self.game.get_next_state((0, 2)).legal_actions)
+
+    def test_shared_evaluation_cache(self):
+        gpa.CachedGameState.evaluation_cache = gpa.EvaluationCache(max_entries=4)
+        try:
+            cache = gpa.CachedGameState.evaluation_cache
+            self.assertEqual(copy(self.game).utility, {"X": 0.5, "O": 0.5})
+            self.assertEqual(copy(self.game).utility, {"X": 0.5, "O": 0.5})
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+            x_agent = gpa.MiniMaxAgent(self.game, 3, "X")
+            x_agent.get_next_action()
+            self.assertEqual(len(cache), 4)
+            self.assertGreater(cache.hit_rate, 0)
+        finally:
+            gpa.CachedGameState.evaluation_cache = None
+
+    def test_zobrist_keys_are_stable(self):
+        self.assertEqual(gpa.ZobristHasher().key(('player', 'X')), 12066510522336213816)
+        self.assertNotEqual(gpa.ZobristHasher(seed=1).key(('player', 'X')), 12066510522336213816)
+        self.assertEqual(gpa.ZobristHasher().hash([(0, 0, 'X'), (1, 1, 'O')]),
+                         gpa.ZobristHasher().update(gpa.ZobristHasher().key((1, 1, 'O')), added=[(0, 0, 'X')]))
+
+        transposed = [self.game.get_next_state((0, 0)).get_next_state((1, 1)).get_next_state((2, 2)),
+                      self.game.get_next_state((2, 2)).get_next_state((1, 1)).get_next_state((0, 0))]
+        self.assertEqual(hash(transposed[0]), hash(transposed[1]))
+        self.assertEqual(hash(transposed[0]), hash(TicTacToeGameState(
+            board=[['X', '', ''], ['', 'O', ''], ['', '', 'X']], current_player="O")))
+        self.assertNotEqual(hash(transposed[0]), hash(TicTacToeGameState(
+            board=[['X', '', ''], ['', 'O', ''], ['', '', 'X']], current_player="X")))
+
+    def test_match_between_minimax_and_random(self):
+        output = io.StringIO()
+        summary = gpa.run_match(self.game, {'minimax': partial(gpa.MiniMaxAgent, depth=2), 'random': gpa.RandomAgent},
+                                20, workers=2, output=output)
+        records = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual(sorted(record['game'] for record in records), list(range(20)))
+        self.assertEqual(summary.games, 20)
+        self.assertEqual(summary.wins, sum(record['winner'] == 'minimax' for record in records))
+        self.assertEqual(summary.draws, sum(record['draw'] for record in records))
+        self.assertGreater(summary.score, 0.5)
+        low, high = summary.elo_interval()
+        self.assertLessEqual(low, summary.elo)
+        self.assertLessEqual(summary.elo, high)
+
+        # the agents swap seats every game, and the first player moves first
+        for record in records:
+            self.assertEqual(record['seats']['X'], 'minimax' if record['game'] % 2 == 0 else 'random')
+            self.assertEqual(record['movers'][0], 'X')
+            self.assertEqual(len(record['moves']), len(record['latencies']))
+
+    def test_match_is_reproducible(self):
+        factories = {'first': gpa.RandomAgent, 'second': gpa.RandomAgent}
+        output = [io.StringIO(), io.StringIO()]
+        for stream, workers in zip(output, (1, 2)):
+            gpa.run_match(self.game, factories, 6, workers=workers, output=stream, seed=5)
+        records = [sorted((json.loads(line) for line in stream.getvalue().splitlines()), key=lambda r: r['game'])
+                   for stream in output]
+        self.assertEqual([record['moves'] for record in records[0]], [record['moves'] for record in records[1]])
+
+    def test_unfinished_games_are_draws(self):
+        output = io.StringIO()
+        summary = gpa.run_match(self.game, {'first': gpa.RandomAgent, 'second': gpa.RandomAgent}, 4, workers=1,
+                                output=output, max_moves=2)
+        records = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual([(record['winner'], record['draw']) for record in records], [(None, True)] * 4)
+        self.assertEqual(summary.draws, 4)
+
+    def test_match_with_parallel_agents(self):
+        # the games run in worker processes, which start the agents' own worker pools
+        for factory in (partial(gpa.MonteCarloAgent, rollouts=20, workers=2),
+                        partial(gpa.MiniMaxAgent, depth=3, workers=2)):
+            summary = gpa.run_match(self.game, {'parallel': factory, 'random': gpa.RandomAgent}, 2, workers=2)
+            self.assertEqual(summary.games, 2)
+            self.assertGreater(summary.moves['parallel'], 0)
+
+    def test_elo_difference(self):
+        self.assertEqual(gpa.tournament.elo_difference(0.5), 0)
+        self.assertAlmostEqual(gpa.tournament.elo_difference(0.75), 190.85, places=2)
+        self.assertEqual(gpa.tournament.elo_difference(1), float('inf'))
+
+    def test_minimax_instrumentation(self):
+        agent = gpa.MiniMaxAgent(self.game, 4, "X")
+        plies = []
+        action, stats = agent.get_next_action_with_stats(on_node=lambda state, ply: plies.append(ply))
+        self.assertEqual(action, gpa.MiniMaxAgent(self.game, 4, "X").get_next_action())
+        self.assertEqual(stats.nodes, agent.nodes_searched)
+        self.assertEqual(len(plies), stats.nodes)
+        self.assertEqual(max(plies), 4)
+        self.assertEqual(stats.max_depth, 4)
+        self.assertGreater(stats.cutoffs, 0)
+        self.assertEqual(stats.state_calls['is_terminal'], stats.nodes)
+        self.assertGreater(stats.search_seconds, 0)
+        self.assertLess(sum(stats.state_seconds.values()), stats.seconds)
+
+        # the hooks are removed again afterwards
+        self.assertNotIn('search', agent.__dict__)
+        self.assertNotIsInstance(agent.current_state, gpa.TimedState)
+        agent.get_next_action()
+        self.assertEqual(len(plies), stats.nodes)
+
+    def test_monte_carlo_instrumentation(self):
+        for compact_tree in (False, True):
+            agent = gpa.MonteCarloAgent(self.game, 200, "X", seed=1, compact_tree=compact_tree)
+            rollouts = []
+            action, stats = agent.get_next_action_with_stats(on_rollout=lambda a: rollouts.append(a.rollouts_completed))
+            self.assertEqual(rollouts, list(range(1, 201)))
+            self.assertEqual(stats.rollouts, 200)
+            self.assertGreater(stats.tree_size, 9)
+            self.assertGreater(stats.max_depth, 1)
+            self.assertGreater(stats.state_calls['get_next_state'], 0)
+            self.assertIsNone(agent.on_rollout)
+
+            # the reused tree holds no timing proxies
+            next_state = self.game.get_next_state(action)
+            agent.update_state(next_state)
+            self.assertIsNotNone(agent.root)
+            self.assertNotIsInstance(agent.root.state, gpa.TimedState)
+            reply = next_state.legal_actions[0]
+            agent.update_state(next_state.get_next_state(reply))
+            agent.get_next_action()
+            self.assertEqual(len(rollouts), 200)
+
+    def test_instrumentation_with_workers(self):
+        # the timing proxy reaches the worker processes as the plain state, without the unpicklable callbacks
+        self.assertEqual(pickle.loads(pickle.dumps(gpa.TimedState(self.game, gpa.SearchStats(lambda s, p: None)))),
+                         self.game)
+        agents = [gpa.MonteCarloAgent(self.game, 40, "X", seed=1, workers=2),
+                  gpa.MonteCarloAgent(self.game, 40, "X", seed=1, workers=2, parallelism='leaf'),
+                  gpa.MiniMaxAgent(self.game, 3, "X", workers=2)]
+        for agent in agents:
+            with agent:
+                action, stats = agent.get_next_action_with_stats(on_node=lambda state, ply: None,
+                                                                 on_rollout=lambda a: None)
+                self.assertIn(action, self.game.legal_actions)
+
+    def test_tablebase_book(self):
+        entries = gpa.solved_entries(self.game, 9)
+        # every non-terminal position reachable from the empty board
+        self.assertEqual(len(entries), 4520)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'tic-tac-toe.book')
+            gpa.write_book(path, entries)
+            with gpa.OpeningBook(path) as book:
+                self.assertEqual(len(book), 4520)
+                self.assertIn(self.game, book)
+                self.assertNotIn(TicTacToeGameState(4).get_next_state((3, 3)), book)
+                self.assertIsNone(book.lookup(TicTacToeGameState(4).get_next_state((3, 3))))
+
+                for game in range(10):
+                    self.setUp()
+                    x_agent = gpa.BookAgent(gpa.RandomAgent(self.game, "X"), book)
+                    o_agent = gpa.RandomAgent(self.game, "O")
+                    self.assertIn(self.play_game(x_agent, o_agent), ["X", ""])
+                    self.assertEqual(x_agent.book_moves,
+                                     (len(self.game.board) ** 2 - len(self.game.legal_actions) + 1) // 2)
+
+                # perfect play against perfect play is a draw
+                self.setUp()
+                x_agent = gpa.BookAgent(gpa.RandomAgent(self.game, "X"), book)
+                o_agent = gpa.BookAgent(gpa.RandomAgent(self.game, "O"), pickle.loads(pickle.dumps(book)))
+                self.assertEqual(self.play_game(x_agent, o_agent), "")
+                o_agent.book.close()
+
+    def test_self_play_book(self):
+        entries = gpa.self_play_entries(self.game, gpa.RandomAgent, 50, plies=2)
+        self.assertEqual(len(set(entries)), len(entries))
+        # the empty board and some of the positions after X's first move
+        self.assertIn(gpa.opening_book.book_key(self.game), entries)
+        self.assertLessEqual(len(entries), 10)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'self-play.book')
+            gpa.write_book(path, entries)
+            with gpa.OpeningBook(path) as book:
+                self.assertIn(book.lookup(self.game), self.game.legal_actions)
+                agent = gpa.BookAgent(gpa.MiniMaxAgent(self.game, 2, "X"), book)
+                self.assertIn(agent.get_next_action(), self.game.legal_actions)
+                self.assertEqual(agent.book_moves, 1)
+
+                # the actions are passed on to an agent that reuses its tree with them, and dropped otherwise
+                searcher = gpa.MonteCarloAgent(self.game, 200, "X", seed=1)
+                agent = gpa.BookAgent(searcher, book)
+                state = self.game.get_next_state((1, 1))
+                searcher.get_next_action()
+                expected_visits = searcher.root.descendant([(1, 1)]).n
+                agent.update_state(state, actions=[(1, 1)])
+                self.assertEqual(searcher.root.n, expected_visits)
+                gpa.BookAgent(gpa.RandomAgent(self.game, "O"), book).update_state(state, actions=[(1, 1)])
+
+            for load_factor in (0, 1):
+                with self.assertRaises(ValueError):
+                    gpa.write_book(path, entries, load_factor)
+            # a table without an empty slot, which write_book never writes, still ends a lookup
+            book_format = gpa.opening_book
+            with open(path, 'wb') as file:
+                file.write(book_format.HEADER.pack(book_format.MAGIC, 2, 2) + book_format.SLOT.pack(2, 0)
+                           + book_format.SLOT.pack(3, 0))
+            with gpa.OpeningBook(path) as book:
+                self.assertEqual(book.lookup_key(3), 0)
+                self.assertIsNone(book.lookup_key(4))
+
+    def test_symmetric_states_share_canonical_hash(self):
+        board = [['X', 'O', ''], ['', 'X', ''], ['', '', '']]
+        rotated = [['', '', 'X'], ['', 'X', 'O'], ['', '', '']]
+        reflected = [['', 'O', 'X'], ['', 'X', ''], ['', '', '']]
+        state = TicTacToeGameState(board=board, current_player="O")
+        self.assertNotEqual(hash(state), hash(TicTacToeGameState(board=rotated, current_player="O")))
+        for other in (rotated, reflected):
+            self.assertEqual(state.canonical_hash(),
+                             TicTacToeGameState(board=other, current_player="O").canonical_hash())
+        self.assertNotEqual(state.canonical_hash(),
+                            TicTacToeGameState(board=board, current_player="X").canonical_hash())
+
+        # the symmetric keys are updated in place once computed
+        state.apply((2, 2))
+        self.assertEqual(state.symmetric_keys[0], hash(state))
+        # a copy computes them from its board
+        self.assertEqual(state.canonical_hash(), copy(state).canonical_hash())
+        state.undo()
+        self.assertEqual(state.canonical_hash(),
+                         TicTacToeGameState(board=reflected, current_player="O").canonical_hash())
+
+    def test_solver_plays_perfectly(self):
+        win = TicTacToeGameState(board=[['X', 'X', ''], ['O', 'O', ''], ['', '', '']], current_player="X")
+        self.assertEqual(gpa.SolverAgent(win).get_next_action(), (0, 2))
+        block = TicTacToeGameState(board=[['X', 'X', ''], ['O', '', ''], ['', '', '']], current_player="O")
+        self.assertEqual(gpa.SolverAgent(block).get_next_action(), (0, 2))
+
+        solver = gpa.SolverAgent(self.game, "X")
+        self.assertEqual(solver.value(self.game), 0)
+        self.assertEqual(solver.get_next_action(), (0, 0))
+        # transpositions and symmetries are solved once, out of 5478 reachable positions
+        self.assertLess(len(solver.table), 1000)
+
+        for game in range(10):
+            self.setUp()
+            x_agent = gpa.RandomAgent(self.game, "X")
+            # the table is from the active player's perspective, so it is shared between players
+            o_agent = gpa.SolverAgent(self.game, "O", table=solver.table)
+            self.assertIn(self.play_game(x_agent, o_agent), ["O", ""])
+
+        self.setUp()
+        self.assertEqual(self.play_game(gpa.SolverAgent(self.game, "X"), gpa.MiniMaxAgent(self.game, 9, "O")), "")
+
+    def test_solver_on_4x4(self):
+        solver = gpa.SolverAgent(TicTacToeGameState(4))
+        self.assertIn(solver.get_next_action(), TicTacToeGameState(4).legal_actions)
+        self.assertEqual(solver.value(TicTacToeGameState(4)), 0)
+
+    def test_solved_table_round_trip(self):
+        solver = gpa.SolverAgent(self.game)
+        action = solver.get_next_action()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'tic-tac-toe.solved')
+            gpa.write_solved_table(path, solver.table)
+            table = gpa.read_solved_table(path)
+            with open(os.path.join(directory, 'not-a-table'), 'wb') as file:
+                file.write(b'\0' * 32)
+            with self.assertRaises(ValueError):
+                gpa.read_solved_table(os.path.join(directory, 'not-a-table'))
+        self.assertEqual(table, solver.table)
+        reloaded = gpa.SolverAgent(self.game, table=table)
+        self.assertEqual(reloaded.get_next_action(), action)
+        # only the root's children are looked up
+        self.assertEqual(reloaded.nodes_searched, len(self.game.legal_actions))
+
+    def test_evaluate_children_matches_next_states(self):
+        boards = [[['X', 'X', ''], ['O', 'O', ''], ['', '', '']],
+                  [['X', 'O', 'X'], ['', 'O', ''], ['', '', '']],
+                  [['', 'O', 'X'], ['', 'X', 'O'], ['', '', '']]]
+        for board in boards:
+            for current_player in ("X", "O"):
+                state = TicTacToeGameState(board=board, current_player=current_player)
+                actions = state.legal_actions
+                for player in ("X", "O"):
+                    self.assertEqual(list(state.evaluate_children(actions, player)),
+                                     [state.get_next_state(action).utility[player] for action in actions])
+
+    def test_batched_leaves_choose_the_same_action(self):
+        for dimensions, depth in [(3, 9), (4, 3), (5, 3)]:
+            actions = [gpa.MiniMaxAgent(TicTacToeGameState(dimensions), depth, batch_leaves=batch_leaves,
+                                        transposition_table=gpa.TranspositionTable()).get_next_action()
+                       for batch_leaves in (False, True)]
+            self.assertEqual(actions[0], actions[1])
+
+        # an iterative deepening search still stops once the whole game has been searched
+        agent = gpa.MiniMaxAgent(TicTacToeGameState(), time_limit=60, batch_leaves=True)
+        agent.get_next_action()
+        self.assertFalse(agent.reached_depth_limit)
+        self.assertLess(agent.completed_depth, 10)
+
+    def test_concurrent_async_games(self):
+        async def play(game: int) -> str:
+            state = TicTacToeGameState()
+            agents = {"X": gpa.SimpleMaxAgent(state, "X"), "O": gpa.RandomAgent(state, "O")}
+            while not state.is_terminal:
+                action = await agents[state.active_player].aget_next_action()
+                state = state.get_next_state(action)
+                for agent in agents.values():
+                    agent.update_state(state)
+            return state.get_winner()
+
+        async def play_all() -> list[str]:
+            return await asyncio.gather(*(play(game) for game in range(200)))
+
+        winners = asyncio.run(play_all())
+        self.assertEqual(len(winners), 200)
+        self.assertTrue(set(winners) <= {"X", "O", ""})
+
+    def test_async_deadline_returns_best_action_so_far(self):
+        state = TicTacToeGameState(5)
+        agents = [gpa.MiniMaxAgent(state, 25), gpa.MiniMaxAgent(state, 25, time_limit=60),
+                  gpa.MonteCarloAgent(state, 10 ** 9, seed=0), gpa.SolverAgent(state)]
+
+        async def choose(agent: gpa.GameAgent):
+            return await agent.aget_next_action(deadline=asyncio.get_running_loop().time() + 0.2)
+
+        for agent in agents:
+            start = time.perf_counter()
+            self.assertIn(asyncio.run(choose(agent)), state.legal_actions)
+            self.assertLess(time.perf_counter() - start, 5)
+            self.assertFalse(agent.stop_requested)
+
+    def test_late_stop_does_not_stop_next_search(self):
+        agent = gpa.MonteCarloAgent(self.game, 50, "X", seed=0)
+        stop_event = threading.Event()
+        agent.get_next_action_until(stop_event)
+        # as when an asynchronous search returns just as its deadline passes
+        stop_event.set()
+        self.assertFalse(agent.stop_requested)
+        agent.get_next_action()
+        self.assertEqual(agent.rollouts_completed, 50)
+
+    def test_async_cancellation_stops_search(self):
+        agent = gpa.MiniMaxAgent(TicTacToeGameState(5), 25)
+
+        async def cancel_search() -> bool:
+            task = asyncio.create_task(agent.aget_next_action())
+            await asyncio.sleep(0.1)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            self.assertTrue(agent.stop_requested)
+            # the search notices the stop request and frees its thread
+            for _ in range(100):
+                if not agent.stop_requested:
+                    return True
+                await asyncio.sleep(0.05)
+            return False
+
+        self.assertTrue(asyncio.run(cancel_search()))